@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Benchmark: JSON row list (current /v1/query body) vs. Arrow IPC and Parquet.
+Reports payload size (raw and gzip) plus encode and decode time on synthetic
+rows shaped like chatbot.call_data. Requires pyarrow; pandas is optional and
+adds a "decode to DataFrame" column.
+
+Usage:
+    python -m benchmarks.bench_formats [--rows 100000] [--repeat 3]
+"""
+
+import argparse
+import gzip
+import json
+import random
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+
+from services import columnar
+
+try:
+    import pandas as pd
+except ImportError:  # optional
+    pd = None
+
+
+def build_rows(n: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    agents = [f"agent_{i:03d}" for i in range(40)]
+    start = datetime(2024, 1, 1)
+    return [
+        {
+            "id": i,
+            "call_id": f"CALL{i:07d}",
+            "tenant_id": rng.randint(1, 20),
+            "agent_name": rng.choice(agents),
+            "date": (start + timedelta(minutes=i)).date(),
+            "created_at": start + timedelta(minutes=i, seconds=rng.randint(0, 59)),
+            "duration": round(rng.uniform(10, 1800), 2),
+            "score": Decimal(rng.randint(0, 1000)) / 10,
+            "resolved": rng.random() < 0.7,
+        }
+        for i in range(n)
+    ]
+
+
+def _json_encode(rows, sql):
+    # what FastAPI does for QueryResponse: jsonable_encoder, then json
+    return json.dumps(jsonable_encoder({"sql": sql, "results": rows, "error": None})).encode()
+
+
+def _json_decode(body, to_frame):
+    results = json.loads(body)["results"]
+    return pd.DataFrame(results) if to_frame else results
+
+
+def _arrow_decode(body, to_frame):
+    table = columnar.pa.ipc.open_stream(body).read_all()
+    return table.to_pandas() if to_frame else table
+
+
+def _parquet_decode(body, to_frame):
+    table = columnar.pq.read_table(columnar.pa.BufferReader(body))
+    return table.to_pandas() if to_frame else table
+
+
+def _best(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark result encodings")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if not columnar.available():
+        raise SystemExit("pyarrow is not installed: pip install pyarrow")
+
+    sql = "SELECT * FROM chatbot.call_data"
+    rows = build_rows(args.rows)
+    formats = {
+        "json": (lambda: _json_encode(rows, sql), _json_decode),
+        "arrow": (lambda: columnar.encode(rows, "arrow", sql), _arrow_decode),
+        "parquet": (lambda: columnar.encode(rows, "parquet", sql), _parquet_decode),
+    }
+
+    print(f"{args.rows:,} rows, best of {args.repeat}")
+    header = f"{'format':<8} {'bytes':>12} {'gzip bytes':>12} {'encode ms':>10} {'decode ms':>10}"
+    if pd is not None:
+        header += f" {'to pandas ms':>13}"
+    print(header)
+    baseline = None
+    for name, (encode, decode) in formats.items():
+        encode_ms, body = _best(encode, args.repeat)
+        decode_ms, _ = _best(lambda: decode(body, False), args.repeat)
+        gz = len(gzip.compress(body, 6))
+        line = f"{name:<8} {len(body):>12,} {gz:>12,} {encode_ms:>10.1f} {decode_ms:>10.1f}"
+        if pd is not None:
+            frame_ms, _ = _best(lambda: decode(body, True), args.repeat)
+            line += f" {frame_ms:>13.1f}"
+        print(line)
+        if baseline is None:
+            baseline = (len(body), encode_ms)
+        else:
+            print(f"{'':<8} size x{len(body) / baseline[0]:.2f}, encode x{encode_ms / baseline[1]:.2f} vs json")
+
+
+if __name__ == "__main__":
+    main()
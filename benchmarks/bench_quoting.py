@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: single-pass token-based numeric-literal quoting vs. the
+previous four-regex implementation, on large multi-join queries.
+
+Usage:
+    python -m benchmarks.bench_quoting [--joins 12] [--predicates 60] [--repeat 200]
+"""
+
+import argparse
+import re
+import timeit
+
+from services.executor import _quote_numeric_literals
+
+TEXTUAL_TYPES = {"character varying", "text", "varchar", "bpchar", "uuid", "citext"}
+TABLE_ALIAS_RE = re.compile(
+    r"\b(from|join)\s+([a-zA-Z_][\w\.]*)(?:\s+(?:as\s+)?([a-zA-Z_][\w]*))?",
+    re.IGNORECASE,
+)
+EQUALITY_RE = re.compile(
+    r"(?P<left>(?:[a-zA-Z_][\w]*\.){0,2}\"?[a-zA-Z_][\w]*\"?)\s*=\s*(?P<literal>-?\d+)(?![\d\.])",
+    re.IGNORECASE,
+)
+EQUALITY_RE_REVERSED = re.compile(
+    r"(?P<literal>-?\d+)\s*=\s*(?P<right>(?:[a-zA-Z_][\w]*\.){0,2}\"?[a-zA-Z_][\w]*\"?)",
+    re.IGNORECASE,
+)
+IN_RE = re.compile(
+    r"(?P<col>(?:[a-zA-Z_][\w]*\.){0,2}\"?[a-zA-Z_][\w]*\"?)\s+IN\s*\((?P<values>[^)]+)\)",
+    re.IGNORECASE,
+)
+
+
+def _norm(token: str) -> str:
+    return token.strip().strip('"').lower()
+
+
+def _regex_quote(sql: str, metadata) -> str:
+    """The previous implementation, kept here only as the baseline."""
+    column_types, textual_index = metadata
+    alias_map = {}
+    for _, table, alias in TABLE_ALIAS_RE.findall(sql):
+        table_norm = _norm(table)
+        alias_map[table_norm] = table_norm
+        if "." in table_norm:
+            alias_map[table_norm.split(".")[-1]] = table_norm
+        if alias:
+            alias_map[_norm(alias)] = table_norm
+
+    def should_quote(identifier):
+        parts = [p for p in identifier.split(".") if p]
+        column = _norm(parts[-1])
+        owner = _norm(".".join(parts[:-1])) if len(parts) > 1 else None
+        if owner:
+            table_key = alias_map.get(owner, owner)
+            if table_key in column_types:
+                return column_types[table_key].get(column) in TEXTUAL_TYPES
+        candidates = textual_index.get(column, set())
+        if len(candidates) == 1:
+            return column_types.get(next(iter(candidates)), {}).get(column) in TEXTUAL_TYPES
+        return False
+
+    def eq(m):
+        if should_quote(m.group("left")):
+            return f"{m.group('left')} = '{m.group('literal')}'"
+        return m.group(0)
+
+    def eq_rev(m):
+        if should_quote(m.group("right")):
+            return f"'{m.group('literal')}' = {m.group('right')}"
+        return m.group(0)
+
+    def in_clause(m):
+        if not should_quote(m.group("col")) or "select" in m.group("values").lower():
+            return m.group(0)
+        parts = [p.strip() for p in m.group("values").split(",")]
+        parts = [f"'{p}'" if re.fullmatch(r"-?\d+", p) else p for p in parts]
+        return f"{m.group('col')} IN ({', '.join(parts)})"
+
+    sql = EQUALITY_RE.sub(eq, sql)
+    sql = EQUALITY_RE_REVERSED.sub(eq_rev, sql)
+    return IN_RE.sub(in_clause, sql)
+
+
+def build_case(joins: int, predicates: int):
+    """A wide star-join with many integer comparisons, half against text columns."""
+    column_types = {}
+    textual = {}
+    for t in range(joins + 1):
+        table = f"chatbot.t{t}"
+        cols = {"id": "integer", "parent_id": "integer"}
+        for c in range(30):
+            cols[f"c{t}_{c}"] = "text" if c % 2 else "integer"
+            if c % 2:
+                textual.setdefault(f"c{t}_{c}", set()).add(table)
+        column_types[table] = cols
+
+    select = ", ".join(f"t{t}.c{t}_{c}" for t in range(joins + 1) for c in range(4))
+    sql = f"SELECT {select}\nFROM chatbot.t0 AS t0\n"
+    for t in range(1, joins + 1):
+        sql += f"JOIN chatbot.t{t} t{t} ON t{t}.parent_id = t{t - 1}.id\n"
+    where = []
+    for p in range(predicates):
+        t = p % (joins + 1)
+        c = p % 30
+        if p % 5 == 0:
+            where.append(f"t{t}.c{t}_{c} IN ({p}, {p + 1}, {p + 2})")
+        elif p % 7 == 0:
+            where.append(f"{p} = t{t}.c{t}_{c}")
+        else:
+            where.append(f"t{t}.c{t}_{c} = {p}")
+    where.append("t0.c0_1 <> 'id = 1 -- not a predicate'")
+    sql += "WHERE " + "\n  AND ".join(where) + "\nORDER BY 1\nLIMIT 1000;"
+    metadata = (column_types, {k: frozenset(v) for k, v in textual.items()})
+    return sql, metadata
+
+
+def _time(fn, repeat: int, *args) -> float:
+    """Best-of-5 mean milliseconds per call (min filters scheduler noise)."""
+    runs = timeit.repeat(lambda: fn(*args), number=repeat, repeat=5)
+    return min(runs) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark numeric-literal quoting")
+    parser.add_argument("--joins", type=int, default=12)
+    parser.add_argument("--predicates", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    sql, metadata = build_case(args.joins, args.predicates)
+    print(f"query: {len(sql):,} chars, {args.joins} joins, {args.predicates} predicates")
+
+    token_out = _quote_numeric_literals(sql, metadata)
+    regex_out = _regex_quote(sql, metadata)
+    print(f"quoted literals: token {token_out.count(chr(39))}, regex {regex_out.count(chr(39))} (quote chars)")
+
+    token_ms = _time(_quote_numeric_literals, args.repeat, sql, metadata)
+    regex_ms = _time(_regex_quote, args.repeat, sql, metadata)
+    print(f"token quoting: {token_ms:8.3f} ms/query")
+    print(f"regex quoting: {regex_ms:8.3f} ms/query")
+    print(f"ratio (token / regex): {token_ms / regex_ms:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark: the old QueryResponse path (Pydantic validation of the row list,
+jsonable_encoder, json.dumps) vs. services.serialization (records straight to
+bytes), plus gzip/brotli compression cost and ratio, at 1k, 10k and 100k rows
+shaped like chatbot.call_data (datetime, Decimal and JSONB text columns).
+
+Usage:
+    python -m benchmarks.bench_serialization [--rows 1000 10000 100000] [--repeat 3]
+"""
+
+import argparse
+import gzip
+import json
+import random
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from benchmarks.bench_formats import _best, build_rows
+from core.config import settings
+from services import serialization
+
+
+class QueryResponse(BaseModel):
+    # same shape as main.QueryResponse
+    sql: str | None = None
+    params: list | None = None
+    results: list | None = None
+    error: str | None = None
+    next_token: str | None = None
+
+
+def with_json_columns(rows: list, seed: int = 11) -> list:
+    rng = random.Random(seed)
+    for row in rows:
+        # asyncpg returns json/jsonb as text unless a codec is registered
+        row["metadata"] = json.dumps({"sentiment": rng.choice(["pos", "neg", "neu"]), "tags": ["billing", "callback"]})
+        row["call_uuid"] = uuid.UUID(int=rng.getrandbits(128))
+    return rows
+
+
+def _pydantic_encode(payload):
+    # what FastAPI does for response_model=QueryResponse
+    model = QueryResponse.model_validate(payload)
+    return json.dumps(jsonable_encoder(model)).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON response serialization")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    encoder = "orjson" if serialization.orjson is not None else "json (orjson not installed)"
+    print(f"fast path encoder: {encoder}, best of {args.repeat}")
+    print(f"{'rows':>8} {'pydantic ms':>12} {'fast ms':>9} {'speedup':>8} {'bytes':>12} "
+          f"{'gzip ms':>8} {'gzip bytes':>11} {'br ms':>7} {'br bytes':>10}")
+    sql = "SELECT * FROM chatbot.call_data"
+    for n in args.rows:
+        rows = with_json_columns(build_rows(n))
+        payload = {"sql": sql, "params": None, "results": rows, "error": None, "next_token": None}
+        slow_ms, _ = _best(lambda: _pydantic_encode(payload), args.repeat)
+        fast_ms, body = _best(lambda: serialization.dumps(payload), args.repeat)
+        gz_ms, gz = _best(lambda: gzip.compress(body, settings.RESPONSE_GZIP_LEVEL), args.repeat)
+        line = (f"{n:>8,} {slow_ms:>12.1f} {fast_ms:>9.1f} {slow_ms / fast_ms:>7.1f}x {len(body):>12,} "
+                f"{gz_ms:>8.1f} {len(gz):>11,}")
+        if serialization.brotli is not None:
+            br_ms, br = _best(lambda: serialization.brotli.compress(body, quality=settings.RESPONSE_BROTLI_QUALITY), args.repeat)
+            line += f" {br_ms:>7.1f} {len(br):>10,}"
+        else:
+            line += f" {'-':>7} {'-':>10}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: token-based validator vs. the previous multi-pass regex validator.
+
+Usage:
+    python -m benchmarks.bench_validator [--joins 12] [--columns 400] [--repeat 200]
+"""
+
+import argparse
+import re
+import timeit
+
+from services.validator import compile_context, validate_sql
+
+
+def _regex_validate(sql: str, grounded_map: dict, relationships: list):
+    """The previous implementation, kept here only as the baseline."""
+    low = sql.lower()
+    for word in ["drop", "delete", "update", "insert", "alter", "truncate"]:
+        if re.search(rf"\b{word}\b", low):
+            return False, "Destructive SQL not allowed", None
+
+    table_cols = {}
+    all_cols = set()
+    fk_set = set()
+    for p_table, entry in grounded_map.items():
+        table = entry.get("matched_table")
+        cols = entry.get("available_columns", []) or []
+        if table:
+            table_cols[table.lower()] = {c.lower() for c in cols}
+            for c in cols:
+                all_cols.add(f"{table}.{c}".lower())
+    for rel in (relationships or []):
+        f_tbl, f_col = rel.get("from_table"), rel.get("from_column")
+        t_tbl, t_col = rel.get("to_table"), rel.get("to_column")
+        if f_tbl and f_col and t_tbl and t_col:
+            fk_set.add((f_tbl.lower(), f_col.lower(), t_tbl.lower(), t_col.lower()))
+            fk_set.add((t_tbl.lower(), t_col.lower(), f_tbl.lower(), f_col.lower()))
+
+    for tbl, col in re.findall(r"([a-zA-Z_][\w]*)\.([a-zA-Z_][\w]*)", sql):
+        if tbl.lower() in table_cols and col.lower() not in table_cols[tbl.lower()]:
+            return False, f"Column '{col}' not found in table '{tbl}'", None
+
+    on_pairs = re.findall(
+        r"on\s+([a-zA-Z_][\w]*)\.([a-zA-Z_][\w]*)\s*=\s*([a-zA-Z_][\w]*)\.([a-zA-Z_][\w]*)",
+        sql,
+        flags=re.I,
+    )
+    for l_tbl, l_col, r_tbl, r_col in on_pairs:
+        pair = (l_tbl.lower(), l_col.lower(), r_tbl.lower(), r_col.lower())
+        pair_rev = (r_tbl.lower(), r_col.lower(), l_tbl.lower(), l_col.lower())
+        if pair not in fk_set and pair_rev not in fk_set:
+            if l_tbl.lower() in table_cols or r_tbl.lower() in table_cols:
+                return False, f"Invalid join: {l_tbl}.{l_col} ↔ {r_tbl}.{r_col}", None
+    return True, "ok", None
+
+
+def build_case(joins: int, columns: int, extra_relationships: int):
+    grounded_map = {}
+    relationships = []
+    for t in range(joins + 1):
+        cols = ["id", "name", "created_at"] + [f"col_{c}" for c in range(40)]
+        if t:
+            cols.append("parent_id")
+            relationships.append(
+                {"from_table": f"schema_a.table_{t}", "from_column": "parent_id",
+                 "to_table": f"schema_a.table_{t - 1}", "to_column": "id"}
+            )
+        grounded_map[f"t{t}"] = {"matched_table": f"schema_a.table_{t}", "available_columns": cols}
+    for r in range(extra_relationships):
+        relationships.append(
+            {"from_table": f"other.table_{r}", "from_column": "fk_id",
+             "to_table": f"other.table_{r + 1}", "to_column": "id"}
+        )
+
+    select_list = ",\n  ".join(f"a{c % (joins + 1)}.col_{c % 40} AS out_{c}" for c in range(columns))
+    from_clause = "schema_a.table_0 a0\n" + "\n".join(
+        f"JOIN schema_a.table_{t} a{t} ON a{t}.parent_id = a{t - 1}.id" for t in range(1, joins + 1)
+    )
+    where = " AND ".join(
+        f"a{c % (joins + 1)}.col_{c % 40} IS NOT NULL" for c in range(columns // 4)
+    )
+    sql = (
+        f"SELECT\n  {select_list}\nFROM {from_clause}\n"
+        f"WHERE a0.created_at >= NOW() - INTERVAL '30 days' AND {where}\n"
+        f"ORDER BY a0.name LIMIT 100"
+    )
+    return sql, grounded_map, relationships
+
+
+def _time(fn, repeat: int, *args) -> float:
+    """Best-of-5 mean milliseconds per call (min filters scheduler noise)."""
+    runs = timeit.repeat(lambda: fn(*args), number=repeat, repeat=5)
+    return min(runs) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SQL validation")
+    parser.add_argument("--joins", type=int, default=12)
+    parser.add_argument("--columns", type=int, default=400)
+    parser.add_argument("--relationships", type=int, default=2000,
+                        help="Unrelated FK relationships in the database")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    sql, grounded_map, relationships = build_case(args.joins, args.columns, args.relationships)
+    print(f"SQL size: {len(sql)} chars, {args.joins} joins, {len(relationships)} relationships")
+    print("token validator:", validate_sql(sql, grounded_map, relationships)[:2])
+    print("regex validator:", _regex_validate(sql, grounded_map, relationships)[:2])
+
+    schema = {
+        "tables": {e["matched_table"]: e["available_columns"] for e in grounded_map.values()},
+        "relationships": relationships,
+    }
+    context = compile_context(schema, version="bench")
+
+    token_ms = _time(validate_sql, args.repeat, sql, grounded_map, relationships)
+    ctx_ms = _time(validate_sql, args.repeat, sql, grounded_map, relationships, context)
+    regex_ms = _time(_regex_validate, args.repeat, sql, grounded_map, relationships)
+    print(f"token validator:                    {token_ms:8.3f} ms/query")
+    print(f"token validator, compiled context:  {ctx_ms:8.3f} ms/query")
+    print(f"regex validator:                    {regex_ms:8.3f} ms/query")
+    print(f"ratio (token / regex): {token_ms / regex_ms:.2f}")
+    print(f"ratio (compiled context / regex): {ctx_ms / regex_ms:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,21 @@ from pydantic import ConfigDict
 
 class Settings(BaseSettings):
     DATABASE_URL: str  # Required: Set in .env file
+    # Optional per-db_id URLs as JSON, e.g. {"mydb": "postgresql://...", "sales": "postgresql://..."}
+    # db_ids not listed here use DATABASE_URL and share its pool.
+    DATABASE_URLS: dict[str, str] = {}
+    # db_id served by DATABASE_URL (schema refresher, pool warmup)
+    DEFAULT_DB_ID: str = "mydb"
     OPENAI_API_KEY: str | None = None
-    REFRESH_INTERVAL_SECONDS: int = 300
+    # unchanged schemas cost one fingerprint query per interval
+    REFRESH_INTERVAL_SECONDS: int = 60
+    # Push-based schema change detection: DDL event triggers NOTIFY a channel
+    # the refresher LISTENs on (installing the triggers needs superuser)
+    SCHEMA_EVENTS_ENABLED: bool = False
+    SCHEMA_EVENTS_INSTALL: bool = True
+    SCHEMA_EVENTS_CHANNEL: str = "gensql_schema_change"
+    SCHEMA_EVENTS_DEBOUNCE_SECONDS: float = 2.0
+    SCHEMA_EVENTS_POLL_INTERVAL_SECONDS: int = 900   # safety-net polling while events are on
     MAX_ROWS: int = 1000
     PSEUDO_SCHEMA_MODEL: str = "gpt-4o-mini"
     SQL_GENERATION_MODEL: str = "gpt-4o-mini"
@@ -12,6 +25,85 @@ class Settings(BaseSettings):
     TOP_K_GROUND: int = 5
     # Comma-separated list of schemas to introspect (empty = all non-system schemas)
     DATABASE_SCHEMAS: str = "public,chatbot"
+    # EXPLAIN-based dry run before executing generated SQL
+    DRY_RUN_ENABLED: bool = False
+    DRY_RUN_MAX_COST: float = 0       # planner total cost ceiling (0 = unlimited)
+    DRY_RUN_MAX_ROWS: float = 0       # estimated result rows ceiling (0 = unlimited)
+    # Per-db_id overrides as JSON, e.g. {"mydb": {"max_cost": 1e6, "max_rows": 50000}}
+    DRY_RUN_LIMITS: dict[str, dict[str, float]] = {}
+    # asyncpg connection pools, one per database
+    POOL_MIN_SIZE: int = 2
+    POOL_MAX_SIZE: int = 10
+    POOL_MAX_INACTIVE_LIFETIME: float = 300.0  # seconds before an idle connection is closed
+    POOL_MAX_QUERIES: int = 50000               # queries before a connection is replaced
+    POOL_ACQUIRE_TIMEOUT: float = 10.0          # seconds to wait for a free connection
+    # Per-db_id overrides as JSON, e.g. {"mydb": {"min_size": 5, "max_size": 40}}
+    POOL_SIZES: dict[str, dict[str, float]] = {}
+    # Read replicas per db_id as JSON, e.g. {"mydb": ["postgresql://...@replica1/db", ...]}
+    # Generated SELECTs go to the healthy replica with the fewest connections in
+    # use, or to the primary when none qualifies. Introspection stays on the primary.
+    READ_REPLICA_URLS: dict[str, list[str]] = {}
+    REPLICA_MAX_LAG_SECONDS: float = 30.0          # replicas further behind are skipped
+    REPLICA_HEALTH_INTERVAL_SECONDS: float = 10.0
+    REPLICA_HEALTH_TIMEOUT_SECONDS: float = 2.0
+    # Request deadlines: X-Request-Timeout header (seconds) or the default,
+    # capped at the max. Every LLM call and SQL statement gets the time left.
+    REQUEST_TIMEOUT_SECONDS: float = 90.0
+    REQUEST_TIMEOUT_MAX_SECONDS: float = 300.0
+    STATEMENT_TIMEOUT_MS: int = 60000  # upper bound per SQL statement
+    # Admission control for /v1/query, per tenant: "<database>/<tenant id>" from
+    # the question (or dashboard tenant_id), or the X-Tenant-ID header when a
+    # trusted proxy sets it; requests naming no tenant share an uncapped key
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_TRUST_TENANT_HEADER: bool = False
+    ADMISSION_MAX_CONCURRENT: int = 8             # queries in flight across all tenants
+    ADMISSION_TENANT_MAX_CONCURRENT: int = 3      # queries in flight per tenant
+    ADMISSION_MAX_QUEUED_PER_TENANT: int = 20     # beyond this, 429 immediately
+    ADMISSION_MAX_QUEUE_WAIT_SECONDS: float = 15.0
+    # Fair-queuing weights as JSON, e.g. {"mydb/7": 2, "mydb": 0.5} (default 1)
+    ADMISSION_WEIGHTS: dict[str, float] = {}
+    ADMISSION_MAX_TRACKED_TENANTS: int = 1000     # idle tenants' counters are dropped past this
+    # Rows fetched per server-side cursor round trip when streaming results
+    STREAM_PREFETCH: int = 500
+    # Paginated answers ("page_size" in the request): each open continuation
+    # token holds a cursor and a pool connection until exhausted or expired
+    PAGINATION_TTL_SECONDS: float = 300.0
+    PAGINATION_MAX_OPEN: int = 5
+    PAGINATION_MAX_PAGE_SIZE: int = 5000
+    # JSON responses larger than this are gzip/brotli compressed when the
+    # client accepts it (0 disables compression)
+    RESPONSE_COMPRESSION_MIN_BYTES: int = 4096
+    RESPONSE_GZIP_LEVEL: int = 5
+    RESPONSE_BROTLI_QUALITY: int = 4
+    # Promotion of recurring LLM answers into templates (data/templates/<db_id>.promoted.json)
+    PROMOTION_ENABLED: bool = True
+    PROMOTION_MIN_OCCURRENCES: int = 5          # same question shape -> same SQL shape
+    PROMOTION_MIN_DISTINCT_VALUES: int = 2      # ... for at least this many tenant/date values
+    PROMOTION_MIN_AGREEMENT: float = 0.8        # share of the shape's answers using that SQL
+    PROMOTION_REQUIRE_REVIEW: bool = False      # write new templates as pending until approved
+    PROMOTION_DEMOTE_AFTER_FAILURES: int = 3
+    PROMOTION_LOG_REPLAY_LINES: int = 50000     # log lines re-read at startup
+    PROMOTION_LOG_MAX_BYTES: int = 50_000_000   # query log rotated to <db_id>.jsonl.1 past this
+    # Per-tenant, per-day rollups of chatbot.call_data answering the built-in
+    # templates (needs CREATE rights on the primary to build ROLLUP_SCHEMA)
+    ROLLUP_ENABLED: bool = False
+    ROLLUP_SCHEMA: str = "rollup"
+    ROLLUP_REFRESH_INTERVAL_SECONDS: int = 60
+    ROLLUP_LOOKBACK_DAYS: int = 3               # recent days recomputed each pass (late rows)
+    # Per-day partial aggregates of the single-value templates, merged per range
+    DAY_CACHE_ENABLED: bool = True
+    DAY_CACHE_MAX_DAYS: int = 200000            # cached (db_id, tenant, day) entries, LRU
+    DAY_CACHE_MAX_RANGE_DAYS: int = 1000        # longer ranges run the template SQL
+    DAY_CACHE_SETTLE_DAYS: int = 4              # most recent days (today included) never cached:
+                                                # today plus the ROLLUP_LOOKBACK_DAYS of late rows
+    # Result cache (in-process TTL + LRU)
+    RESULT_CACHE_ENABLED: bool = True
+    RESULT_CACHE_TTL: float = 60.0                   # seconds, default for SQL and templates
+    RESULT_CACHE_HISTORICAL_TTL: float = 86400.0     # ranges that ended before DAY_CACHE_SETTLE_DAYS
+    RESULT_CACHE_MAX_ENTRIES: int = 1000
+    RESULT_CACHE_MAX_ROWS: int = 10000               # larger results are not cached
+    # Per-template TTLs as JSON, e.g. {"fatal_calls": 300, "agent_wise": 120}
+    RESULT_CACHE_TEMPLATE_TTLS: dict[str, float] = {}
 
     model_config = ConfigDict(
         env_file=".env",
@@ -20,12 +112,25 @@ class Settings(BaseSettings):
         extra="ignore"
     )
 
-    def get_asyncpg_dsn(self) -> str:
+    def get_asyncpg_dsn(self, db_id: str | None = None) -> str:
         """
-        Convert SQLAlchemy-style DATABASE_URL to asyncpg-compatible DSN.
+        Convert SQLAlchemy-style DATABASE_URL (or the db_id entry of
+        DATABASE_URLS) to asyncpg-compatible DSN.
         Removes the +asyncpg driver specification.
         """
-        dsn = self.DATABASE_URL
+        dsn = self.DATABASE_URLS.get(db_id, self.DATABASE_URL) if db_id else self.DATABASE_URL
+        return self._asyncpg_dsn(dsn)
+
+    def database_ids(self) -> list[str]:
+        """db_ids with a database of their own: DEFAULT_DB_ID plus the DATABASE_URLS keys."""
+        return list(dict.fromkeys([self.DEFAULT_DB_ID, *self.DATABASE_URLS]))
+
+    def replica_dsns(self, db_id: str | None = None) -> list[str]:
+        """asyncpg DSNs of the read replicas of db_id (DEFAULT_DB_ID when None)."""
+        return [self._asyncpg_dsn(dsn) for dsn in self.READ_REPLICA_URLS.get(db_id or self.DEFAULT_DB_ID, [])]
+
+    @staticmethod
+    def _asyncpg_dsn(dsn: str) -> str:
         # Replace postgresql+asyncpg:// with postgresql://
         if dsn.startswith("postgresql+asyncpg://"):
             dsn = dsn.replace("postgresql+asyncpg://", "postgresql://", 1)
@@ -34,4 +139,22 @@ class Settings(BaseSettings):
             dsn = dsn.replace("postgres+asyncpg://", "postgresql://", 1)
         return dsn
 
+    def dry_run_limits(self, db_id: str) -> tuple[float, float]:
+        """(max_cost, max_rows) for db_id; 0 means no limit."""
+        limits = self.DRY_RUN_LIMITS.get(db_id, {})
+        return (
+            limits.get("max_cost", self.DRY_RUN_MAX_COST),
+            limits.get("max_rows", self.DRY_RUN_MAX_ROWS),
+        )
+
+    def pool_options(self, db_id: str) -> dict:
+        """asyncpg.create_pool keyword arguments for db_id."""
+        sizes = self.POOL_SIZES.get(db_id, {})
+        return {
+            "min_size": int(sizes.get("min_size", self.POOL_MIN_SIZE)),
+            "max_size": int(sizes.get("max_size", self.POOL_MAX_SIZE)),
+            "max_inactive_connection_lifetime": self.POOL_MAX_INACTIVE_LIFETIME,
+            "max_queries": self.POOL_MAX_QUERIES,
+        }
+
 settings = Settings()
@@ -0,0 +1,39 @@
+# core/deadline.py
+"""
+Per-request deadline carried in a context variable, so every pipeline stage
+(LLM calls, DB statements) can size its own timeout from the time left.
+asyncio tasks inherit the context, so work spawned for a request sees it too.
+"""
+import time
+from contextvars import ContextVar, Token
+from typing import Optional
+
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time before this stage could start."""
+
+
+def set_deadline(seconds: float) -> Token:
+    return _deadline.set(time.monotonic() + seconds)
+
+
+def reset(token: Token):
+    _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the current request, or None when no deadline is set."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check(stage: str) -> Optional[float]:
+    """Raise DeadlineExceeded if time is up; otherwise return the seconds left."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Request deadline exceeded before {stage}")
+    return left
@@ -1,7 +1,9 @@
 # Handles your custom LLM endpoint as an OpenAI-compatible client
-from openai import OpenAI
+from openai import AsyncOpenAI
 
-LLM_API_1 = OpenAI(
+# Async client: awaiting a completion can be cancelled, which aborts the
+# underlying HTTP request when the request deadline expires.
+LLM_API_1 = AsyncOpenAI(
     api_key="sandlogic",     # your key
     base_url="http://45.194.2.204:3535/v1"   # custom LLM server
 )
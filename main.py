@@ -1,46 +1,375 @@
 # main.py
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 import asyncio
+from datetime import date
+from urllib.parse import quote
+from core import deadline
 from core.config import settings
-from services import pseudo_schema, grounding, sql_generator, validator, executor, query_templates
+from services import pseudo_schema, grounding, sql_generator, validator, executor, query_templates, sql_repair, streaming, columnar, result_cache, pagination, serialization, admission, template_promotion, rollups, dashboard, day_cache
 from workers import refresh_scheduler
 
 app = FastAPI(title="Gen-SQL Backend (Real LLMs)")
 
+DISCONNECT_POLL_SECONDS = 0.5
+# header values must be latin-1: the SQL keeps printable ASCII, everything else
+# (and "%") is percent-encoded (UTF-8), so clients can always unquote it
+SQL_HEADER_SAFE = "".join(chr(c) for c in range(0x20, 0x7f) if chr(c) != "%")
+
 @app.on_event("startup")
 async def startup():
+    # open connection pools before the first request arrives
+    await executor.warmup_pools()
+    if settings.READ_REPLICA_URLS:
+        asyncio.create_task(executor.monitor_replicas())
+    asyncio.create_task(pagination.reaper())
     # start schema refresh worker in background
     asyncio.create_task(refresh_scheduler.background_refresh())
+    if settings.SCHEMA_EVENTS_ENABLED:
+        asyncio.create_task(refresh_scheduler.schema_event_listener())
+    if settings.ROLLUP_ENABLED:
+        asyncio.create_task(refresh_scheduler.rollup_refresh())
+
+@app.on_event("shutdown")
+async def shutdown():
+    await executor.close_pools()
 
 @app.get("/health/ready")
 async def health_ready():
     return {"status":"ready"}
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "sql_repair": sql_repair.stats(),
+        "pools": executor.pool_stats(),
+        "replicas": executor.replica_stats(),
+        "prepared_statements": executor.statement_stats(),
+        "admission": admission.stats(),
+        "result_cache": result_cache.stats(),
+        "template_promotion": template_promotion.stats(),
+        "pagination": pagination.stats(),
+        "rollups": rollups.stats(),
+        "day_cache": day_cache.stats(),
+        "schema_refresh": refresh_scheduler.stats(),
+    }
+
 class QueryRequest(BaseModel):
     db_id: str
     question: str
+    # stream rows from a server-side cursor instead of buffering the result
+    # (also enabled by "Accept: application/x-ndjson")
+    stream: bool = False
+    # return the full (un-LIMITed) answer in pages of this many rows; follow
+    # next_token with GET /v1/query/pages/{token}
+    page_size: int | None = None
 
 class QueryResponse(BaseModel):
     sql: str | None = None
+    # values bound to $n placeholders (template queries)
+    params: list | None = None
     results: list | None = None
     error: str | None = None
+    # continuation token for the next page (paginated requests only)
+    next_token: str | None = None
+
+def _local_repair(sql, grounded_map, relationships, validation_ctx):
+    """
+    Try the deterministic repair rules before paying for an LLM round trip.
+    Returns the repaired SQL when it passes validation, otherwise None.
+    """
+    fixed = sql_repair.repair_sql(sql, grounded_map, validation_ctx)
+    if fixed is None:
+        sql_repair.record_outcome(False)
+        return None
+    ok, msg, repaired = validator.validate_sql(fixed, grounded_map, relationships, validation_ctx)
+    print("Local repair validation result:", ok, msg)
+    sql_repair.record_outcome(ok)
+    return (repaired or fixed) if ok else None
+
+def _response_format(accept: str) -> str:
+    """json | ndjson | arrow | parquet, negotiated from the Accept header."""
+    if streaming.NDJSON_MEDIA_TYPE in accept:
+        return "ndjson"
+    fmt = columnar.negotiate(accept)
+    if fmt and not columnar.available():
+        raise HTTPException(status_code=406, detail=f"{fmt} responses require pyarrow to be installed")
+    return fmt or "json"
+
+async def _execute(sql, db_id, fmt, stream, enforce_limit=True, params=None, statement=None, to_date=None, page_size=None):
+    """
+    Buffered rows, raw records for columnar formats, an open cursor stream
+    whose first batch is already fetched, or the first pagination.Page.
+    Buffered results go through the result cache; to_date lets finished date
+    ranges be cached longer.
+    """
+    kwargs = {"enforce_limit": enforce_limit, "params": params, "statement": statement}
+    if page_size:
+        # the slot is released with the response; each later page is admitted again
+        return await pagination.first_page(sql, db_id, page_size, params=params, statement=statement)
+    if stream:
+        return await executor.open_stream(sql, db_id, **kwargs)
+    records = result_cache.get(db_id, sql, params, template=statement)
+    if records is None:
+        records = await executor.fetch_records(sql, db_id, **kwargs)
+        result_cache.put(db_id, sql, params, records, result_cache.ttl_for(statement, to_date))
+    # columnar encoders and the JSON serializer both take records as they are
+    return records
+
+def _encoded_response(sql, rows, fmt, stream, params=None, accept_encoding=""):
+    """
+    Response for the negotiated format. Plain JSON has the QueryResponse shape
+    but is encoded straight from the records, without per-row validation.
+    """
+    if isinstance(rows, pagination.Page):
+        payload = {"sql": sql, "params": params, "results": rows.rows, "error": None, "next_token": rows.next_token}
+        return serialization.json_response(payload, accept_encoding)
+    # outside the JSON document the SQL travels in a header
+    headers = {"X-Generated-SQL": quote(" ".join(sql.split()), safe=SQL_HEADER_SAFE)}
+    if fmt == "ndjson" or stream:
+        # the stream holds its connection, and the admission slot, until it ends
+        release = admission.hold()
+        background = BackgroundTask(release) if release else None
+        if fmt == "ndjson":
+            return StreamingResponse(
+                streaming.ndjson_rows(rows), media_type=streaming.NDJSON_MEDIA_TYPE, headers=headers, background=background
+            )
+        return StreamingResponse(streaming.json_document(sql, rows), media_type="application/json", background=background)
+    if fmt in columnar.CONTENT_TYPES:
+        body = columnar.encode(rows, fmt, sql)
+        return Response(content=body, media_type=columnar.CONTENT_TYPES[fmt], headers=headers)
+    payload = {"sql": sql, "params": params, "results": rows, "error": None, "next_token": None}
+    return serialization.json_response(payload, accept_encoding)
+
+def _tenant(request: Request, db_id: str, tenant_id: str | None = None) -> tuple[str, bool]:
+    """
+    Admission (key, capped): the X-Tenant-ID header only when a trusted proxy
+    sets it (ADMISSION_TRUST_TENANT_HEADER); otherwise the tenant id the query
+    is about, within the db_id's configured database, so made-up db_ids
+    cannot mint new tenants. Requests naming no tenant share one key per
+    database, which only counts against the global limit.
+    """
+    if settings.ADMISSION_TRUST_TENANT_HEADER and request.headers.get("x-tenant-id"):
+        return request.headers["x-tenant-id"], True
+    database = db_id if db_id in settings.database_ids() else settings.DEFAULT_DB_ID
+    if tenant_id and tenant_id.isdigit():
+        return f"{database}/{tenant_id}", True
+    return database, False
+
+def _request_timeout(request: Request) -> float:
+    """X-Request-Timeout header (seconds) or the configured default, capped."""
+    header = request.headers.get("x-request-timeout")
+    try:
+        timeout = float(header) if header else settings.REQUEST_TIMEOUT_SECONDS
+    except ValueError:
+        raise HTTPException(status_code=400, detail="X-Request-Timeout must be a number of seconds")
+    if timeout <= 0:
+        raise HTTPException(status_code=400, detail="X-Request-Timeout must be positive")
+    return min(timeout, settings.REQUEST_TIMEOUT_MAX_SECONDS)
+
+async def _client_disconnected(request: Request):
+    while not await request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+async def _run_until_deadline(work, request: Request, timeout: float):
+    """
+    Run the pipeline until it finishes, the deadline passes or the client goes
+    away. In the last two cases the pipeline task is cancelled: the pending
+    LLM HTTP call is aborted and asyncpg cancels the running statement.
+    """
+    task = asyncio.create_task(work)
+    watcher = asyncio.create_task(_client_disconnected(request))
+    try:
+        # time spent queueing for admission has already used part of the deadline
+        left = deadline.remaining()
+        budget = timeout if left is None else max(left, 0)
+        done, _ = await asyncio.wait({task, watcher}, timeout=budget, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+    if task in done:
+        return task.result()
+    task.cancel()
+    # let cancellation unwind so connections go back to the pool
+    await asyncio.gather(task, return_exceptions=True)
+    if watcher in done:
+        print("Client disconnected, request abandoned")
+        raise HTTPException(status_code=499, detail="Client closed request")
+    print(f"Request deadline of {timeout:g}s exceeded, work cancelled")
+    raise HTTPException(status_code=504, detail=f"Request deadline of {timeout:g}s exceeded")
 
 @app.post("/v1/query", response_model=QueryResponse)
-async def query(req: QueryRequest):
+async def query(req: QueryRequest, request: Request):
     print(">>> /v1/query request received", req.model_dump())
+    fmt = _response_format(request.headers.get("accept", ""))
+    timeout = _request_timeout(request)
+    tenant, capped = _tenant(request, req.db_id, query_templates._extract_tenant(req.question))
+    token = deadline.set_deadline(timeout)
+    try:
+        # queueing for a slot counts against the request deadline
+        async with admission.admit(tenant, max_wait=timeout, capped=capped):
+            accept_encoding = request.headers.get("accept-encoding", "")
+            return await _run_until_deadline(_answer(req, fmt, accept_encoding), request, timeout)
+    except admission.Rejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except deadline.DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    finally:
+        deadline.reset(token)
+
+class DashboardRequest(BaseModel):
+    db_id: str
+    tenant_id: str | None = None
+    from_date: str | None = None
+    to_date: str | None = None
+    # alternatively taken from a question, as for templates
+    question: str | None = None
+    # template names (default: every single-value template)
+    metrics: list[str] | None = None
+
+@app.post("/v1/dashboard")
+async def dashboard_metrics(req: DashboardRequest, request: Request):
+    """Every requested count/average template for one tenant and date range, in one statement."""
+    try:
+        names = dashboard.resolve(req.metrics)
+    except dashboard.UnknownMetric as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    ctx = query_templates._build_context(req.question or "")
+    params = [req.tenant_id or ctx.tenant_id, req.from_date or ctx.from_date, req.to_date or ctx.to_date]
+    missing = [name for name, value in zip(query_templates.PARAM_NAMES, params) if value is None]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Dashboard needs {', '.join(missing)}")
+    for name, value in zip(query_templates.PARAM_NAMES[1:], params[1:]):
+        try:
+            date.fromisoformat(value)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"{name} must be a YYYY-MM-DD date")
+
+    timeout = _request_timeout(request)
+    tenant, capped = _tenant(request, req.db_id, params[0])
+    sql = dashboard.build_sql(names, req.db_id)
+    token = deadline.set_deadline(timeout)
+    try:
+        async with admission.admit(tenant, max_wait=timeout, capped=capped):
+            values = None
+            if settings.DAY_CACHE_ENABLED and not rollups.metrics_sql(names, req.db_id):
+                values = await _run_until_deadline(day_cache.aggregate(names, req.db_id, *params), request, timeout)
+            if values is None:
+                work = _execute(
+                    sql, req.db_id, "json", False, enforce_limit=False, params=params,
+                    statement=dashboard.statement_name(sql), to_date=params[2],
+                )
+                records = await _run_until_deadline(work, request, timeout)
+                values = dict(records[0]) if records else {}
+    except admission.Rejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except deadline.DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        deadline.reset(token)
+    payload = {"sql": sql, "params": params, "metrics": values}
+    return serialization.json_response(payload, request.headers.get("accept-encoding", ""))
+
+@app.post("/v1/cache/{db_id}/days/invalidate")
+async def invalidate_day_cache(db_id: str, tenant_id: str | None = None, since: str | None = None):
+    """Drop cached per-day aggregates (e.g. after back-filling old rows), optionally from `since` on."""
+    try:
+        since_date = date.fromisoformat(since) if since else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since must be a YYYY-MM-DD date")
+    return {"invalidated": day_cache.invalidate(db_id, tenant_id, since_date)}
+
+@app.get("/v1/query/pages/{token}", response_model=QueryResponse)
+async def query_page(token: str, request: Request):
+    """Next page of a paginated answer; next_token is null on the last page."""
+    # admitted under the tenant of the request that opened the cursor
+    tenant, capped = pagination.tenant_of(token) or (settings.DEFAULT_DB_ID, False)
+    try:
+        async with admission.admit(tenant, capped=capped):
+            sql, page = await pagination.next_page(token)
+    except admission.Rejected as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except pagination.TokenExpired as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return _encoded_response(sql, page, "json", False, accept_encoding=request.headers.get("accept-encoding", ""))
+
+@app.delete("/v1/query/pages/{token}")
+async def close_query_pages(token: str):
+    """Release the cursor behind a continuation token before it expires."""
+    if not await pagination.close(token):
+        raise HTTPException(status_code=404, detail="Continuation token is unknown or has expired")
+    return {"closed": True}
+
+@app.get("/v1/templates/{db_id}/promoted")
+async def promoted_templates(db_id: str):
+    """Templates promoted from recurring LLM answers: active, pending review and demoted."""
+    return {"templates": template_promotion.list_promoted(db_id)}
+
+@app.post("/v1/templates/{db_id}/promoted/{name}/approve")
+async def approve_promoted_template(db_id: str, name: str):
+    if not await template_promotion.approve(db_id, name):
+        raise HTTPException(status_code=404, detail=f"No promoted template '{name}' for '{db_id}'")
+    return {"name": name, "status": "active"}
+
+@app.delete("/v1/templates/{db_id}/promoted/{name}")
+async def demote_promoted_template(db_id: str, name: str):
+    if not await template_promotion.demote(db_id, name):
+        raise HTTPException(status_code=404, detail=f"No promoted template '{name}' for '{db_id}'")
+    return {"name": name, "status": "demoted"}
+
+async def _answer(req: QueryRequest, fmt: str, accept_encoding: str = ""):
+    # columnar formats need the whole result (Parquet writes a footer)
+    stream = fmt == "ndjson" or (req.stream and fmt == "json")
+    # pages are plain JSON documents
+    page_size = req.page_size if fmt == "json" and not stream else None
+    if req.page_size is not None and req.page_size < 1:
+        raise HTTPException(status_code=400, detail="page_size must be positive")
 
     # 0. Template shortcuts for frequently asked questions
-    template_sql = query_templates.match_template(req.question)
-    if template_sql:
-        print("Matched template SQL:", template_sql)
+    template = query_templates.match_template(req.question, req.db_id)
+    if template:
+        print("Matched template SQL:", template.name, template.sql, template.params)
+        if template.missing:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Template '{template.name}' needs {', '.join(template.missing)} in the question",
+            )
+        # finished days come from the pre-aggregated rollups when they are ready
+        sql, statement = template.sql, template.name
+        rollup_sql = rollups.template_sql(template, req.db_id)
+        if rollup_sql:
+            sql, statement = rollup_sql, f"{template.name}@rollup"
+            rollups.record_answer()
         try:
-            rows = await executor.execute_sql(template_sql, req.db_id, enforce_limit=False)
-            return {"sql": template_sql, "results": rows, "error": None}
+            if (
+                rollup_sql is None and settings.DAY_CACHE_ENABLED and fmt == "json" and not stream
+                and not page_size and day_cache.supports(template.name) and query_templates.is_builtin(template)
+            ):
+                # merge cached per-day partials, computing only the missing days
+                rows = await day_cache.template_rows(template.name, req.db_id, template.params)
+                if rows is not None:
+                    return _encoded_response(sql, rows, fmt, stream, params=template.params, accept_encoding=accept_encoding)
+            rows = await _execute(
+                sql, req.db_id, fmt, stream,
+                enforce_limit=False, params=template.params, statement=statement,
+                to_date=template.to_date, page_size=page_size,
+            )
+            return _encoded_response(sql, rows, fmt, stream, params=template.params, accept_encoding=accept_encoding)
+        except deadline.DeadlineExceeded:
+            raise
         except Exception as e:
+            await template_promotion.record_template_result(req.db_id, template.name, False)
             raise HTTPException(status_code=500, detail=str(e))
 
     # 1. Load stored schema to provide table hints to pseudo-schema LLM
+    schema_version = grounding.schema_version(req.db_id)
     schema = grounding.load_schema(req.db_id)
     print("Loaded schema for", req.db_id, "with tables:", list(schema.get("tables", {}).keys()))
     table_hints = list(schema.get("tables", {}).keys()) if schema and schema.get("tables") else None
@@ -52,6 +381,8 @@ async def query(req: QueryRequest):
     # 3. Ground pseudo-schema to real schema (returns mapping + relationships)
     grounded_map, relationships = await grounding.ground(pseudo, req.db_id)
     print("Grounded schema. Relationships count:", len(relationships))
+    # compiled once per schema version, shared by every validation below
+    validation_ctx = validator.get_context(req.db_id, schema, schema_version)
 
     # 4. Generate SQL (LLM) using grounded_map + relationships
     sql = await sql_generator.generate_sql(req.question, grounded_map, relationships)
@@ -59,10 +390,13 @@ async def query(req: QueryRequest):
     print("Generated SQL:", sql)
 
     # 5. Validate SQL (pass relationships separately)
-    ok, msg, repaired_sql = validator.validate_sql(sql, grounded_map, relationships)
+    ok, msg, repaired_sql = validator.validate_sql(sql, grounded_map, relationships, validation_ctx)
     print("Validation result:", ok, msg)
 
     if not ok:
+        # Cheap local rules first, LLM regeneration only if they cannot fix it
+        final_sql = _local_repair(sql, grounded_map, relationships, validation_ctx)
+    if not ok and final_sql is None:
         # AUTO-REPAIR USING LLM (pass relationships)
         print("Validation failed, regenerating SQL with error")
         repaired_sql = await sql_generator.regenerate_sql_with_error(
@@ -74,7 +408,7 @@ async def query(req: QueryRequest):
         )
 
         # validate repaired SQL
-        ok2, msg2, repaired2 = validator.validate_sql(repaired_sql, grounded_map, relationships)
+        ok2, msg2, repaired2 = validator.validate_sql(repaired_sql, grounded_map, relationships, validation_ctx)
         print("Second validation result:", ok2, msg2)
         if not ok2:
             return {
@@ -84,42 +418,60 @@ async def query(req: QueryRequest):
             }
 
         final_sql = repaired_sql
+    elif not ok:
+        print("Validation failure fixed by local repair rules")
     else:
         final_sql = repaired_sql or sql
 
-    # 6. Execute SQL with automatic recovery attempt on runtime error
+    # 6. Execute SQL with automatic recovery attempt on runtime error.
+    #    The optional dry run surfaces planner errors and over-budget plans
+    #    cheaply, and feeds them into the same repair path.
     try:
+        if settings.DRY_RUN_ENABLED:
+            await executor.explain_sql(final_sql, req.db_id)
         print("Executing SQL:", final_sql)
-        rows = await executor.execute_sql(final_sql, req.db_id)
-        print("SQL executed, rows returned:", len(rows) if rows else 0)
+        rows = await _execute(final_sql, req.db_id, fmt, stream, page_size=page_size)
+        print("SQL executed, rows returned:", "streaming" if stream else "paginated" if page_size else len(rows) if rows else 0)
+    except deadline.DeadlineExceeded:
+        raise
     except Exception as e:
         # Attempt to auto-repair based on database error feedback
         print("Execution failed, attempting auto-repair:", e)
-        repair_sql = await sql_generator.regenerate_sql_with_error(
-            question=req.question,
-            grounded_map=grounded_map,
-            relationships=relationships,
-            bad_sql=final_sql,
-            error_message=str(e),
-        )
-        ok3, msg3, repaired3 = validator.validate_sql(repair_sql, grounded_map, relationships)
-        print("Repair validation result:", ok3, msg3)
-        if not ok3:
-            raise HTTPException(
-                status_code=400,
-                detail=f"{str(e)} | Auto-repair failed validation: {msg3}",
+        repair_final_sql = _local_repair(final_sql, grounded_map, relationships, validation_ctx)
+        if repair_final_sql is None:
+            repair_sql = await sql_generator.regenerate_sql_with_error(
+                question=req.question,
+                grounded_map=grounded_map,
+                relationships=relationships,
+                bad_sql=final_sql,
+                error_message=str(e),
             )
-        repair_final_sql = repaired3 or repair_sql
+            ok3, msg3, repaired3 = validator.validate_sql(repair_sql, grounded_map, relationships, validation_ctx)
+            print("Repair validation result:", ok3, msg3)
+            if not ok3:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"{str(e)} | Auto-repair failed validation: {msg3}",
+                )
+            repair_final_sql = repaired3 or repair_sql
         try:
+            if settings.DRY_RUN_ENABLED:
+                await executor.explain_sql(repair_final_sql, req.db_id)
             print("Executing repaired SQL")
-            rows = await executor.execute_sql(repair_final_sql, req.db_id)
+            rows = await _execute(repair_final_sql, req.db_id, fmt, stream, page_size=page_size)
             final_sql = repair_final_sql
             print("Repair execution succeeded")
+        except deadline.DeadlineExceeded:
+            raise
         except Exception as e2:
             raise HTTPException(
                 status_code=500,
                 detail=f"{str(e)} | Repair attempt failed: {str(e2)}",
             )
-    response = {"sql": final_sql, "results": rows, "error": None}
+    try:
+        # recurring question shapes become templates that skip the LLM
+        await template_promotion.record(req.db_id, req.question, final_sql)
+    except Exception as e:
+        print("Warning: could not record answer for template promotion:", e)
     print("Returning response")
-    return response
+    return _encoded_response(final_sql, rows, fmt, stream, accept_encoding=accept_encoding)
@@ -1 +1 @@
-from . import pseudo_schema, grounding, sql_generator, validator, executor, query_templates
+from . import pseudo_schema, grounding, sql_generator, validator, executor, query_templates, sql_repair, streaming, columnar, result_cache, catalog, pagination, serialization, admission, template_promotion, rollups, dashboard, day_cache
@@ -0,0 +1,238 @@
+# services/admission.py
+"""
+Admission control in front of /v1/query. Requests are keyed by tenant
+(chosen by the caller) and share ADMISSION_MAX_CONCURRENT slots:
+- per-tenant cap: no tenant holds more than ADMISSION_TENANT_MAX_CONCURRENT;
+  shared keys (capped=False, e.g. requests naming no tenant) only count
+  against the global limit
+- weighted fair queuing: waiting requests get a virtual finish tag
+  (start + 1/weight), and a free slot goes to the smallest tag whose tenant
+  is under its cap, so a burst from one tenant cannot starve the others
+- load shedding: a request that would wait longer than the budget, or finds
+  its tenant's queue full, is rejected with a Retry-After estimate
+
+A slot is held until the request's database work ends: a streamed response
+hold()s it and releases it when the stream closes.
+"""
+import asyncio
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from core.config import settings
+
+
+class Rejected(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass(order=True)
+class _Waiter:
+    finish: float
+    seq: int
+    tenant: str = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    capped: bool = field(compare=False, default=True)
+
+
+_waiters: List[_Waiter] = []
+_active: Dict[str, int] = {}
+_last_finish: Dict[str, float] = {}   # tenant -> finish tag of its last queued request
+_virtual_time = 0.0
+_seq = itertools.count()
+_service_ewma = 1.0                   # seconds a slot is typically held
+_tenant_stats: Dict[str, dict] = {}
+
+
+@dataclass
+class _Slot:
+    tenant: str
+    admitted: float
+    capped: bool = True
+    held: bool = False       # outlives the admit() block
+    released: bool = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            _release(self.tenant, time.monotonic() - self.admitted)
+
+
+_current: ContextVar[Optional[_Slot]] = ContextVar("admission_slot", default=None)
+
+
+def _forget_idle_tenants():
+    """Drop the oldest tenants without active or queued requests, down to the cap."""
+    busy = {w.tenant for w in _waiters} | {t for t, n in _active.items() if n}
+    for tenant in [t for t in _tenant_stats if t not in busy]:
+        if len(_tenant_stats) < settings.ADMISSION_MAX_TRACKED_TENANTS:
+            return
+        del _tenant_stats[tenant]
+        _active.pop(tenant, None)
+        _last_finish.pop(tenant, None)
+
+
+def _stats_for(tenant: str) -> dict:
+    stats = _tenant_stats.get(tenant)
+    if stats is None:
+        _forget_idle_tenants()
+        stats = _tenant_stats[tenant] = {
+            "admitted": 0,
+            "rejected": 0,
+            "wait_total_ms": 0.0,
+            "wait_max_ms": 0.0,
+        }
+    return stats
+
+
+def _weight(tenant: str) -> float:
+    return max(settings.ADMISSION_WEIGHTS.get(tenant, 1.0), 1e-3)
+
+
+def _total_active() -> int:
+    return sum(_active.values())
+
+
+def _under_cap(tenant: str) -> bool:
+    return _active.get(tenant, 0) < settings.ADMISSION_TENANT_MAX_CONCURRENT
+
+
+def _dispatch():
+    """Hand free slots to the waiters with the smallest finish tags."""
+    global _virtual_time
+    while _waiters and _total_active() < settings.ADMISSION_MAX_CONCURRENT:
+        eligible = [w for w in _waiters if not w.capped or _under_cap(w.tenant)]
+        if not eligible:
+            return
+        waiter = min(eligible)
+        _waiters.remove(waiter)
+        _virtual_time = max(_virtual_time, waiter.finish)
+        _active[waiter.tenant] = _active.get(waiter.tenant, 0) + 1
+        waiter.future.set_result(None)
+
+
+def _release(tenant: str, held: float):
+    global _service_ewma
+    _active[tenant] -= 1
+    _service_ewma = 0.9 * _service_ewma + 0.1 * held
+    _dispatch()
+
+
+def retry_after() -> int:
+    """Seconds until a retry is likely to be admitted, from queue depth and hold times."""
+    ahead = len(_waiters) + 1
+    estimate = _service_ewma * ahead / max(settings.ADMISSION_MAX_CONCURRENT, 1)
+    return max(1, min(60, math.ceil(estimate)))
+
+
+def _reject(tenant: str, reason: str):
+    _stats_for(tenant)["rejected"] += 1
+    seconds = retry_after()
+    print(f"Admission rejected for tenant '{tenant}': {reason}")
+    raise Rejected(f"Too many concurrent requests for '{tenant}': {reason}", seconds)
+
+
+def _record_wait(tenant: str, started: float):
+    waited_ms = (time.monotonic() - started) * 1000
+    stats = _stats_for(tenant)
+    stats["admitted"] += 1
+    stats["wait_total_ms"] += waited_ms
+    stats["wait_max_ms"] = max(stats["wait_max_ms"], waited_ms)
+
+
+@asynccontextmanager
+async def admit(tenant: str, max_wait: float | None = None, capped: bool = True):
+    """
+    Hold one query slot for `tenant` while the block runs. Raises Rejected
+    when the tenant's queue is full or no slot frees up within the budget
+    (ADMISSION_MAX_QUEUE_WAIT_SECONDS, or max_wait if smaller). With
+    capped=False the per-tenant concurrency and queue caps do not apply.
+    """
+    if not settings.ADMISSION_ENABLED:
+        yield
+        return
+    started = time.monotonic()
+    if not _waiters and (not capped or _under_cap(tenant)) and _total_active() < settings.ADMISSION_MAX_CONCURRENT:
+        _active[tenant] = _active.get(tenant, 0) + 1
+    else:
+        if capped and sum(1 for w in _waiters if w.tenant == tenant) >= settings.ADMISSION_MAX_QUEUED_PER_TENANT:
+            _reject(tenant, "queue is full")
+        start = max(_virtual_time, _last_finish.get(tenant, 0.0))
+        waiter = _Waiter(
+            start + 1.0 / _weight(tenant), next(_seq), tenant, asyncio.get_running_loop().create_future(), capped
+        )
+        _last_finish[tenant] = waiter.finish
+        _waiters.append(waiter)
+        _dispatch()
+        budget = settings.ADMISSION_MAX_QUEUE_WAIT_SECONDS
+        if max_wait is not None:
+            budget = min(budget, max_wait)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), budget)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter in _waiters:
+                _waiters.remove(waiter)
+                waiter.future.cancel()
+            else:
+                # granted just as we gave up: hand the slot on
+                _release(tenant, 0.0)
+            if isinstance(e, asyncio.TimeoutError):
+                _reject(tenant, f"no slot within {budget:g}s")
+            raise
+    _record_wait(tenant, started)
+    slot = _Slot(tenant, time.monotonic(), capped)
+    token = _current.set(slot)
+    completed = False
+    try:
+        yield
+        completed = True
+    finally:
+        _current.reset(token)
+        # a failed request hands nothing to the client that could hold the slot
+        if not (slot.held and completed):
+            slot.release()
+
+
+def hold() -> Optional[Callable[[], None]]:
+    """
+    Keep the current request's slot after its admit() block ends, for a
+    response that still uses a connection (a stream). Returns
+    the release callback, or None outside admission control.
+    """
+    slot = _current.get()
+    if slot is None:
+        return None
+    slot.held = True
+    return slot.release
+
+
+def current() -> Optional[tuple[str, bool]]:
+    """(tenant, capped) of the slot the current request holds, for admitting its follow-ups."""
+    slot = _current.get()
+    return None if slot is None else (slot.tenant, slot.capped)
+
+
+def stats() -> dict:
+    tenants = {}
+    for tenant in set(_tenant_stats) | set(_active):
+        s = _stats_for(tenant)
+        tenants[tenant] = {
+            **s,
+            "active": _active.get(tenant, 0),
+            "queued": sum(1 for w in _waiters if w.tenant == tenant),
+            "wait_avg_ms": s["wait_total_ms"] / s["admitted"] if s["admitted"] else 0.0,
+            "weight": _weight(tenant),
+        }
+    return {
+        "active": _total_active(),
+        "queued": len(_waiters),
+        "max_concurrent": settings.ADMISSION_MAX_CONCURRENT,
+        "service_time_ewma_s": _service_ewma,
+        "tenants": tenants,
+    }
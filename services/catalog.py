@@ -0,0 +1,286 @@
+# services/catalog.py
+"""
+One catalog snapshot per db_id: tables, columns, data types and foreign keys,
+read in a single introspection pass. The schema refresher produces snapshots;
+the executor (literal quoting), grounding and the validator read them.
+Publishing replaces the dict entry, so readers always see a complete snapshot.
+"""
+import hashlib
+import json
+import re
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Set
+
+from core.config import settings
+
+TEXTUAL_TYPES = {"character varying", "text", "varchar", "bpchar", "uuid", "citext"}
+
+_snapshots: Dict[str, "CatalogSnapshot"] = {}
+_rows: Dict[str, Dict[str, list]] = {}  # db_id -> schema -> column rows of the last introspection
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    version: str                                 # hash of schema + types, changes with any DDL we track
+    schema: dict                                 # {"tables": {table: [cols]}, "relationships": [...]}
+    column_types: Dict[str, Dict[str, str]]      # "schema.table" -> column -> data_type
+    textual_columns: Dict[str, FrozenSet[str]]   # column -> tables where it is textual
+
+
+def _display_table(schema_name: str, table_name: str) -> str:
+    # schema.table, except public tables which keep their bare name
+    return f"{schema_name}.{table_name}" if schema_name != "public" else table_name
+
+
+def _version(schema: dict, column_types: dict) -> str:
+    payload = json.dumps({"schema": schema, "types": column_types}, sort_keys=True)
+    return hashlib.md5(payload.encode()).hexdigest()
+
+
+def build_snapshot(column_rows, fk_rows) -> CatalogSnapshot:
+    """
+    column_rows: (table_schema, table_name, column_name, data_type, is_base_table),
+    ordered by table and ordinal position. fk_rows: one row per FK column
+    pair, in key order.
+    """
+    tables: Dict[str, List[str]] = {}
+    column_types: Dict[str, Dict[str, str]] = {}
+    textual: Dict[str, set] = {}
+    current = None
+    for r in column_rows:
+        # per-table work only when the table changes (rows come grouped)
+        key = (r["table_schema"], r["table_name"])
+        if key != current:
+            current = key
+            names = tables.setdefault(_display_table(*key), []) if r["is_base_table"] else None
+            full_table = f"{key[0]}.{key[1]}".lower()
+            types = column_types.setdefault(full_table, {})
+        if names is not None:
+            names.append(r["column_name"])
+        column = r["column_name"].lower()
+        data_type = r["data_type"].lower()
+        types[column] = data_type
+        if data_type in TEXTUAL_TYPES:
+            textual.setdefault(column, set()).add(full_table)
+
+    relationships = [
+        {
+            "from_table": _display_table(r["from_schema"], r["from_table"]),
+            "from_column": r["from_column"],
+            "to_table": _display_table(r["to_schema"], r["to_table"]),
+            "to_column": r["to_column"],
+            "constraint_name": r["constraint_name"],
+        }
+        for r in fk_rows
+    ]
+    schema = {"tables": tables, "relationships": relationships}
+    return CatalogSnapshot(
+        version=_version(schema, column_types),
+        schema=schema,
+        column_types=column_types,
+        textual_columns={col: frozenset(tbls) for col, tbls in textual.items()},
+    )
+
+
+SCHEMAS_SQL = """
+SELECT n.nspname AS schema_name
+FROM pg_catalog.pg_namespace n
+WHERE n.nspname NOT IN ('pg_catalog', 'information_schema')
+  AND n.nspname NOT LIKE 'pg\\_toast%'
+  AND n.nspname NOT LIKE 'pg\\_temp\\_%'
+  AND has_schema_privilege(n.oid, 'USAGE')
+ORDER BY n.nspname;
+"""
+
+
+async def _schemas_to_check(conn) -> List[str]:
+    if settings.DATABASE_SCHEMAS:
+        return [s.strip() for s in settings.DATABASE_SCHEMAS.split(",") if s.strip()]
+    rows = await conn.fetch(SCHEMAS_SQL)
+    # the rollup tables are an internal copy of chatbot.call_data, not for the LLM
+    return [r["schema_name"] for r in rows if r["schema_name"] != settings.ROLLUP_SCHEMA]
+
+
+# Straight from pg_catalog: the information_schema views re-derive privileges
+# and type names row by row and get slow on large catalogs. data_type keeps
+# the information_schema spelling ("character varying", "ARRAY",
+# "USER-DEFINED" for enums; domains report their base type).
+INTROSPECT_COLUMNS_SQL = """
+SELECT n.nspname AS table_schema,
+       c.relname AS table_name,
+       a.attname AS column_name,
+       CASE
+         WHEN t.typtype = 'd' THEN format_type(t.typbasetype, NULL)
+         WHEN t.typcategory = 'A' THEN 'ARRAY'
+         WHEN t.typtype = 'e' THEN 'USER-DEFINED'
+         ELSE format_type(a.atttypid, NULL)
+       END AS data_type,
+       c.relkind IN ('r', 'p') AS is_base_table
+FROM pg_catalog.pg_attribute a
+JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_catalog.pg_type t ON t.oid = a.atttypid
+WHERE n.nspname = ANY($1::text[])
+  AND c.relkind IN ('r', 'p', 'v', 'f')
+  AND a.attnum > 0
+  AND NOT a.attisdropped
+  AND has_column_privilege(c.oid, a.attnum, 'SELECT, INSERT, UPDATE, REFERENCES')
+ORDER BY n.nspname, c.relname, a.attnum;
+"""
+
+# conkey/confkey are parallel arrays: unnesting them together pairs each
+# column of a multi-column FK with its own referenced column
+INTROSPECT_FKS_SQL = """
+SELECT fn.nspname AS from_schema,
+       fc.relname AS from_table,
+       fa.attname AS from_column,
+       tn.nspname AS to_schema,
+       tc.relname AS to_table,
+       ta.attname AS to_column,
+       con.conname AS constraint_name
+FROM pg_catalog.pg_constraint con
+JOIN pg_catalog.pg_class fc ON fc.oid = con.conrelid
+JOIN pg_catalog.pg_namespace fn ON fn.oid = fc.relnamespace
+JOIN pg_catalog.pg_class tc ON tc.oid = con.confrelid
+JOIN pg_catalog.pg_namespace tn ON tn.oid = tc.relnamespace
+CROSS JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(from_attnum, to_attnum, position)
+JOIN pg_catalog.pg_attribute fa ON fa.attrelid = con.conrelid AND fa.attnum = k.from_attnum
+JOIN pg_catalog.pg_attribute ta ON ta.attrelid = con.confrelid AND ta.attnum = k.to_attnum
+WHERE con.contype = 'f'
+  AND fn.nspname = ANY($1::text[])
+ORDER BY fn.nspname, fc.relname, con.conname, k.position;
+"""
+
+
+# Order-independent digest of everything introspection reads: relations,
+# columns (name, position, type) and FK constraints. One aggregate row, no
+# sort; a moved, renamed, retyped, added or dropped object changes it.
+FINGERPRINT_SQL = """
+SELECT count(*) AS objects, coalesce(sum(hashtext(item)::bigint), 0) AS digest
+FROM (
+    SELECT n.nspname || '.' || c.relname || ':' || c.oid || ':' || c.relkind AS item
+    FROM pg_catalog.pg_class c
+    JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = ANY($1::text[]) AND c.relkind IN ('r', 'p', 'v', 'f')
+    UNION ALL
+    SELECT a.attrelid || '.' || a.attnum || ':' || a.attname || ':' || a.atttypid
+    FROM pg_catalog.pg_attribute a
+    JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+    JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = ANY($1::text[]) AND c.relkind IN ('r', 'p', 'v', 'f')
+      AND a.attnum > 0 AND NOT a.attisdropped
+    UNION ALL
+    SELECT con.oid || ':' || con.conname || ':' || con.confrelid || ':' || con.conkey::text || con.confkey::text
+    FROM pg_catalog.pg_constraint con
+    JOIN pg_catalog.pg_class c ON c.oid = con.conrelid
+    JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = ANY($1::text[]) AND con.contype = 'f'
+) AS catalog_items;
+"""
+
+
+async def fingerprint(conn) -> str:
+    """
+    Cheap change detector for the schemas introspect() reads: one aggregate
+    query instead of fetching every column. Equal fingerprints mean the
+    snapshot would be the same.
+    """
+    schemas = await _schemas_to_check(conn)
+    if not schemas:
+        return ""
+    row = await conn.fetchrow(FINGERPRINT_SQL, schemas)
+    return f"{','.join(schemas)}|{row['objects']}|{row['digest']}"
+
+
+async def introspect(conn, db_id: Optional[str] = None) -> CatalogSnapshot:
+    """
+    Read tables, columns, types and FKs with (at most) three bulk pg_catalog
+    queries. With db_id the column rows are kept per schema, so that
+    introspect_schemas() can later re-read only the schemas that changed.
+    """
+    schemas = await _schemas_to_check(conn)
+    if not schemas:
+        return build_snapshot([], [])
+    column_rows = await conn.fetch(INTROSPECT_COLUMNS_SQL, schemas)
+    fk_rows = await conn.fetch(INTROSPECT_FKS_SQL, schemas)
+    if db_id is not None:
+        by_schema = {schema: [] for schema in schemas}
+        for r in column_rows:
+            by_schema[r["table_schema"]].append(r)
+        _rows[db_id] = by_schema
+    return build_snapshot(column_rows, fk_rows)
+
+
+async def introspect_schemas(conn, db_id: str, changed: Set[str]) -> Optional[CatalogSnapshot]:
+    """
+    Snapshot after DDL in the `changed` schemas: only their columns are read
+    again, plus the FKs (one query; they can point across schemas). None when
+    none of them is introspected. Falls back to a full pass when there are no
+    kept rows for db_id.
+    """
+    by_schema = _rows.get(db_id)
+    if by_schema is None:
+        return await introspect(conn, db_id)
+    schemas = await _schemas_to_check(conn)
+    # schemas that appeared since the last pass are read too
+    targets = [s for s in schemas if s in changed or s not in by_schema]
+    if not targets and set(schemas) == set(by_schema):
+        return None
+    column_rows = await conn.fetch(INTROSPECT_COLUMNS_SQL, targets) if targets else []
+    fk_rows = await conn.fetch(INTROSPECT_FKS_SQL, schemas)
+    fresh = {schema: [] for schema in targets}
+    for r in column_rows:
+        fresh[r["table_schema"]].append(r)
+    by_schema = {schema: fresh[schema] if schema in fresh else by_schema[schema] for schema in schemas}
+    _rows[db_id] = by_schema
+    return build_snapshot([r for schema in schemas for r in by_schema[schema]], fk_rows)
+
+
+# DDL event triggers for push-based change detection: every DDL command (and
+# every dropped object) NOTIFYs the schema it touched. Postgres folds
+# identical notifications of one transaction, so a migration creating many
+# tables in one schema sends a single message. Needs superuser to install.
+EVENT_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION public.gensql_notify_schema_change() RETURNS event_trigger
+LANGUAGE plpgsql AS $fn$
+DECLARE
+    obj record;
+BEGIN
+    IF TG_EVENT = 'sql_drop' THEN
+        FOR obj IN SELECT schema_name FROM pg_event_trigger_dropped_objects() LOOP
+            PERFORM pg_notify('{channel}', json_build_object('schema', obj.schema_name)::text);
+        END LOOP;
+    ELSE
+        FOR obj IN SELECT schema_name FROM pg_event_trigger_ddl_commands() LOOP
+            PERFORM pg_notify('{channel}', json_build_object('schema', obj.schema_name)::text);
+        END LOOP;
+    END IF;
+END
+$fn$;
+DROP EVENT TRIGGER IF EXISTS gensql_schema_change;
+CREATE EVENT TRIGGER gensql_schema_change ON ddl_command_end
+    EXECUTE FUNCTION public.gensql_notify_schema_change();
+DROP EVENT TRIGGER IF EXISTS gensql_schema_drop;
+CREATE EVENT TRIGGER gensql_schema_drop ON sql_drop
+    EXECUTE FUNCTION public.gensql_notify_schema_change();
+"""
+
+
+async def install_event_triggers(conn, channel: str):
+    if not re.fullmatch(r"[a-z_][a-z0-9_]*", channel):
+        raise ValueError(f"Invalid notification channel name: {channel!r}")
+    async with conn.transaction():
+        await conn.execute(EVENT_TRIGGER_SQL.replace("{channel}", channel))
+
+
+def current(db_id: str) -> Optional[CatalogSnapshot]:
+    return _snapshots.get(db_id)
+
+
+def publish(db_id: str, snapshot: CatalogSnapshot) -> bool:
+    """Install snapshot for db_id. Returns True when it differs from the previous one."""
+    previous = _snapshots.get(db_id)
+    if previous is not None and previous.version == snapshot.version:
+        return False
+    _snapshots[db_id] = snapshot
+    return True
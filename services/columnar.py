@@ -0,0 +1,90 @@
+# services/columnar.py
+"""
+Columnar result encodings (Apache Arrow IPC stream and Parquet) built straight
+from asyncpg records. pyarrow is in requirements.txt; in an install without it
+these formats are simply not offered and the API keeps answering JSON.
+"""
+from typing import List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = None
+    pq = None
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+# Accept header value -> format name
+MEDIA_TYPES = {
+    ARROW_MEDIA_TYPE: "arrow",
+    "application/vnd.apache.arrow.file": "arrow",
+    PARQUET_MEDIA_TYPE: "parquet",
+    "application/x-parquet": "parquet",
+}
+CONTENT_TYPES = {"arrow": ARROW_MEDIA_TYPE, "parquet": PARQUET_MEDIA_TYPE}
+
+# Postgres type name -> pyarrow type factory, for the schema of an empty result
+# (other types are text, as _column falls back to)
+PG_TYPES = {
+    "bool": "bool_",
+    "int2": "int16",
+    "int4": "int32",
+    "int8": "int64",
+    "float4": "float32",
+    "float8": "float64",
+    "date": "date32",
+    "text": "string",
+    "varchar": "string",
+}
+
+
+def available() -> bool:
+    return pa is not None
+
+
+def negotiate(accept: str) -> Optional[str]:
+    """'arrow' or 'parquet' when the Accept header asks for it, else None."""
+    for part in accept.split(","):
+        fmt = MEDIA_TYPES.get(part.split(";")[0].strip().lower())
+        if fmt:
+            return fmt
+    return None
+
+
+def _column(values: list):
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # mixed or exotic types (json, arrays of records, ...): fall back to text
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+def to_table(records: List, sql: str = ""):
+    """
+    Build a pyarrow Table column by column from asyncpg records (or dicts).
+    The generating SQL is stored in the schema metadata. An empty result
+    keeps its columns when the records carry them (executor.Records).
+    """
+    if not records:
+        columns = getattr(records, "columns", [])
+        schema = pa.schema(
+            [(name, getattr(pa, PG_TYPES.get(type_name, "string"))()) for name, type_name in columns],
+            metadata={"sql": sql},
+        )
+        return schema.empty_table()
+    names = list(records[0].keys())
+    columns = [_column(list(values)) for values in zip(*(r.values() for r in records))]
+    return pa.Table.from_arrays(columns, names=names).replace_schema_metadata({"sql": sql})
+
+
+def encode(records: List, fmt: str, sql: str = "") -> bytes:
+    table = to_table(records, sql)
+    sink = pa.BufferOutputStream()
+    if fmt == "parquet":
+        pq.write_table(table, sink)
+    else:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue().to_pybytes()
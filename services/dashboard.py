@@ -0,0 +1,59 @@
+# services/dashboard.py
+"""
+Dashboard metrics in one statement. Each single-value template (counts,
+averages, total duration) over chatbot.call_data becomes one FILTER
+aggregate, so a dashboard needs a single scan and a single round trip
+instead of one /v1/query per metric. Grouped templates (agent_wise,
+disposition_wise, audit_sheet) return row sets and stay on /v1/query.
+
+Column names are the template names. When the rollups are ready the same
+metrics are read from them instead (rollups.metrics_sql).
+"""
+import hashlib
+from typing import Dict, List, Optional, Sequence
+
+from services import query_templates, rollups
+
+SOURCE = "chatbot.call_data"
+
+# template name -> aggregate over SOURCE, equivalent to the template's query
+METRICS: Dict[str, str] = {
+    **{
+        name: f"count(*) filter (where {predicate})"
+        for name, predicate in query_templates.COUNT_PREDICATES.items()
+    },
+    **{name: f"avg({column})" for name, column in query_templates.AVERAGE_COLUMNS.items()},
+    "total_duration": (
+        "concat(floor(sum(duration) / 3600), ' hours ', floor((sum(duration) % 3600) / 60), ' minutes')"
+    ),
+}
+
+
+class UnknownMetric(ValueError):
+    pass
+
+
+def resolve(names: Optional[Sequence[str]]) -> List[str]:
+    """Requested metric names in METRICS order (all of them when None)."""
+    if not names:
+        return list(METRICS)
+    unknown = [name for name in names if name not in METRICS]
+    if unknown:
+        raise UnknownMetric(
+            f"Unknown dashboard metric(s): {', '.join(unknown)}; available: {', '.join(METRICS)}"
+        )
+    return [name for name in METRICS if name in names]
+
+
+def build_sql(names: Sequence[str], db_id: str) -> str:
+    """One statement returning a single row with a column per metric, binding $1-$3."""
+    sql = rollups.metrics_sql(names, db_id)
+    if sql:
+        return sql
+    select = ",\n".join(f"{METRICS[name]} as {name}" for name in names)
+    return f"select {select}\nfrom {SOURCE}\nwhere tenant_id = $1 and date between $2 and $3;"
+
+
+def statement_name(sql: str) -> str:
+    # one prepared statement per metric selection (and raw/rollup source)
+    return "dashboard_" + hashlib.md5(sql.encode()).hexdigest()[:10]
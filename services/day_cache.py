@@ -0,0 +1,191 @@
+# services/day_cache.py
+"""
+Day-partitioned cache of the single-value template aggregates. For each
+(db_id, tenant, day) it keeps the partial aggregates of every dashboard
+metric: counts, sum + count for averages, and the duration sum. A date
+range is answered by merging the cached days and computing only the
+missing ones, one grouped-by-day query per run of consecutive missing
+days. Overlapping ranges ("last 30 days" asked daily) then scan a single
+new day instead of the whole range.
+
+Finished days are never recomputed unless invalidate() drops them. The last
+DAY_CACHE_SETTLE_DAYS days (today included) can still receive rows, so they
+are always computed and never stored. Partials are read from the primary: a
+lagging replica would freeze an incomplete day.
+"""
+from collections import OrderedDict
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Hashable, List, Optional, Sequence
+
+from core.config import settings
+from services import dashboard, executor, query_templates, rollups
+
+# metric -> how its partials are merged
+_AVERAGES = query_templates.AVERAGE_COLUMNS
+_SUMS = {"total_duration": "duration"}
+_COUNTS = [name for name in dashboard.METRICS if name not in _AVERAGES and name not in _SUMS]
+
+_entries: "OrderedDict[Hashable, dict]" = OrderedDict()  # (db_id, tenant, day) -> partials
+_stats = {"days_hit": 0, "days_computed": 0, "queries": 0, "evictions": 0, "invalidated": 0}
+
+
+def _partial_columns() -> List[str]:
+    columns = [f"{dashboard.METRICS[name]} as {name}" for name in _COUNTS]
+    for name, column in _AVERAGES.items():
+        columns += [f"sum({column}) as {name}_sum", f"count({column}) as {name}_n"]
+    columns += [f"sum({column}) as {name}_sum" for name, column in _SUMS.items()]
+    return columns
+
+
+PARTIALS_SQL = (
+    "select date,\n" + ",\n".join(_partial_columns()) + "\n"
+    f"from {dashboard.SOURCE}\n"
+    "where tenant_id = $1 and date between $2 and $3\n"
+    "group by date"
+)
+_EMPTY_DAY = {
+    **{name: 0 for name in _COUNTS},
+    **{f"{name}_sum": None for name in list(_AVERAGES) + list(_SUMS)},
+    **{f"{name}_n": 0 for name in _AVERAGES},
+}
+
+
+def supports(name: str) -> bool:
+    return name in dashboard.METRICS
+
+
+def _parse_range(from_date: str, to_date: str) -> Optional[tuple[date, date]]:
+    try:
+        return date.fromisoformat(from_date), date.fromisoformat(to_date)
+    except (TypeError, ValueError):
+        return None
+
+
+def _settled_before() -> date:
+    return date.today() - timedelta(days=max(settings.DAY_CACHE_SETTLE_DAYS, 1) - 1)
+
+
+def _runs(days: List[date]) -> List[tuple[date, date]]:
+    """Consecutive days collapsed into (first, last) ranges."""
+    runs = []
+    for day in days:
+        if runs and runs[-1][1] + timedelta(days=1) == day:
+            runs[-1] = (runs[-1][0], day)
+        else:
+            runs.append((day, day))
+    return runs
+
+
+def _store(key: Hashable, partials: dict):
+    _entries[key] = partials
+    _entries.move_to_end(key)
+    while len(_entries) > settings.DAY_CACHE_MAX_DAYS:
+        _entries.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+def _add(total, value):
+    if value is None:
+        return total
+    return value if total is None else total + value
+
+
+def merge(names: Sequence[str], days: Sequence[dict]) -> Dict[str, object]:
+    """Final metric values from per-day partials, as the template SQL returns them."""
+    result = {}
+    for name in names:
+        if name in _AVERAGES:
+            total, n = None, 0
+            for day in days:
+                total = _add(total, day[f"{name}_sum"])
+                n += day[f"{name}_n"]
+            if not n:
+                result[name] = None
+            else:
+                # avg() of an integer column is numeric
+                result[name] = Decimal(total) / n if isinstance(total, int) else total / n
+        elif name in _SUMS:
+            total = None
+            for day in days:
+                total = _add(total, day[f"{name}_sum"])
+            # concat() skips NULLs, like the template
+            result[name] = (
+                " hours  minutes" if total is None
+                else f"{int(total // 3600)} hours {int((total % 3600) // 60)} minutes"
+            )
+        else:
+            result[name] = sum(day[name] for day in days)
+    return result
+
+
+async def aggregate(names: Sequence[str], db_id: str, tenant_id: str, from_date: str, to_date: str) -> Optional[dict]:
+    """
+    {metric: value} for the tenant and inclusive date range, or None when the
+    dates cannot be parsed or the range is too long to go day by day (the
+    caller falls back to the template SQL).
+    """
+    parsed = _parse_range(from_date, to_date)
+    if parsed is None:
+        return None
+    start, end = parsed
+    if (end - start).days >= settings.DAY_CACHE_MAX_RANGE_DAYS:
+        return None
+    settled = _settled_before()
+    partials, missing = [], []
+    day = start
+    while day <= end:
+        key = (db_id, tenant_id, day)
+        cached = _entries.get(key) if day < settled else None
+        if cached is not None:
+            _entries.move_to_end(key)
+            partials.append(cached)
+            _stats["days_hit"] += 1
+        else:
+            missing.append(day)
+        day += timedelta(days=1)
+
+    for first, last in _runs(missing):
+        records = await executor.fetch_records(
+            PARTIALS_SQL, db_id, enforce_limit=False,
+            params=[tenant_id, first, last], statement="day_cache_partials", primary=True,
+        )
+        _stats["queries"] += 1
+        found = {r["date"]: {k: v for k, v in dict(r).items() if k != "date"} for r in records}
+        day = first
+        while day <= last:
+            # days without rows are cached too, as zero partials
+            day_partials = found.get(day, _EMPTY_DAY)
+            partials.append(day_partials)
+            _stats["days_computed"] += 1
+            if day < settled:
+                _store((db_id, tenant_id, day), day_partials)
+            day += timedelta(days=1)
+    return merge(names, partials)
+
+
+async def template_rows(name: str, db_id: str, params: Sequence[str]) -> Optional[list]:
+    """The single result row of a single-value template, from the day cache."""
+    tenant_id, from_date, to_date = params
+    values = await aggregate([name], db_id, tenant_id, from_date, to_date)
+    if values is None:
+        return None
+    return [{rollups.DAILY_METRICS[name][1]: values[name]}]
+
+
+def invalidate(db_id: Optional[str] = None, tenant_id: Optional[str] = None, since: Optional[date] = None) -> int:
+    """Drop cached days (of db_id, of a tenant, from a date on); returns how many."""
+    keys = [
+        k for k in _entries
+        if (db_id is None or k[0] == db_id)
+        and (tenant_id is None or k[1] == tenant_id)
+        and (since is None or k[2] >= since)
+    ]
+    for key in keys:
+        del _entries[key]
+    _stats["invalidated"] += len(keys)
+    return len(keys)
+
+
+def stats() -> dict:
+    return {**_stats, "days": len(_entries), "enabled": settings.DAY_CACHE_ENABLED}
@@ -1,122 +1,369 @@
 import asyncio
 import asyncpg
+import json
 import re
-from typing import Dict, Set
-
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+from core import deadline
 from core.config import settings
+from services import catalog
+from services.sql_lexer import Token, split_name, tokenize
+from services.validator import KEYWORDS
+
+DEFAULT_POOL = "default"
 
-_pool = None
-_column_types_cache: Dict[str, Dict[str, str]] | None = None
-_textual_column_index: Dict[str, Set[str]] | None = None
+_pools: Dict[str, asyncpg.Pool] = {}
+_pool_lock = asyncio.Lock()
+_pool_stats: Dict[str, dict] = {}
 _column_lock = asyncio.Lock()
+# (pool key, backend pid) -> statement name -> (sql, PreparedStatement)
+_statements: Dict[Tuple[str, int], Dict[str, tuple]] = {}
+_statement_stats = {"prepared": 0, "reused": 0}
+# primary pool key -> replica pool keys ("default/replica0", ...)
+_replicas: Dict[str, List[str]] = {}
+_replica_dsns: Dict[str, str] = {}
+_replica_health: Dict[str, dict] = {}
+_replica_stats = {"routed": 0, "fallbacks": 0, "saturated": 0}
 
-TEXTUAL_TYPES = {"character varying", "text", "varchar", "bpchar", "uuid", "citext"}
-TABLE_ALIAS_RE = re.compile(
-    r"\b(from|join)\s+([a-zA-Z_][\w\.]*)(?:\s+(?:as\s+)?([a-zA-Z_][\w]*))?",
-    re.IGNORECASE,
-)
-EQUALITY_RE = re.compile(
-    r"(?P<left>(?:[a-zA-Z_][\w]*\.){0,2}\"?[a-zA-Z_][\w]*\"?)\s*=\s*(?P<literal>-?\d+)(?![\d\.])",
-    re.IGNORECASE,
-)
-EQUALITY_RE_REVERSED = re.compile(
-    r"(?P<literal>-?\d+)\s*=\s*(?P<right>(?:[a-zA-Z_][\w]*\.){0,2}\"?[a-zA-Z_][\w]*\"?)",
-    re.IGNORECASE,
-)
-IN_RE = re.compile(
-    r"(?P<col>(?:[a-zA-Z_][\w]*\.){0,2}\"?[a-zA-Z_][\w]*\"?)\s+IN\s*\((?P<values>[^)]+)\)",
-    re.IGNORECASE,
-)
+TEXTUAL_TYPES = catalog.TEXTUAL_TYPES
+_DIGIT_RE = re.compile(r"\d")
 
 
 def _normalize_identifier(token: str) -> str:
     return token.strip().strip('"').lower()
 
 
-async def _get_pool():
-    global _pool
-    if _pool is None:
-        _pool = await asyncpg.create_pool(dsn=settings.get_asyncpg_dsn(), min_size=1, max_size=5)
-    return _pool
+def _pool_key(db_id: str | None) -> str:
+    """db_ids without their own DATABASE_URLS entry share the default pool."""
+    return db_id if db_id and db_id in settings.DATABASE_URLS else DEFAULT_POOL
+
+
+def _replica_keys(primary: str) -> List[str]:
+    """
+    Pool keys of the read replicas behind a primary pool key. Replicas belong
+    to a database, not a db_id: READ_REPLICA_URLS entries of db_ids sharing
+    the default pool all replicate the default database.
+    """
+    keys = _replicas.get(primary)
+    if keys is None:
+        dsns = list(dict.fromkeys(
+            dsn for db_id in settings.READ_REPLICA_URLS if _pool_key(db_id) == primary
+            for dsn in settings.replica_dsns(db_id)
+        ))
+        keys = [f"{primary}/replica{i}" for i in range(len(dsns))]
+        _replica_dsns.update(zip(keys, dsns))
+        _replicas[primary] = keys
+    return keys
+
+
+def _pool_dsn(key: str) -> str:
+    if key in _replica_dsns:
+        return _replica_dsns[key]
+    return settings.get_asyncpg_dsn(None if key == DEFAULT_POOL else key)
 
 
-async def _ensure_column_metadata():
+def _route(db_id: str | None, read_only: bool) -> str:
+    """
+    Pool key for a statement: the primary, or for read-only work the healthy
+    replica with the fewest connections in use or waiting (least connections).
+    Falls back to the primary when no replica is within the lag tolerance.
     """
-    Introspect information_schema once and cache column data types so that we can
-    patch obvious literal type mismatches before touching the database.
+    primary = _pool_key(db_id)
+    if not read_only:
+        return primary
+    replicas = _replica_keys(primary)
+    if not replicas:
+        return primary
+    healthy = [k for k in replicas if _replica_health.get(k, {}).get("healthy")]
+    if not healthy:
+        _replica_stats["fallbacks"] += 1
+        return primary
+    _replica_stats["routed"] += 1
+
+    def load(key):
+        stats = _pool_stats.get(key, {})
+        # ties go to the replica that has served fewer acquires so far
+        return stats.get("in_use", 0) + stats.get("waiting", 0), stats.get("acquires", 0)
+
+    return min(healthy, key=load)
+
+
+async def _get_pool(key: str = DEFAULT_POOL):
+    pool = _pools.get(key)
+    if pool is not None:
+        return pool
+    async with _pool_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = await asyncpg.create_pool(
+                dsn=_pool_dsn(key),
+                init=partial(_init_connection, key),
+                **settings.pool_options(key),
+            )
+            _pools[key] = pool
+            _pool_stats.setdefault(key, {
+                "acquires": 0,
+                "acquire_timeouts": 0,
+                "acquire_wait_total_ms": 0.0,
+                "acquire_wait_max_ms": 0.0,
+                "waiting": 0,
+                "in_use": 0,
+            })
+            print(f"Created connection pool '{key}' ({pool.get_min_size()}-{pool.get_max_size()} connections)")
+    return pool
+
+
+async def _init_connection(key: str, conn):
+    # prepared statements die with their connection; drop the cache entry with it
+    pid = conn.get_server_pid()
+    conn.add_termination_listener(lambda _conn: _statements.pop((key, pid), None))
+
+
+async def _checkout(key: str):
+    pool = await _get_pool(key)
+    stats = _pool_stats[key]
+    stats["waiting"] += 1
+    started = time.perf_counter()
+    try:
+        conn = await pool.acquire(timeout=settings.POOL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        stats["acquire_timeouts"] += 1
+        raise
+    finally:
+        stats["waiting"] -= 1
+    waited_ms = (time.perf_counter() - started) * 1000
+    stats["acquires"] += 1
+    stats["acquire_wait_total_ms"] += waited_ms
+    stats["acquire_wait_max_ms"] = max(stats["acquire_wait_max_ms"], waited_ms)
+    return pool, conn
+
+
+def _exhausted(key: str) -> bool:
+    """Every connection of the pool is checked out (a timeout there is load, not ill health)."""
+    pool = _pools.get(key)
+    return pool is not None and pool.get_size() >= pool.get_max_size() and pool.get_idle_size() == 0
+
+
+@asynccontextmanager
+async def _acquire(db_id: str | None = None, read_only: bool = False):
     """
-    global _column_types_cache, _textual_column_index
-    if _column_types_cache is not None and _textual_column_index is not None:
+    pool.acquire() that records wait time and in-use counts for pool_stats().
+    Yields (pool key, connection). read_only work may be routed to a replica;
+    if that replica cannot hand out a connection the primary serves the
+    statement instead. A replica that cannot be reached is marked unhealthy;
+    one whose pool is merely exhausted (acquire timeout) stays in rotation.
+    """
+    key = _route(db_id, read_only)
+    try:
+        pool, conn = await _checkout(key)
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError) as e:
+        if key not in _replica_dsns:
+            raise
+        if isinstance(e, asyncio.TimeoutError) and _exhausted(key):
+            _replica_stats["saturated"] += 1
+        else:
+            _mark_replica(key, False, error=f"acquire failed: {e}")
+            _replica_stats["fallbacks"] += 1
+        key = _pool_key(db_id)
+        pool, conn = await _checkout(key)
+    stats = _pool_stats[key]
+    stats["in_use"] += 1
+    try:
+        yield key, conn
+    finally:
+        stats["in_use"] -= 1
+        await pool.release(conn)
+
+
+# Replication lag as seen by the replica. A replica that has replayed all WAL
+# it received is current even if the primary has been idle for a while; a
+# server that is not in recovery (e.g. promoted) has no lag at all.
+REPLICA_LAG_SQL = """
+SELECT CASE
+         WHEN NOT pg_is_in_recovery() THEN 0
+         WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+         ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+       END::float8 AS lag_seconds
+"""
+
+
+def _mark_replica(key: str, healthy: bool, lag: float | None = None, error: str | None = None):
+    previous = _replica_health.get(key, {}).get("healthy")
+    _replica_health[key] = {
+        "healthy": healthy,
+        "lag_seconds": lag,
+        "error": error,
+        "checked_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    if previous is not None and previous != healthy:
+        state = "healthy" if healthy else f"unhealthy ({error or f'lag {lag:.1f}s'})"
+        print(f"Replica '{key}' is now {state}")
+
+
+async def _check_replica(key: str):
+    timeout = settings.REPLICA_HEALTH_TIMEOUT_SECONDS
+    try:
+        pool = await asyncio.wait_for(_get_pool(key), timeout)
+        async with pool.acquire(timeout=timeout) as conn:
+            lag = await conn.fetchval(REPLICA_LAG_SQL, timeout=timeout)
+    except Exception as e:
+        _mark_replica(key, False, error=str(e) or type(e).__name__)
         return
+    if lag > settings.REPLICA_MAX_LAG_SECONDS:
+        _mark_replica(key, False, lag=lag)
+    else:
+        _mark_replica(key, True, lag=lag)
+
+
+async def check_replicas():
+    """Probe every configured replica once: reachable and within REPLICA_MAX_LAG_SECONDS."""
+    keys = [k for db_id in _configured_db_ids() for k in _replica_keys(_pool_key(db_id))]
+    await asyncio.gather(*(_check_replica(k) for k in dict.fromkeys(keys)))
+
 
-    async with _column_lock:
-        if _column_types_cache is not None and _textual_column_index is not None:
-            return
-
-        pool = await _get_pool()
-        async with pool.acquire() as conn:
-            schemas = [s.strip() for s in settings.DATABASE_SCHEMAS.split(",") if s.strip()]
-            base_query = """
-                SELECT table_schema || '.' || table_name AS full_table,
-                       column_name,
-                       data_type
-                FROM information_schema.columns
-                WHERE table_schema NOT IN ('information_schema','pg_catalog')
-            """
-            params = []
-            if schemas:
-                base_query += " AND table_schema = ANY($1::text[])"
-                params.append(schemas)
-            rows = await conn.fetch(base_query, *params)
-
-        column_map: Dict[str, Dict[str, str]] = {}
-        text_index: Dict[str, Set[str]] = {}
-
-        for row in rows:
-            table = _normalize_identifier(row["full_table"])
-            column = _normalize_identifier(row["column_name"])
-            data_type = _normalize_identifier(row["data_type"])
-            table_entry = column_map.setdefault(table, {})
-            table_entry[column] = data_type
-            if data_type in TEXTUAL_TYPES:
-                text_index.setdefault(column, set()).add(table)
-
-        _column_types_cache = column_map
-        _textual_column_index = text_index
-
-
-def _build_alias_map(sql: str) -> Dict[str, str]:
+async def monitor_replicas():
+    """Background loop re-checking replica health and lag."""
+    while True:
+        await asyncio.sleep(settings.REPLICA_HEALTH_INTERVAL_SECONDS)
+        try:
+            await check_replicas()
+        except Exception as e:
+            print(f"Replica health check error: {e}")
+
+
+def _configured_db_ids() -> List[str]:
+    return list(dict.fromkeys([settings.DEFAULT_DB_ID, *settings.DATABASE_URLS, *settings.READ_REPLICA_URLS]))
+
+
+async def warmup_pools():
+    """
+    Open every configured pool (min_size connections each) and load column
+    metadata, so the first request does not pay for connection setup. Read
+    replicas are probed once so they can take traffic right away.
+    """
+    for db_id in settings.database_ids():
+        try:
+            await _ensure_column_metadata(db_id)
+        except Exception as e:
+            print(f"Warning: pool warmup failed for '{_pool_key(db_id)}': {e}")
+    await check_replicas()
+
+
+async def close_pools():
+    for key in list(_pools):
+        await _pools.pop(key).close()
+
+
+def pool_stats() -> dict:
+    """Per-pool size, in-use count, saturation and acquire-wait timings."""
+    out = {}
+    for key, pool in _pools.items():
+        stats = _pool_stats[key]
+        max_size = pool.get_max_size()
+        acquires = stats["acquires"]
+        out[key] = {
+            **stats,
+            "size": pool.get_size(),
+            "idle": pool.get_idle_size(),
+            "min_size": pool.get_min_size(),
+            "max_size": max_size,
+            "saturation": stats["in_use"] / max_size if max_size else 0.0,
+            "acquire_wait_avg_ms": stats["acquire_wait_total_ms"] / acquires if acquires else 0.0,
+            "role": "replica" if key in _replica_dsns else "primary",
+        }
+        if key in _replica_health:
+            out[key]["health"] = dict(_replica_health[key])
+    return out
+
+
+def replica_stats() -> dict:
+    """Routing counters plus the last health check of every replica."""
+    return {**_replica_stats, "replicas": {k: dict(v) for k, v in _replica_health.items()}}
+
+
+async def _ensure_column_metadata(db_id: str | None = None):
+    """
+    Column data types used to patch obvious literal type mismatches before
+    touching the database. They come from the shared catalog snapshot kept
+    fresh by the schema refresher; if none is published yet, introspect once.
+    """
+    # db_ids without a database of their own run on the default one and use
+    # its snapshot: nothing is published under a client-chosen name
+    if db_id not in settings.DATABASE_URLS:
+        db_id = settings.DEFAULT_DB_ID
+    snapshot = catalog.current(db_id)
+    if snapshot is None:
+        async with _column_lock:
+            snapshot = catalog.current(db_id)
+            if snapshot is None:
+                # introspection always reads the primary
+                async with _acquire(db_id) as (_, conn):
+                    snapshot = await catalog.introspect(conn, db_id)
+                catalog.publish(db_id, snapshot)
+    return snapshot.column_types, snapshot.textual_columns
+
+
+_REF_KINDS = ("ident", "name", "qident")
+
+
+def _ref_parts(tok: Token) -> tuple[str | None, str]:
+    """(owner, column) of an identifier token, normalized."""
+    if tok.kind == "name":
+        parts = split_name(tok.text)
+        return ".".join(parts[:-1]), parts[-1]
+    return None, _normalize_identifier(tok.text)
+
+
+def _build_alias_map(tokens: List[Token]) -> Dict[str, str]:
     """
     Map aliases → fully-qualified table names (schema.table).
     """
     alias_map: Dict[str, str] = {}
-    for _, table, alias in TABLE_ALIAS_RE.findall(sql):
-        table_norm = _normalize_identifier(table)
+    n = len(tokens)
+    for i, tok in enumerate(tokens):
+        if tok.kind != "ident" or tok.text.lower() not in ("from", "join") or i + 1 >= n:
+            continue
+        table_tok = tokens[i + 1]
+        if table_tok.kind not in _REF_KINDS:
+            continue
+        table_norm = ".".join(split_name(table_tok.text)) if table_tok.kind == "name" \
+            else _normalize_identifier(table_tok.text)
+        if table_tok.kind == "ident" and table_norm in KEYWORDS:
+            continue
         alias_map[table_norm] = table_norm
         if "." in table_norm:
             alias_map[table_norm.split(".")[-1]] = table_norm
-        if alias:
-            alias_map[_normalize_identifier(alias)] = table_norm
+        j = i + 2
+        if j < n and tokens[j].kind == "ident" and tokens[j].text.lower() == "as":
+            j += 1
+        if j < n and tokens[j].kind in ("ident", "qident"):
+            alias = _normalize_identifier(tokens[j].text)
+            if tokens[j].kind == "qident" or alias not in KEYWORDS:
+                alias_map[alias] = table_norm
     return alias_map
 
 
-def _should_quote(owner: str | None, column: str, alias_map: Dict[str, str]) -> bool:
+def _should_quote(owner: str | None, column: str, alias_map: Dict[str, str], metadata) -> bool:
     """
     Decide whether the literal next to this column should be treated as text.
     """
-    if _column_types_cache is None or _textual_column_index is None:
-        return False
+    column_types, textual_index = metadata
 
     if owner:
         table_key = alias_map.get(owner, owner)
-        if table_key and table_key in _column_types_cache:
-            data_type = _column_types_cache[table_key].get(column)
+        if table_key and table_key in column_types:
+            data_type = column_types[table_key].get(column)
             return data_type in TEXTUAL_TYPES
 
-    candidate_tables = _textual_column_index.get(column, set())
+    candidate_tables = textual_index.get(column, set())
     if len(candidate_tables) == 1:
         table_key = next(iter(candidate_tables))
-        data_type = _column_types_cache.get(table_key, {}).get(column)
+        data_type = column_types.get(table_key, {}).get(column)
         return data_type in TEXTUAL_TYPES
     return False
 
@@ -125,74 +372,348 @@ def _quote_literal(literal: str) -> str:
     return f"'{literal}'"
 
 
-def _extract_owner_and_column(identifier: str) -> tuple[str | None, str]:
-    parts = [segment for segment in identifier.split(".") if segment]
-    if not parts:
-        return None, ""
-    column = _normalize_identifier(parts[-1])
-    owner = _normalize_identifier(".".join(parts[:-1])) if len(parts) > 1 else None
-    return owner, column
+def _integer_at(tokens: List[Token], i: int) -> tuple[int, int] | None:
+    """(start, end) of an integer literal (optionally negative) starting at token i."""
+    if i >= len(tokens):
+        return None
+    tok = tokens[i]
+    if tok.kind == "number" and tok.text.isdigit():
+        return tok.start, tok.end
+    if tok.text == "-" and i + 1 < len(tokens):
+        nxt = tokens[i + 1]
+        if nxt.kind == "number" and nxt.text.isdigit() and nxt.start == tok.end:
+            return tok.start, nxt.end
+    return None
 
 
-def _quote_numeric_literals(sql: str) -> str:
+def _quote_numeric_literals(sql: str, metadata) -> str:
     """
     Quote bare numeric literals when they are compared against columns that are
     stored as text/varchar to avoid operator mismatch errors.
+
+    One tokenizer scan feeds both the alias map and the comparisons, so string
+    literals, quoted identifiers and comments are never rewritten. Handles
+    `col = 5`, `5 = col` and `col [NOT] IN (1, 2)`; edits are spliced into the
+    original text by offset.
     """
-    if _column_types_cache is None or _textual_column_index is None:
+    if metadata is None or not _DIGIT_RE.search(sql):
         return sql
 
-    alias_map = _build_alias_map(sql)
-
-    def handle_equality(match, left_key: str, literal_key: str, right_side: bool = False):
-        identifier = match.group(left_key)
-        literal = match.group(literal_key)
-        owner, column = _extract_owner_and_column(identifier)
-        if _should_quote(owner, column, alias_map):
-            quoted = _quote_literal(literal)
-            if right_side:
-                return f"{quoted} = {identifier}"
-            return f"{identifier} = {quoted}"
-        return match.group(0)
-
-    sql = EQUALITY_RE.sub(lambda m: handle_equality(m, "left", "literal"), sql)
-    sql = EQUALITY_RE_REVERSED.sub(lambda m: handle_equality(m, "right", "literal", right_side=True), sql)
-
-    def handle_in_clause(match):
-        identifier = match.group("col")
-        owner, column = _extract_owner_and_column(identifier)
-        if not _should_quote(owner, column, alias_map):
-            return match.group(0)
-        values = match.group("values")
-        if "select" in values.lower():
-            return match.group(0)
-        parts = [p.strip() for p in values.split(",")]
-        new_parts = []
-        for part in parts:
-            if re.fullmatch(r"-?\d+", part) and not part.startswith("'"):
-                new_parts.append(_quote_literal(part))
-            else:
-                new_parts.append(part)
-        return f"{identifier} IN ({', '.join(new_parts)})"
+    tokens = tokenize(sql)
+    n = len(tokens)
+    alias_map = None
+    edits = []
+
+    def quote(ref: Token) -> bool:
+        nonlocal alias_map
+        if alias_map is None:
+            alias_map = _build_alias_map(tokens)
+        owner, column = _ref_parts(ref)
+        return _should_quote(owner, column, alias_map, metadata)
+
+    for i, tok in enumerate(tokens):
+        text = tok.text
+        if text == "=" and 0 < i < n - 1:
+            left, right = tokens[i - 1], tokens[i + 1]
+            if left.kind in _REF_KINDS:
+                span = _integer_at(tokens, i + 1)
+                if span and quote(left):
+                    edits.append(span)
+            elif right.kind in _REF_KINDS and left.kind == "number" and left.text.isdigit():
+                start = left.start
+                if i >= 2 and tokens[i - 2].text == "-" and tokens[i - 2].end == start:
+                    start = tokens[i - 2].start
+                if quote(right):
+                    edits.append((start, left.end))
+        elif tok.kind == "ident" and i + 1 < n and tokens[i + 1].text == "(" and text.lower() == "in" and i:
+            ref = tokens[i - 1]
+            if ref.kind == "ident" and ref.text.lower() == "not" and i >= 2:
+                ref = tokens[i - 2]
+            if ref.kind not in _REF_KINDS:
+                continue
+            j = i + 2
+            spans = []
+            while j < n and tokens[j].text != ")":
+                if tokens[j].kind == "ident" and tokens[j].text.lower() in ("select", "with"):
+                    spans = []
+                    break
+                span = _integer_at(tokens, j)
+                if span:
+                    spans.append(span)
+                    if tokens[j].text == "-":
+                        j += 1
+                j += 1
+            if spans and quote(ref):
+                edits.extend(spans)
+
+    if not edits:
+        return sql
+    out = []
+    pos = 0
+    for start, end in edits:
+        out.append(sql[pos:start])
+        out.append(_quote_literal(sql[start:end]))
+        pos = end
+    out.append(sql[pos:])
+    return "".join(out)
+
+
+def _statement_timeout_ms() -> int:
+    """STATEMENT_TIMEOUT_MS, shortened to whatever is left of the request deadline."""
+    timeout_ms = settings.STATEMENT_TIMEOUT_MS
+    left = deadline.check("SQL execution")
+    if left is not None:
+        timeout_ms = max(1, min(timeout_ms, int(left * 1000)))
+    return timeout_ms
+
+
+async def _set_statement_timeout(conn):
+    # SET LOCAL only lasts until the end of the enclosing transaction, so
+    # callers must be inside conn.transaction() for it to apply at all.
+    await conn.execute(f"SET LOCAL statement_timeout = {_statement_timeout_ms()}")
+
+
+class DryRunError(Exception):
+    """EXPLAIN failed: the planner rejected the SQL (bad column, type error, ...)."""
 
-    sql = IN_RE.sub(handle_in_clause, sql)
+
+class QueryTooExpensive(DryRunError):
+    """EXPLAIN succeeded but the estimated cost or row count exceeds the db_id limits."""
+
+
+def apply_row_limit(sql: str) -> str:
+    """Append LIMIT MAX_ROWS to a SELECT that has none."""
+    if sql.strip().lower().startswith("select") and "limit" not in sql.lower():
+        sql = sql.rstrip(";") + f" LIMIT {settings.MAX_ROWS};"
     return sql
 
 
-async def execute_sql(sql: str, db_id: str, enforce_limit: bool = True):
+async def _prepare_sql(sql: str, db_id: str, enforce_limit: bool) -> str:
     # enforce small LIMIT if missing
-    if enforce_limit and sql.strip().lower().startswith("select") and "limit" not in sql.lower():
-        sql = sql.rstrip(";") + f" LIMIT {settings.MAX_ROWS};"
+    if enforce_limit:
+        sql = apply_row_limit(sql)
+
+    metadata = await _ensure_column_metadata(db_id)
+    return _quote_numeric_literals(sql, metadata)
+
+
+def _seq_scans(plan: dict) -> list[tuple[str, float, float]]:
+    """(relation, total cost, plan rows) for every Seq Scan node, most expensive first."""
+    found = []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if node.get("Node Type") == "Seq Scan":
+            relation = node.get("Relation Name", "?")
+            # "Schema" is only in VERBOSE plans, which explain_sql asks for
+            if node.get("Schema"):
+                relation = f"{node['Schema']}.{relation}"
+            found.append((relation, node.get("Total Cost", 0.0), node.get("Plan Rows", 0.0)))
+        stack.extend(node.get("Plans", []))
+    return sorted(found, key=lambda item: item[1], reverse=True)
+
+
+def _check_plan(plan: dict, db_id: str):
+    """
+    Compare the whole plan with the db_id's thresholds (DRY_RUN_LIMITS is keyed
+    by database, not by table); the schema-qualified scans only explain a rejection.
+    """
+    max_cost, max_rows = settings.dry_run_limits(db_id)
+    cost = plan.get("Total Cost", 0.0)
+    rows = plan.get("Plan Rows", 0.0)
+
+    problems = []
+    if max_cost and cost > max_cost:
+        problems.append(f"estimated cost {cost:,.0f} exceeds limit {max_cost:,.0f}")
+    if max_rows and rows > max_rows:
+        problems.append(f"estimated {rows:,.0f} result rows exceeds limit {max_rows:,.0f}")
+    if not problems:
+        return
+
+    detail = ""
+    scans = _seq_scans(plan)
+    if scans:
+        detail = " Full table scans: " + ", ".join(
+            f"{rel} (cost {c:,.0f}, ~{r:,.0f} rows)" for rel, c, r in scans[:3]
+        ) + "."
+    raise QueryTooExpensive(
+        f"Query rejected by dry run for db '{db_id}': {'; '.join(problems)}.{detail} "
+        "Add selective filters or aggregate instead of returning raw rows."
+    )
 
-    await _ensure_column_metadata()
-    sql = _quote_numeric_literals(sql)
 
-    pool = await _get_pool()
-    async with pool.acquire() as conn:
-        # set a statement timeout per session (ms)
+async def explain_sql(sql: str, db_id: str, enforce_limit: bool = True) -> dict:
+    """
+    Dry run: plan the SQL exactly as execute_sql would run it with
+    EXPLAIN (VERBOSE, FORMAT JSON), without executing it. Raises DryRunError on planner
+    errors and QueryTooExpensive when the per-db_id thresholds are exceeded.
+    Returns the top plan node.
+    """
+    sql = await _prepare_sql(sql, db_id, enforce_limit)
+
+    async with _acquire(db_id, read_only=True) as (_, conn):
         try:
-            await conn.execute("SET LOCAL statement_timeout = 60000;")  # 60s
+            async with conn.transaction(readonly=True):
+                await _set_statement_timeout(conn)
+                raw = await conn.fetchval(f"EXPLAIN (VERBOSE, FORMAT JSON) {sql.strip().rstrip(';')}")
+        except asyncpg.PostgresError as e:
+            raise DryRunError(f"Planner error: {e}") from e
+
+    plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+    _check_plan(plan, db_id)
+    return plan
+
+
+def _coerce_param(value, type_name: str):
+    """Convert a textual template value to the type Postgres inferred for its $n."""
+    if not isinstance(value, str):
+        return value
+    if type_name in ("int2", "int4", "int8"):
+        return int(value)
+    if type_name in ("float4", "float8"):
+        return float(value)
+    if type_name == "numeric":
+        return Decimal(value)
+    if type_name == "date":
+        return date.fromisoformat(value)
+    if type_name in ("timestamp", "timestamptz"):
+        return datetime.fromisoformat(value)
+    if type_name == "bool":
+        return value.lower() in ("true", "t", "yes", "1")
+    return value
+
+
+async def _prepared(conn, key: str, name: str, sql: str):
+    """Per-connection prepared statement for `name`, prepared on first use."""
+    cache = _statements.setdefault((key, conn.get_server_pid()), {})
+    entry = cache.get(name)
+    if entry is not None and entry[0] == sql:
+        _statement_stats["reused"] += 1
+        return entry[1]
+    stmt = await conn.prepare(sql)
+    cache[name] = (sql, stmt)
+    _statement_stats["prepared"] += 1
+    return stmt
+
+
+def _bind(stmt, params: List) -> List:
+    return [_coerce_param(v, t.name) for v, t in zip(params, stmt.get_parameters())]
+
+
+def statement_stats() -> dict:
+    return {**_statement_stats, "connections": len(_statements)}
+
+
+class Records(list):
+    """asyncpg records; `columns` lists (name, Postgres type) when there are no rows to read them from."""
+
+    def __init__(self, rows=(), columns=()):
+        super().__init__(rows)
+        self.columns = list(columns)
+
+
+def _columns(stmt) -> list:
+    return [(attr.name, attr.type.name) for attr in stmt.get_attributes()]
+
+
+async def fetch_records(
+    sql: str,
+    db_id: str,
+    enforce_limit: bool = True,
+    params: Optional[List] = None,
+    statement: Optional[str] = None,
+    primary: bool = False,
+):
+    """
+    Execute and return the raw asyncpg records (used by columnar encoders).
+    With `statement`, the SQL is trusted $n-parameterized template SQL: it is
+    run through a prepared statement cached under that name, binding `params`.
+    `primary` skips the read replicas (results that are kept, not just served).
+    """
+    if statement is None:
+        sql = await _prepare_sql(sql, db_id, enforce_limit)
+
+    async with _acquire(db_id, read_only=not primary) as (key, conn):
+        async with conn.transaction(readonly=True):
+            await _set_statement_timeout(conn)
+            if statement is not None:
+                stmt = await _prepared(conn, key, statement, sql)
+                return Records(await stmt.fetch(*_bind(stmt, params or [])), _columns(stmt))
             rows = await conn.fetch(sql)
-            return [dict(r) for r in rows]
-        except Exception as e:
-            raise
+            if rows:
+                return Records(rows)  # columns and types come from the records
+            # an empty result carries no columns: describe the statement for them
+            return Records(rows, _columns(await conn.prepare(sql)))
+
+
+async def execute_sql(
+    sql: str,
+    db_id: str,
+    enforce_limit: bool = True,
+    params: Optional[List] = None,
+    statement: Optional[str] = None,
+):
+    rows = await fetch_records(sql, db_id, enforce_limit, params, statement)
+    return [dict(r) for r in rows]
+
+
+async def stream_sql(
+    sql: str,
+    db_id: str,
+    enforce_limit: bool = True,
+    prefetch: int | None = None,
+    params: Optional[List] = None,
+    statement: Optional[str] = None,
+):
+    """
+    Execute SQL through a server-side cursor and yield lists of at most
+    `prefetch` records as they arrive, so only one batch is held in memory.
+    The connection and transaction stay open until the generator is exhausted
+    or closed (e.g. the client disconnects).
+    """
+    if statement is None:
+        sql = await _prepare_sql(sql, db_id, enforce_limit)
+    prefetch = prefetch or settings.STREAM_PREFETCH
+
+    async with _acquire(db_id, read_only=True) as (key, conn):
+        # cursors only live inside a transaction
+        async with conn.transaction(readonly=True):
+            await _set_statement_timeout(conn)
+            if statement is not None:
+                stmt = await _prepared(conn, key, statement, sql)
+                cursor = await stmt.cursor(*_bind(stmt, params or []))
+            else:
+                cursor = await conn.cursor(sql.strip().rstrip(";"))
+            while True:
+                batch = await cursor.fetch(prefetch)
+                if not batch:
+                    break
+                yield batch
+                if len(batch) < prefetch:
+                    break
+
+
+async def open_stream(
+    sql: str,
+    db_id: str,
+    enforce_limit: bool = True,
+    params: Optional[List] = None,
+    statement: Optional[str] = None,
+):
+    """
+    stream_sql with the first batch already fetched, so SQL errors raise here
+    (where the caller can still repair the query) instead of mid-response.
+    """
+    batches = stream_sql(sql, db_id, enforce_limit, params=params, statement=statement)
+    try:
+        first = await batches.__anext__()
+    except StopAsyncIteration:
+        first = []
+
+    async def _all_batches():
+        if first:
+            yield first
+            async for batch in batches:
+                yield batch
+
+    return _all_batches()
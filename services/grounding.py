@@ -4,6 +4,7 @@ import os
 import json
 import numpy as np
 from sentence_transformers import SentenceTransformer
+from services import catalog
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
 SCHEMA_DIR = os.path.join(DATA_DIR, "schemas")
@@ -18,17 +19,50 @@ _model = SentenceTransformer("all-MiniLM-L6-v2")
 # Load schema & emb cache
 # ------------------------
 
+_schema_cache = {}  # db_id -> (mtime_ns, schema)
+
+
+def _schema_path(db_id: str):
+    return os.path.join(SCHEMA_DIR, f"{db_id}_schema.json")
+
+
+def schema_version(db_id: str) -> str:
+    """
+    Cheap version token for the schema: the live catalog snapshot version when
+    the refresher has published one, else the schema file mtime.
+    """
+    snapshot = catalog.current(db_id)
+    if snapshot is not None:
+        return snapshot.version
+    try:
+        return str(os.stat(_schema_path(db_id)).st_mtime_ns)
+    except FileNotFoundError:
+        return "missing"
+
+
 def load_schema(db_id: str):
     """
     Public: load stored schema JSON for given db_id.
     Returns dict with keys: "tables", "relationships"
+    Served from the live catalog snapshot when one is published; otherwise the
+    parsed file is cached until it changes. Treat the result as read-only.
     """
-    path = os.path.join(SCHEMA_DIR, f"{db_id}_schema.json")
-    if not os.path.exists(path):
+    snapshot = catalog.current(db_id)
+    if snapshot is not None:
+        return snapshot.schema
+    path = _schema_path(db_id)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
         # return minimal fallback to avoid crash; caller should handle real schema presence
         return {"tables": {}, "relationships": []}
+    cached = _schema_cache.get(db_id)
+    if cached and cached[0] == mtime:
+        return cached[1]
     with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+        schema = json.load(f)
+    _schema_cache[db_id] = (mtime, schema)
+    return schema
 
 
 def _emb_path(db_id: str):
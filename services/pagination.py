@@ -0,0 +1,173 @@
+# services/pagination.py
+"""
+Paginated answers through held server-side cursors. The first page of a
+query is returned with an opaque continuation token; later pages are fetched
+from the same cursor (same transaction, so the pages are consistent) without
+running the LLM pipeline again. Each open cursor holds a pool connection, so
+cursors expire after PAGINATION_TTL_SECONDS of inactivity and only
+PAGINATION_MAX_OPEN of them are kept (the least recently used is closed).
+"""
+import asyncio
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from core.config import settings
+from services import admission, executor
+
+
+@dataclass
+class Page:
+    rows: list  # asyncpg records
+    next_token: Optional[str] = None  # None once the result is exhausted
+
+
+@dataclass
+class _Cursor:
+    sql: str
+    db_id: str
+    page_size: int
+    batches: object  # executor.stream_sql generator
+    expires_at: float
+    pages: int = 1
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    tenant: Optional[tuple] = None  # admission (tenant, capped) of the request that opened it
+
+
+class TokenExpired(Exception):
+    """Unknown, expired or already exhausted continuation token."""
+
+
+_cursors: "OrderedDict[str, _Cursor]" = OrderedDict()
+_stats = {"opened": 0, "pages": 0, "exhausted": 0, "expired": 0, "evicted": 0}
+
+
+def page_size(requested: int) -> int:
+    return max(1, min(requested, settings.PAGINATION_MAX_PAGE_SIZE))
+
+
+async def _close(token: str, reason: str):
+    # callers hold the cursor's lock: closing a generator that a page fetch
+    # is still awaiting fails ("asynchronous generator is already running")
+    cursor = _cursors.pop(token, None)
+    if cursor is None:
+        return
+    _stats[reason] += 1
+    # rolls back the read-only transaction and returns the connection
+    await cursor.batches.aclose()
+
+
+async def _close_unlocked(token: str, reason: str) -> bool:
+    """Close a cursor once no page fetch is running on it; False if it is gone by then."""
+    cursor = _cursors.get(token)
+    if cursor is None:
+        return False
+    async with cursor.lock:
+        if _cursors.get(token) is not cursor:
+            return False
+        await _close(token, reason)
+    return True
+
+
+async def sweep():
+    """Close cursors whose TTL has passed (cursors serving a page are skipped)."""
+    now = time.monotonic()
+    for token in [t for t, c in _cursors.items() if c.expires_at <= now]:
+        cursor = _cursors.get(token)
+        if cursor is None or cursor.lock.locked() or cursor.expires_at > now:
+            continue
+        await _close_unlocked(token, "expired")
+
+
+async def first_page(
+    sql: str,
+    db_id: str,
+    size: int,
+    params: Optional[List] = None,
+    statement: Optional[str] = None,
+) -> Page:
+    """
+    Open a cursor over the whole (un-LIMITed) result and return its first
+    page. SQL errors raise here, before any token is handed out.
+    """
+    await sweep()
+    size = page_size(size)
+    batches = executor.stream_sql(sql, db_id, enforce_limit=False, prefetch=size, params=params, statement=statement)
+    try:
+        rows = await batches.__anext__()
+    except StopAsyncIteration:
+        return Page(rows=[])
+    if len(rows) < size:
+        await batches.aclose()
+        return Page(rows=rows)
+
+    while len(_cursors) >= settings.PAGINATION_MAX_OPEN:
+        # least recently used idle cursor; if all are serving a page, wait for the oldest
+        idle = next((t for t, c in _cursors.items() if not c.lock.locked()), None)
+        await _close_unlocked(idle or next(iter(_cursors)), "evicted")
+    token = secrets.token_urlsafe(24)
+    _cursors[token] = _Cursor(
+        sql=sql,
+        db_id=db_id,
+        page_size=size,
+        batches=batches,
+        expires_at=time.monotonic() + settings.PAGINATION_TTL_SECONDS,
+        tenant=admission.current(),
+    )
+    _stats["opened"] += 1
+    _stats["pages"] += 1
+    return Page(rows=rows, next_token=token)
+
+
+def tenant_of(token: str) -> Optional[tuple]:
+    """Admission (tenant, capped) to fetch the token's next page under, None if unknown."""
+    cursor = _cursors.get(token)
+    return None if cursor is None else cursor.tenant
+
+
+async def next_page(token: str) -> tuple[str, Page]:
+    """(sql, page) for a continuation token. Raises TokenExpired."""
+    await sweep()
+    cursor = _cursors.get(token)
+    if cursor is None:
+        raise TokenExpired("Continuation token is unknown or has expired")
+    async with cursor.lock:
+        if token not in _cursors:
+            raise TokenExpired("Continuation token is unknown or has expired")
+        try:
+            rows = await cursor.batches.__anext__()
+        except StopAsyncIteration:
+            rows = []
+        except Exception:
+            await _close(token, "exhausted")
+            raise
+        _stats["pages"] += 1
+        if len(rows) < cursor.page_size:
+            await _close(token, "exhausted")
+            return cursor.sql, Page(rows=rows)
+        cursor.pages += 1
+        cursor.expires_at = time.monotonic() + settings.PAGINATION_TTL_SECONDS
+        if token in _cursors:
+            _cursors.move_to_end(token)
+        return cursor.sql, Page(rows=rows, next_token=token)
+
+
+async def close(token: str) -> bool:
+    """Release a cursor early (client is done). False if the token is unknown."""
+    return await _close_unlocked(token, "exhausted")
+
+
+async def reaper():
+    """Background loop closing idle cursors so their connections go back to the pool."""
+    while True:
+        await asyncio.sleep(max(1.0, settings.PAGINATION_TTL_SECONDS / 4))
+        try:
+            await sweep()
+        except Exception as e:
+            print(f"Cursor reaper error: {e}")
+
+
+def stats() -> dict:
+    return {**_stats, "open": len(_cursors)}
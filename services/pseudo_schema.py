@@ -1,19 +1,25 @@
-import asyncio
 import json
 import re
-from tenacity import retry, wait_exponential, stop_after_attempt
+from tenacity import retry, retry_if_not_exception_type, wait_exponential, stop_after_attempt
+from core import deadline
 from core.llm import LLM_API_1
 from core.prompts import PSEUDO_SCHEMA_SYSTEM, PSEUDO_SCHEMA_USER
 
-@retry(wait=wait_exponential(min=1, max=10), stop=stop_after_attempt(3))
-def _call_llm_sync(user_prompt: str, model: str):
-    resp = LLM_API_1.chat.completions.create(
+@retry(
+    wait=wait_exponential(min=1, max=10),
+    stop=stop_after_attempt(3),
+    retry=retry_if_not_exception_type(deadline.DeadlineExceeded),
+)
+async def _call_llm(user_prompt: str, model: str):
+    timeout = deadline.check("pseudo-schema LLM call")
+    resp = await LLM_API_1.chat.completions.create(
         model=model,
         messages=[
             {"role": "system", "content": PSEUDO_SCHEMA_SYSTEM},
             {"role": "user", "content": user_prompt},
         ],
         temperature=0.0,
+        timeout=timeout,
     )
     return resp
 
@@ -24,10 +30,7 @@ async def generate_pseudo_schema(question: str, table_hints=None) -> list:
         question=question
     )
 
-    loop = asyncio.get_running_loop()
-    resp = await loop.run_in_executor(
-        None, _call_llm_sync, user_prompt, "gpt-4o-mini"
-    )
+    resp = await _call_llm(user_prompt, "gpt-4o-mini")
 
     content = resp.choices[0].message.content
 
@@ -1,6 +1,22 @@
+import json
+import os
 import re
+from collections import deque
 from dataclasses import dataclass
-from typing import Callable, Optional
+from typing import Callable, Dict, List, Optional, Sequence
+
+from services.sql_lexer import tokenize
+
+try:
+    import yaml
+except ImportError:  # optional: JSON registries work without it
+    yaml = None
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+# per-db_id registries: <db_id>.json, <db_id>.yaml or <db_id>.yml
+TEMPLATE_DIR = os.path.join(DATA_DIR, "templates")
+# db_ids name files under data/: nothing that could leave the directory
+DB_ID_RE = re.compile(r"^[A-Za-z0-9_-]+$")
 
 
 @dataclass
@@ -11,55 +27,194 @@ class TemplateContext:
     to_date: Optional[str]
 
 
+# Values a template can bind, extracted from the question. Built-in templates
+# bind all three, in this order; registry templates pick their own slots.
+PARAM_NAMES = ("tenant_id", "from_date", "to_date")
+
+
 @dataclass
 class QueryTemplate:
     name: str
-    matcher: Callable[[str], bool]
+    # matches when every keyword occurs in the lower-cased question
+    keywords: List[str]
     renderer: Callable[[TemplateContext], str]
+    # slot bound to $1, $2, ...
+    param_names: Sequence[str] = PARAM_NAMES
+    # when set, the question's question_shape() must also equal it exactly
+    shape: Optional[str] = None
+
+    @property
+    def specificity(self) -> tuple[int, int]:
+        """More keywords, then more keyword characters, means more specific."""
+        return len(self.keywords), sum(len(k) for k in self.keywords)
+
+
+@dataclass
+class RenderedTemplate:
+    """
+    Template SQL with $n placeholders plus the values to bind. The SQL text
+    depends only on the template, so it can be prepared once per connection
+    and cached under `name`.
+    """
+    name: str
+    sql: str
+    params: List[Optional[str]]
+    param_names: Sequence[str] = PARAM_NAMES
+
+    @property
+    def missing(self) -> List[str]:
+        return [name for name, value in zip(self.param_names, self.params) if value is None]
+
+    @property
+    def to_date(self) -> Optional[str]:
+        if "to_date" not in self.param_names:
+            return None
+        return self.params[list(self.param_names).index("to_date")]
 
 
 def _normalize(question: str) -> str:
     return question.lower()
 
 
-def _contains_all(keywords: list[str]) -> Callable[[str], bool]:
-    def _match(question: str) -> bool:
-        q = _normalize(question)
-        return all(keyword in q for keyword in keywords)
-
-    return _match
+class _Automaton:
+    """Aho-Corasick automaton: every keyword occurrence in one pass over the text."""
+
+    def __init__(self, words: Sequence[str]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[tuple] = [()]
+        for word_id, word in enumerate(words):
+            state = 0
+            for ch in word:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                state = nxt
+            self.out[state] += (word_id,)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                if state:
+                    f = self.fail[state]
+                    while f and ch not in self.goto[f]:
+                        f = self.fail[f]
+                    self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] += self.out[self.fail[nxt]]
+
+    def find(self, text: str) -> set:
+        """ids of the words occurring in text."""
+        goto, fail, out = self.goto, self.fail, self.out
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class TemplateMatcher:
+    """
+    Compiled matcher over a template list: one automaton over all distinct
+    keywords, and each template indexed under its rarest keyword. The
+    question is normalized and scanned once; only templates whose rarest
+    keyword occurs are checked, and the most specific full match wins (list
+    order breaks ties).
+    """
+
+    def __init__(self, templates: Sequence[QueryTemplate]):
+        self.templates = list(templates)
+        keyword_ids: Dict[str, int] = {}
+        self._keyword_ids: List[frozenset] = [
+            frozenset(keyword_ids.setdefault(k, len(keyword_ids)) for k in t.keywords)
+            for t in self.templates
+        ]
+        frequency = [0] * len(keyword_ids)
+        for ids in self._keyword_ids:
+            for word_id in ids:
+                frequency[word_id] += 1
+        self._anchors: Dict[int, List[int]] = {}
+        for index, ids in enumerate(self._keyword_ids):
+            if ids:
+                self._anchors.setdefault(min(ids, key=frequency.__getitem__), []).append(index)
+        self._automaton = _Automaton(list(keyword_ids))
+        self._rank = [(t.specificity, -i) for i, t in enumerate(self.templates)]
+
+    def match(self, question: str) -> Optional[QueryTemplate]:
+        found = self._automaton.find(_normalize(question))
+        best = None
+        shape = None
+        for word_id in found:
+            for index in self._anchors.get(word_id, ()):
+                if not found.issuperset(self._keyword_ids[index]):
+                    continue
+                if best is not None and self._rank[index] <= self._rank[best]:
+                    continue
+                required = self.templates[index].shape
+                if required is not None:
+                    shape = shape or question_shape(question)
+                    if shape != required:
+                        continue
+                best = index
+        return None if best is None else self.templates[best]
+
+
+_DATE_RE = re.compile(r"'(\d{4}-\d{2}-\d{2})'")
+_BARE_DATE_RE = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+_TENANT_RE = re.compile(r"tenant\s*(?:id|=)?\s*(\d+)")
 
 
 def _extract_dates(question: str) -> tuple[Optional[str], Optional[str]]:
-    date_pattern = re.compile(r"'(\d{4}-\d{2}-\d{2})'")
-    matches = date_pattern.findall(question)
+    matches = _DATE_RE.findall(question)
     if len(matches) >= 2:
         return matches[0], matches[1]
 
-    bare_pattern = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
-    matches = bare_pattern.findall(question)
+    matches = _BARE_DATE_RE.findall(question)
     if len(matches) >= 2:
         return matches[0], matches[1]
     return None, None
 
 
 def _extract_tenant(question: str) -> Optional[str]:
-    match = re.search(r"tenant\s*(?:id|=)?\s*(\d+)", question.lower())
+    match = _TENANT_RE.search(question.lower())
     if match:
         return match.group(1)
     return None
 
 
+def question_shape(question: str) -> str:
+    """
+    The question with its slot values (tenant id, dates) abstracted and
+    punctuation/spacing normalized: "Fatal calls for tenant 7 between
+    '2024-01-01' and '2024-01-31'?" -> "fatal calls for tenant {tenant_id}
+    between {date} and {date}". Other numbers stay, they change the answer.
+    """
+    q = _BARE_DATE_RE.sub("{date}", _normalize(question))
+    q = _TENANT_RE.sub("tenant {tenant_id}", q)
+    return " ".join(re.sub(r"[^\w{}]+", " ", q).split())
+
+
+# Placeholders only: values are bound at execution from RenderedTemplate.params,
+# so one template always produces the same SQL text.
 def _resolve_tenant(ctx: TemplateContext) -> str:
-    return ctx.tenant_id or ":tenant_id"
+    return "$1"
 
 
 def _resolve_from_date(ctx: TemplateContext) -> str:
-    return f"'{ctx.from_date}'" if ctx.from_date else ":from_date"
+    return "$2"
 
 
 def _resolve_to_date(ctx: TemplateContext) -> str:
-    return f"'{ctx.to_date}'" if ctx.to_date else ":to_date"
+    return "$3"
 
 
 def _common_where(ctx: TemplateContext) -> str:
@@ -221,40 +376,65 @@ def _propensity_score_gte_three(ctx: TemplateContext) -> str:
     )
 
 
+# The single-value templates above as data, for code computing several of
+# them in one statement (dashboard FILTER aggregates, rollup counters, day
+# cache partials): the row predicate of each count template and the column of
+# each average. test_dashboard checks them against the template SQL.
+MANDATORY_INFO_SHARED = (
+    "exists (select 1 from jsonb_array_elements(scoring_parameters) as sp "
+    "where sp->>'name' = 'Mandatory Information shared' and sp->>'status' = 'Yes')"
+)
+COUNT_PREDICATES: Dict[str, str] = {
+    "fatal_calls": "is_fatal_call = true",
+    "disconnected_calls": "is_disconnected = false",
+    "ztp_calls": "is_ztp = true",
+    "customer_emotion_positive": "customer_emotion = 'positive'",
+    "call_score_gt_85": "call_score > 85",
+    "call_intent_buy": "call_intent = 'Intent to Buy'",
+    "propensity_score_gte_three": "propensity_score >= 3",
+    "mandatory_information_shared": MANDATORY_INFO_SHARED,
+}
+AVERAGE_COLUMNS: Dict[str, str] = {
+    "avg_call_score": "call_score",
+    "avg_handling_time": "handling_time",
+    "avg_agent_skill_score": "agent_skill_score",
+}
+
+
 TEMPLATES: list[QueryTemplate] = [
-    QueryTemplate("fatal_calls", _contains_all(["fatal", "call", "count"]), _fatal_calls),
+    QueryTemplate("fatal_calls", ["fatal", "call", "count"], _fatal_calls),
     QueryTemplate(
-        "disconnected_calls", _contains_all(["disconnected", "count"]), _disconnected_calls
+        "disconnected_calls", ["disconnected", "count"], _disconnected_calls
     ),
-    QueryTemplate("ztp_calls", _contains_all(["ztp", "count"]), _ztp_calls),
-    QueryTemplate("avg_call_score", _contains_all(["avg", "call", "score"]), _avg_call_score),
-    QueryTemplate("audit_sheet", _contains_all(["audit", "sheet"]), _audit_sheet_counts),
-    QueryTemplate("total_duration", _contains_all(["duration"]), _total_duration),
+    QueryTemplate("ztp_calls", ["ztp", "count"], _ztp_calls),
+    QueryTemplate("avg_call_score", ["avg", "call", "score"], _avg_call_score),
+    QueryTemplate("audit_sheet", ["audit", "sheet"], _audit_sheet_counts),
+    QueryTemplate("total_duration", ["duration"], _total_duration),
     QueryTemplate(
         "customer_emotion_positive",
-        _contains_all(["customer", "emotion", "positive"]),
+        ["customer", "emotion", "positive"],
         _customer_emotion_positive,
     ),
-    QueryTemplate("call_score_gt_85", _contains_all(["call", "score", "85"]), _call_score_gt_85),
-    QueryTemplate("call_intent_buy", _contains_all(["intent", "buy"]), _call_intent_buy),
+    QueryTemplate("call_score_gt_85", ["call", "score", "85"], _call_score_gt_85),
+    QueryTemplate("call_intent_buy", ["intent", "buy"], _call_intent_buy),
     QueryTemplate(
         "mandatory_information_shared",
-        _contains_all(["mandatory", "information", "shared"]),
+        ["mandatory", "information", "shared"],
         _mandatory_information_shared,
     ),
-    QueryTemplate("agent_wise", _contains_all(["agent", "call", "count"]), _agent_wise_count),
+    QueryTemplate("agent_wise", ["agent", "call", "count"], _agent_wise_count),
     QueryTemplate(
-        "disposition_wise", _contains_all(["disposition", "call", "count"]), _disposition_wise_count
+        "disposition_wise", ["disposition", "call", "count"], _disposition_wise_count
     ),
-    QueryTemplate("avg_handling_time", _contains_all(["avg", "handling", "time"]), _avg_handling_time),
+    QueryTemplate("avg_handling_time", ["avg", "handling", "time"], _avg_handling_time),
     QueryTemplate(
         "avg_agent_skill_score",
-        _contains_all(["agent", "skill", "score"]),
+        ["agent", "skill", "score"],
         _avg_agent_skill_score,
     ),
     QueryTemplate(
         "propensity_score_gte_three",
-        _contains_all(["propensity", "score"]),
+        ["propensity", "score"],
         _propensity_score_gte_three,
     ),
 ]
@@ -266,10 +446,156 @@ def _build_context(question: str) -> TemplateContext:
     return TemplateContext(question=question, tenant_id=tenant_id, from_date=from_date, to_date=to_date)
 
 
-def match_template(question: str) -> Optional[str]:
-    ctx = _build_context(question)
-    for template in TEMPLATES:
-        if template.matcher(question):
-            return template.renderer(ctx)
+_matcher = TemplateMatcher(TEMPLATES)
+_builtin_sql = {t.name: t.renderer(_build_context("")) for t in TEMPLATES}
+
+
+def is_builtin(template: RenderedTemplate) -> bool:
+    """True for a built-in template; a registry entry may reuse its name with other SQL."""
+    return _builtin_sql.get(template.name) == template.sql
+
+
+# ------------------------
+# Declarative registry
+# ------------------------
+
+class RegistryError(ValueError):
+    """A registry file that cannot be compiled; the previous set stays active."""
+
+
+_registries = {}  # db_id -> ((path, mtime_ns) or None, TemplateMatcher)
+
+
+def valid_db_id(db_id: Optional[str]) -> bool:
+    return bool(db_id) and DB_ID_RE.match(db_id) is not None
+
+
+def _registry_path(db_id: str) -> Optional[str]:
+    if not valid_db_id(db_id):
+        return None
+    for ext in (".json", ".yaml", ".yml"):
+        path = os.path.join(TEMPLATE_DIR, f"{db_id}{ext}")
+        if os.path.exists(path):
+            return path
     return None
 
+
+def promoted_path(db_id: str) -> str:
+    """Machine-maintained registry of templates promoted from LLM answers."""
+    if not valid_db_id(db_id):
+        raise ValueError(f"Invalid db_id {db_id!r}")
+    return os.path.join(TEMPLATE_DIR, f"{db_id}.promoted.json")
+
+
+def _stamp(path: Optional[str]):
+    try:
+        stat = os.stat(path) if path else None
+    except FileNotFoundError:
+        return None
+    # size too: two quick rewrites can share an mtime on coarse filesystems
+    return (path, stat.st_mtime_ns, stat.st_size) if stat else None
+
+
+def _read_registry(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        if yaml is None:
+            raise RegistryError(f"{path}: YAML registries require PyYAML (pip install pyyaml)")
+        return yaml.safe_load(f) or {}
+
+
+def _compile_entry(entry: dict, source: str) -> QueryTemplate:
+    name = entry.get("name")
+    keywords = entry.get("keywords")
+    sql = entry.get("sql")
+    slots = entry.get("params", list(PARAM_NAMES))
+    if not name or not isinstance(sql, str) or not sql.strip():
+        raise RegistryError(f"{source}: every template needs a name and sql")
+    if not keywords or not all(isinstance(k, str) and k.strip() for k in keywords):
+        raise RegistryError(f"{source}: template '{name}' needs a non-empty keyword list")
+    unknown = [slot for slot in slots if slot not in PARAM_NAMES]
+    if unknown:
+        raise RegistryError(f"{source}: template '{name}' has unknown params {unknown}; known: {list(PARAM_NAMES)}")
+    placeholders = {int(tok.text[1:]) for tok in tokenize(sql) if tok.kind == "param"}
+    if placeholders and max(placeholders) > len(slots):
+        raise RegistryError(f"{source}: template '{name}' uses ${max(placeholders)} but binds {len(slots)} params")
+    return QueryTemplate(
+        name=name,
+        keywords=[k.strip().lower() for k in keywords],
+        renderer=lambda ctx, sql=sql: sql,
+        param_names=tuple(slots),
+        shape=entry.get("shape"),
+    )
+
+
+def compile_registry(data: dict, source: str = "registry") -> List[QueryTemplate]:
+    """
+    Registry document -> templates. Format (JSON or YAML):
+        {"templates": [{"name": ..., "keywords": [...], "sql": "... $1 ...",
+                        "params": ["tenant_id", "from_date", "to_date"]}]}
+    "params" names the slot bound to each $n and defaults to all three.
+    Optional: "shape" (exact question_shape to require) and "enabled": false.
+    """
+    entries = data.get("templates") if isinstance(data, dict) else None
+    if not isinstance(entries, list):
+        raise RegistryError(f"{source}: expected a top-level 'templates' list")
+    templates = [_compile_entry(entry, source) for entry in entries if entry.get("enabled", True)]
+    names = [t.name for t in templates]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise RegistryError(f"{source}: duplicate template names {duplicates}")
+    return templates
+
+
+def _matcher_for(db_id: Optional[str]) -> TemplateMatcher:
+    """
+    Built-in templates plus the db_id registry and promoted templates,
+    recompiled when either file changes. The new matcher is built completely
+    before it replaces the old one, so a request sees either the previous set
+    or the new one; a file that fails to compile (e.g. caught mid-write)
+    leaves the previous set.
+    """
+    if not valid_db_id(db_id):
+        return _matcher
+    paths = (_registry_path(db_id), promoted_path(db_id))
+    stamp = tuple(_stamp(path) for path in paths)
+    cached = _registries.get(db_id)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    if stamp == (None, None):
+        matcher = _matcher
+    else:
+        try:
+            registry, promoted = (
+                compile_registry(_read_registry(st[0]), st[0]) if st else [] for st in stamp
+            )
+        except Exception as e:
+            print(f"Warning: template registry for '{db_id}' not loaded: {e}")
+            matcher = cached[1] if cached else _matcher
+        else:
+            # order breaks specificity ties: hand-written registry entries,
+            # then built-ins, then promoted ones; names shadow later entries
+            seen = set()
+            merged = []
+            for template in registry + TEMPLATES + promoted:
+                if template.name not in seen:
+                    seen.add(template.name)
+                    merged.append(template)
+            matcher = TemplateMatcher(merged)
+            print(f"Loaded {len(registry)} registry and {len(promoted)} promoted templates for '{db_id}'")
+    _registries[db_id] = (stamp, matcher)
+    return matcher
+
+
+def match_template(question: str, db_id: Optional[str] = None) -> Optional[RenderedTemplate]:
+    template = _matcher_for(db_id).match(question)
+    if template is None:
+        return None
+    ctx = _build_context(question)
+    return RenderedTemplate(
+        name=template.name,
+        sql=template.renderer(ctx),
+        params=[getattr(ctx, slot) for slot in template.param_names],
+        param_names=template.param_names,
+    )
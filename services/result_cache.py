@@ -0,0 +1,91 @@
+# services/result_cache.py
+"""
+In-process TTL + LRU cache for query results, keyed by db_id, token-normalized
+SQL and bound parameters. Template queries get per-template TTLs, and ranges
+that ended before the DAY_CACHE_SETTLE_DAYS window (late rows have arrived)
+get a much longer one.
+"""
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Hashable, List, Optional, Tuple
+
+from core.config import settings
+from services.sql_lexer import tokenize
+
+_entries: "OrderedDict[Hashable, Tuple[float, list]]" = OrderedDict()  # key -> (expires_at, records)
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0, "template_hits": {}}
+
+
+def normalize_sql(sql: str) -> str:
+    """Whitespace, comments and a trailing ';' do not change the key; literals do."""
+    return " ".join(tok.text for tok in tokenize(sql) if tok.text != ";")
+
+
+def _key(db_id: str, sql: str, params: Optional[List]) -> Hashable:
+    return (db_id, normalize_sql(sql), tuple(params or ()))
+
+
+def ttl_for(template: Optional[str] = None, to_date: Optional[str] = None) -> float:
+    """Seconds to keep a result; 0 disables caching."""
+    if not settings.RESULT_CACHE_ENABLED:
+        return 0
+    if to_date:
+        try:
+            # same settle window as the day cache: recent days still get late rows
+            if date.fromisoformat(to_date) < date.today() - timedelta(days=settings.DAY_CACHE_SETTLE_DAYS):
+                return settings.RESULT_CACHE_HISTORICAL_TTL
+        except ValueError:
+            pass
+    if template:
+        return settings.RESULT_CACHE_TEMPLATE_TTLS.get(template, settings.RESULT_CACHE_TTL)
+    return settings.RESULT_CACHE_TTL
+
+
+def get(db_id: str, sql: str, params: Optional[List] = None, template: Optional[str] = None) -> Optional[list]:
+    key = _key(db_id, sql, params)
+    entry = _entries.get(key)
+    if entry is not None:
+        expires_at, records = entry
+        if expires_at > time.monotonic():
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+            if template:
+                _stats["template_hits"][template] = _stats["template_hits"].get(template, 0) + 1
+            return records
+        del _entries[key]
+        _stats["expired"] += 1
+    _stats["misses"] += 1
+    return None
+
+
+def put(db_id: str, sql: str, params: Optional[List], records: list, ttl: float):
+    # big results would crowd out everything else; they are not worth pinning
+    if ttl <= 0 or len(records) > settings.RESULT_CACHE_MAX_ROWS:
+        return
+    key = _key(db_id, sql, params)
+    _entries[key] = (time.monotonic() + ttl, records)
+    _entries.move_to_end(key)
+    _stats["stores"] += 1
+    while len(_entries) > settings.RESULT_CACHE_MAX_ENTRIES:
+        _entries.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+def clear(db_id: Optional[str] = None):
+    """Drop every entry, or only those of db_id (e.g. after a schema change)."""
+    if db_id is None:
+        _entries.clear()
+        return
+    for key in [k for k in _entries if k[0] == db_id]:
+        del _entries[key]
+
+
+def stats() -> dict:
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "template_hits": dict(_stats["template_hits"]),
+        "entries": len(_entries),
+        "hit_rate": _stats["hits"] / lookups if lookups else 0.0,
+    }
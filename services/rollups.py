@@ -0,0 +1,246 @@
+# services/rollups.py
+"""
+Per-tenant, per-day rollups of chatbot.call_data in their own schema
+(ROLLUP_SCHEMA), so the built-in templates read a few rows per day instead
+of scanning the raw table:
+
+- call_data_daily:              counters and sums behind the count/avg templates
+- call_data_daily_agent:        calls per agent_name
+- call_data_daily_disposition:  calls per disposition
+- call_data_daily_audit_sheet:  active calls per audit_sheet
+
+refresh() runs in the background worker on the primary. The first pass
+backfills everything; later passes recompute the last ROLLUP_LOOKBACK_DAYS
+days (late-arriving rows). Rollup answers read finished days from the
+rollup tables and today from call_data, so today's numbers stay live. When
+refreshes stop succeeding for STALE_AFTER_INTERVALS intervals, templates go
+back to the raw table.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from core.config import settings
+from services import query_templates
+
+SOURCE = "chatbot.call_data"
+# refresh intervals without a successful refresh before the rollups are not used
+STALE_AFTER_INTERVALS = 3
+
+# count template -> its counter column in call_data_daily
+COUNT_COLUMNS: Dict[str, str] = {
+    "fatal_calls": "fatal_calls",
+    "disconnected_calls": "not_disconnected_calls",
+    "ztp_calls": "ztp_calls",
+    "customer_emotion_positive": "positive_emotion_calls",
+    "call_score_gt_85": "call_score_gt_85_calls",
+    "call_intent_buy": "intent_buy_calls",
+    "propensity_score_gte_three": "propensity_gte_3_calls",
+    "mandatory_information_shared": "mandatory_info_shared_calls",
+}
+# output column of a single-value template when not "count" / "avg"
+_OUTPUT_COLUMNS = {"mandatory_information_shared": "call_count", "avg_handling_time": "avg_handling_time"}
+
+
+@dataclass(frozen=True)
+class Rollup:
+    table: str
+    group_column: Optional[str]   # besides tenant_id and date
+    measures: tuple               # "<aggregate over SOURCE> as <column>"
+    where: str = "true"           # rows of SOURCE that count
+
+
+ROLLUPS = [
+    Rollup(
+        "call_data_daily",
+        None,
+        (
+            "count(*) as calls",
+            *(
+                f"count(*) filter (where {query_templates.COUNT_PREDICATES[name]}) as {column}"
+                for name, column in COUNT_COLUMNS.items()
+            ),
+            *(
+                measure
+                for column in query_templates.AVERAGE_COLUMNS.values()
+                for measure in (f"sum({column}) as {column}_sum", f"count({column}) as {column}_n")
+            ),
+            "sum(duration) as duration_sum",
+        ),
+    ),
+    Rollup("call_data_daily_agent", "agent_name", ("count(*) as calls",)),
+    Rollup("call_data_daily_disposition", "disposition", ("count(*) as calls",)),
+    Rollup("call_data_daily_audit_sheet", "audit_sheet", ("count(*) as calls",), "is_active = true"),
+]
+_by_table = {r.table: r for r in ROLLUPS}
+
+# single-value templates over the call_data_daily rows in the "daily" CTE:
+# name -> (expression, output column of the raw template)
+DAILY_METRICS: Dict[str, Tuple[str, str]] = {
+    **{
+        name: (f"coalesce(sum({column}), 0)::bigint", _OUTPUT_COLUMNS.get(name, "count"))
+        for name, column in COUNT_COLUMNS.items()
+    },
+    **{
+        name: (f"sum({column}_sum)::numeric / nullif(sum({column}_n), 0)", _OUTPUT_COLUMNS.get(name, "avg"))
+        for name, column in query_templates.AVERAGE_COLUMNS.items()
+    },
+    "total_duration": (
+        "concat(floor(sum(duration_sum) / 3600), ' hours ', floor((sum(duration_sum) % 3600) / 60), ' minutes')",
+        "total_duration",
+    ),
+}
+
+# template name -> (rollup table, final select over the "daily" CTE)
+TEMPLATE_QUERIES: Dict[str, Tuple[str, str]] = {
+    **{
+        name: ("call_data_daily", f"select {expr} as {alias} from daily;")
+        for name, (expr, alias) in DAILY_METRICS.items()
+    },
+    "agent_wise": (
+        "call_data_daily_agent",
+        "select agent_name, sum(calls)::bigint as call_count from daily "
+        "group by agent_name order by call_count desc;",
+    ),
+    "disposition_wise": (
+        "call_data_daily_disposition",
+        "select disposition, sum(calls)::bigint as count from daily "
+        "group by disposition order by count desc;",
+    ),
+    "audit_sheet": (
+        "call_data_daily_audit_sheet",
+        "select audit_sheet, sum(calls)::bigint as call_count from daily "
+        "group by audit_sheet order by call_count desc;",
+    ),
+}
+
+_ready: Dict[str, datetime] = {}   # db_id -> last successful refresh
+_stats = {"refreshes": 0, "failures": 0, "answered": 0, "last_refresh_ms": 0.0, "last_rows": 0}
+
+
+def ready(db_id: str) -> bool:
+    """Whether db_id's rollups were refreshed recently enough to answer templates."""
+    refreshed = _ready.get(db_id)
+    if not settings.ROLLUP_ENABLED or refreshed is None:
+        return False
+    stale_after = timedelta(seconds=STALE_AFTER_INTERVALS * settings.ROLLUP_REFRESH_INTERVAL_SECONDS)
+    return datetime.now() - refreshed <= stale_after
+
+
+def _qualified(table: str) -> str:
+    return f"{settings.ROLLUP_SCHEMA}.{table}"
+
+
+def _keys(rollup: Rollup) -> str:
+    return ", ".join(["tenant_id", "date"] + ([rollup.group_column] if rollup.group_column else []))
+
+
+def aggregate_sql(rollup: Rollup, where: str) -> str:
+    """SELECT producing rollup rows from SOURCE for the rows matching `where`."""
+    return (
+        f"select {_keys(rollup)},\n" + ",\n".join(rollup.measures) + "\n"
+        f"from {SOURCE}\nwhere ({rollup.where}) and ({where})\n"
+        f"group by {_keys(rollup)}"
+    )
+
+
+def _daily_cte(rollup: Rollup) -> str:
+    # finished days from the rollup, today straight from the source
+    columns = ", ".join([_keys(rollup)] + [m.rsplit(" as ", 1)[1] for m in rollup.measures])
+    return (
+        "with daily as (\n"
+        f"select {columns} from {_qualified(rollup.table)}\n"
+        "where tenant_id = $1 and date between $2 and $3 and date < current_date\n"
+        "union all\n"
+        + aggregate_sql(rollup, "tenant_id = $1 and date between $2 and $3 and date >= current_date")
+        + "\n)\n"
+    )
+
+
+def template_sql(template: query_templates.RenderedTemplate, db_id: str) -> Optional[str]:
+    """
+    Rollup-backed SQL for a matched built-in template, binding the same $1
+    (tenant) and $2/$3 (date range); None when the rollups cannot answer it.
+    """
+    if not ready(db_id):
+        return None
+    entry = TEMPLATE_QUERIES.get(template.name)
+    if entry is None or not query_templates.is_builtin(template):
+        return None
+    return _daily_cte(_by_table[entry[0]]) + entry[1]
+
+
+def metrics_sql(names, db_id: str) -> Optional[str]:
+    """One statement computing several DAILY_METRICS, one column per template name."""
+    if not ready(db_id):
+        return None
+    select = ",\n".join(f"{DAILY_METRICS[name][0]} as {name}" for name in names)
+    return _daily_cte(_by_table["call_data_daily"]) + f"select {select}\nfrom daily;"
+
+
+def record_answer():
+    _stats["answered"] += 1
+
+
+async def _ensure_tables(conn):
+    await conn.execute(f"create schema if not exists {settings.ROLLUP_SCHEMA}")
+    await conn.execute(
+        f"create table if not exists {_qualified('refresh_state')} "
+        "(rollup text primary key, backfilled boolean not null, refreshed_at timestamptz not null)"
+    )
+    for rollup in ROLLUPS:
+        # column types follow the source table
+        await conn.execute(
+            f"create table if not exists {_qualified(rollup.table)} as "
+            f"{aggregate_sql(rollup, 'false')} with no data"
+        )
+        await conn.execute(
+            f"create index if not exists {rollup.table}_key on {_qualified(rollup.table)} ({_keys(rollup)})"
+        )
+
+
+async def _refresh_rollup(conn, rollup: Rollup) -> int:
+    backfilled = await conn.fetchval(
+        f"select backfilled from {_qualified('refresh_state')} where rollup = $1", rollup.table
+    )
+    # first pass: everything; afterwards only days that may still receive rows
+    since = f"current_date - {int(settings.ROLLUP_LOOKBACK_DAYS)}" if backfilled else "'-infinity'::date"
+    async with conn.transaction():
+        # another instance refreshing the same rollup waits instead of inserting the same days twice
+        await conn.execute("select pg_advisory_xact_lock(hashtext($1))", _qualified(rollup.table))
+        await conn.execute(f"delete from {_qualified(rollup.table)} where date >= {since}")
+        status = await conn.execute(
+            f"insert into {_qualified(rollup.table)} {aggregate_sql(rollup, f'date >= {since}')}"
+        )
+        await conn.execute(
+            f"insert into {_qualified('refresh_state')} values ($1, true, now()) "
+            "on conflict (rollup) do update set backfilled = true, refreshed_at = now()",
+            rollup.table,
+        )
+    return int(status.split()[-1])
+
+
+async def refresh(conn, db_id: str):
+    """Create missing rollup tables and bring every rollup up to date."""
+    started = datetime.now()
+    try:
+        await _ensure_tables(conn)
+        rows = 0
+        for rollup in ROLLUPS:
+            rows += await _refresh_rollup(conn, rollup)
+    except Exception:
+        _stats["failures"] += 1
+        raise
+    _ready[db_id] = datetime.now()
+    _stats["refreshes"] += 1
+    _stats["last_refresh_ms"] = (datetime.now() - started).total_seconds() * 1000
+    _stats["last_rows"] = rows
+    return rows
+
+
+def stats() -> dict:
+    return {
+        **_stats,
+        "enabled": settings.ROLLUP_ENABLED,
+        "ready": {db_id: at.isoformat(timespec="seconds") for db_id, at in _ready.items()},
+    }
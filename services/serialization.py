@@ -0,0 +1,94 @@
+# services/serialization.py
+"""
+Fast JSON path for query responses: asyncpg records (or dicts) are encoded
+straight to bytes, skipping Pydantic validation of every row and
+jsonable_encoder's recursive copy. Values come out exactly as the default
+FastAPI response would render them (Decimal as int/float, datetimes in ISO
+format, timedelta as seconds, ...). orjson and brotli are in requirements.txt;
+in an install without orjson the standard json module is used with the same
+type handlers, and without brotli only gzip is offered.
+"""
+import gzip
+import json
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from asyncpg import Record
+from fastapi import Response
+
+from core.config import settings
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+JSON_MEDIA_TYPE = "application/json"
+
+
+def _default(obj):
+    """Types neither encoder handles natively, converted like jsonable_encoder does."""
+    if isinstance(obj, Record):
+        return dict(obj)
+    if isinstance(obj, Decimal):
+        return int(obj) if obj.is_finite() and obj.as_tuple().exponent >= 0 else float(obj)
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return bytes(obj).decode()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    # UUID (including asyncpg's own UUID type), ranges, geometric types, ...
+    return str(obj)
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        # non-str keys happen with json columns decoded by a custom codec
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def negotiate_encoding(accept_encoding: str) -> str | None:
+    """'br' or 'gzip' when the client accepts it (brotli preferred), else None."""
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip()] = q
+    if brotli is not None and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str | None) -> tuple[bytes, str | None]:
+    """Compress large bodies; small ones are not worth the CPU."""
+    min_bytes = settings.RESPONSE_COMPRESSION_MIN_BYTES
+    if encoding is None or min_bytes <= 0 or len(body) < min_bytes:
+        return body, None
+    if encoding == "br":
+        return brotli.compress(body, quality=settings.RESPONSE_BROTLI_QUALITY), "br"
+    return gzip.compress(body, compresslevel=settings.RESPONSE_GZIP_LEVEL), "gzip"
+
+
+def json_response(payload, accept_encoding: str = "", headers: dict | None = None) -> Response:
+    body, encoding = compress(dumps(payload), negotiate_encoding(accept_encoding))
+    headers = dict(headers or {})
+    if encoding:
+        headers["Content-Encoding"] = encoding
+        headers["Vary"] = "Accept-Encoding"
+    return Response(content=body, media_type=JSON_MEDIA_TYPE, headers=headers)
@@ -1,32 +1,39 @@
 # services/sql_generator.py
 
-import asyncio
 import json
 import re
 from typing import Dict, List
 
-from tenacity import retry, wait_exponential, stop_after_attempt
+from tenacity import retry, retry_if_not_exception_type, wait_exponential, stop_after_attempt
 
+from core import deadline
 from core.config import settings
 from core.llm import LLM_API_1
 from core.prompts import SQL_GENERATION_SYSTEM, SQL_GENERATION_USER
 
 
 # ===========================
-# Internal LLM caller (sync)
+# Internal LLM caller (async)
 # ===========================
-@retry(wait=wait_exponential(min=1, max=10), stop=stop_after_attempt(3))
-def _call_llm_sync(system_prompt: str, user_prompt: str, model: str):
+@retry(
+    wait=wait_exponential(min=1, max=10),
+    stop=stop_after_attempt(3),
+    retry=retry_if_not_exception_type(deadline.DeadlineExceeded),
+)
+async def _call_llm(system_prompt: str, user_prompt: str, model: str):
     """
-    Blocking LLM call wrapped with retry policy.
+    LLM call wrapped with retry policy. The HTTP timeout is the time left
+    before the request deadline, and cancelling the await aborts the call.
     """
-    resp = LLM_API_1.chat.completions.create(
+    timeout = deadline.check("SQL generation LLM call")
+    resp = await LLM_API_1.chat.completions.create(
         model=model,
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ],
         temperature=0.0,
+        timeout=timeout,
     )
     return resp
 
@@ -68,10 +75,7 @@ async def generate_sql(question: str, grounded_map: Dict, relationships: List[Di
         question=question,
     )
 
-    loop = asyncio.get_running_loop()
-    resp = await loop.run_in_executor(
-        None,
-        _call_llm_sync,
+    resp = await _call_llm(
         SQL_GENERATION_SYSTEM,
         user_prompt,
         settings.SQL_GENERATION_MODEL,
@@ -119,10 +123,7 @@ Rules:
 - Return ONLY fixed SQL.
 """
 
-    loop = asyncio.get_running_loop()
-    resp = await loop.run_in_executor(
-        None,
-        _call_llm_sync,
+    resp = await _call_llm(
         SQL_GENERATION_SYSTEM,
         correction_prompt,
         settings.SQL_GENERATION_MODEL,
@@ -0,0 +1,229 @@
+# services/sql_repair.py
+"""
+Deterministic, local SQL repairs tried before asking the LLM to regenerate.
+
+Every rule is a cheap, provable rewrite against the schema we already hold:
+  - interval_quoting:      INTERVAL 7 days        -> INTERVAL '7 days'
+  - schema_qualification:  FROM call_data         -> FROM chatbot.call_data
+  - column_typo:           c.agnet_name           -> c.agent_name
+The caller re-validates the result and only falls back to the LLM when the
+rules produce nothing or the repaired SQL still fails validation.
+"""
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from services.sql_lexer import tokenize
+from services.validator import KEYWORDS, ValidationContext, scan_sql
+
+INTERVAL_UNITS = frozenset("""
+    microsecond microseconds millisecond milliseconds second seconds minute minutes
+    hour hours day days week weeks month months year years decade decades
+""".split())
+
+MAX_EDIT_DISTANCE = 2
+# short names are repaired only when closer: two edits turn 'dt' into 'id'
+SHORT_NAME_DISTANCES = ((3, 0), (8, 1))  # (max length, max edit distance)
+
+_stats = {
+    "attempts": 0,            # repair_sql calls
+    "rewrites": 0,            # calls where at least one rule fired
+    "avoided_llm_calls": 0,   # rewrites that then passed validation
+    "llm_fallbacks": 0,       # calls that still needed the LLM
+    "rules": {"interval_quoting": 0, "schema_qualification": 0, "column_typo": 0},
+}
+
+
+def _splice(sql: str, edits: List[Tuple[int, int, str]]) -> str:
+    """Apply non-overlapping (start, end, replacement) edits."""
+    out = []
+    pos = 0
+    for start, end, text in sorted(edits):
+        out.append(sql[pos:start])
+        out.append(text)
+        pos = end
+    out.append(sql[pos:])
+    return "".join(out)
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance, abandoning early once it must exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+
+def _max_distance(name: str) -> int:
+    for length, distance in SHORT_NAME_DISTANCES:
+        if len(name) <= length:
+            return distance
+    return MAX_EDIT_DISTANCE
+
+
+def _closest(name: str, candidates) -> Optional[str]:
+    """Unique closest candidate within the length-scaled edit distance, else None."""
+    limit = _max_distance(name)
+    best, best_dist, tie = None, limit + 1, False
+    for cand in candidates:
+        dist = _edit_distance(name, cand, limit)
+        if dist < best_dist:
+            best, best_dist, tie = cand, dist, False
+        elif dist == best_dist:
+            tie = True
+    if best is None or tie:
+        return None
+    return best
+
+
+def _columns_for(table: str, grounded_map: dict, context: ValidationContext) -> Optional[FrozenSet[str]]:
+    cols = context.table_cols.get(table)
+    if cols is not None:
+        return cols
+    for entry in grounded_map.values():
+        matched = (entry.get("matched_table") or "").lower()
+        if matched == table or matched == f"public.{table}":
+            return frozenset(c.lower() for c in entry.get("available_columns", []) or [])
+    return None
+
+
+# ---------------------------
+# Rules: sql -> fixed sql (or None when the rule does not apply)
+# ---------------------------
+
+def _fix_interval_quoting(sql: str, grounded_map: dict, context: ValidationContext) -> Optional[str]:
+    tokens = tokenize(sql)
+    edits = []
+    for i in range(len(tokens) - 2):
+        tok, num, unit = tokens[i], tokens[i + 1], tokens[i + 2]
+        if (
+            tok.kind == "ident" and tok.text.lower() == "interval"
+            and num.kind == "number"
+            and unit.kind == "ident" and unit.text.lower() in INTERVAL_UNITS
+        ):
+            edits.append((num.start, unit.end, f"'{num.text} {unit.text.lower()}'"))
+    return _splice(sql, edits) if edits else None
+
+
+def _fix_schema_qualification(sql: str, grounded_map: dict, context: ValidationContext) -> Optional[str]:
+    by_bare_name: Dict[str, List[str]] = {}
+    for table in context.table_cols:
+        by_bare_name.setdefault(table.rsplit(".", 1)[-1], []).append(table)
+    for entry in grounded_map.values():
+        matched = (entry.get("matched_table") or "").lower()
+        if matched and matched not in by_bare_name.get(matched.rsplit(".", 1)[-1], []):
+            by_bare_name.setdefault(matched.rsplit(".", 1)[-1], []).append(matched)
+
+    tokens = tokenize(sql)
+    edits = []
+    for i in range(1, len(tokens)):
+        tok = tokens[i]
+        prev = tokens[i - 1]
+        if tok.kind != "ident" or prev.kind != "ident" or prev.text.lower() not in ("from", "join"):
+            continue
+        name = tok.text.lower()
+        if name in KEYWORDS or name in context.table_cols:
+            continue
+        candidates = by_bare_name.get(name, [])
+        if len(candidates) == 1 and "." in candidates[0]:
+            edits.append((tok.start, tok.end, candidates[0]))
+    return _splice(sql, edits) if edits else None
+
+
+def _fix_column_typos(sql: str, grounded_map: dict, context: ValidationContext) -> Optional[str]:
+    tokens = tokenize(sql)
+    scan = scan_sql(tokens)
+    edits = []
+
+    # alias.col / table.col
+    for tok in tokens:
+        if tok.kind != "name" or '"' in tok.text:
+            continue
+        qualifier_text, _, column_text = tok.text.rpartition(".")
+        column = column_text.lower()
+        if column == "*":
+            continue
+        found, table = scan.resolve(qualifier_text.lower())
+        if not found or table is None:
+            continue
+        cols = _columns_for(table, grounded_map, context)
+        if not cols or column in cols:
+            continue
+        best = _closest(column, cols)
+        if best:
+            edits.append((tok.start, tok.end, f"{qualifier_text}.{best}"))
+
+    # bare columns, only when every relation has known columns
+    tables = {t for t in scan.relations.values() if t is not None}
+    col_sets = [_columns_for(t, grounded_map, context) for t in tables]
+    if tables and not scan.opaque and all(c is not None for c in col_sets):
+        visible = frozenset().union(*col_sets)
+        fixes = {}
+        for name in scan.unqualified:
+            if name in visible or name in scan.output_aliases or name in scan.relations:
+                continue
+            best = _closest(name, visible)
+            if best:
+                fixes[name] = best
+        if fixes:
+            for i, tok in enumerate(tokens):
+                if tok.kind != "ident" or tok.text.lower() not in fixes:
+                    continue
+                prev = tokens[i - 1].text.lower() if i else ""
+                nxt = tokens[i + 1].text if i + 1 < len(tokens) else ""
+                if prev in (".", "::", "as") or nxt == "(":
+                    continue
+                edits.append((tok.start, tok.end, fixes[tok.text.lower()]))
+
+    return _splice(sql, edits) if edits else None
+
+
+_RULES = [
+    ("interval_quoting", _fix_interval_quoting),
+    ("schema_qualification", _fix_schema_qualification),
+    ("column_typo", _fix_column_typos),
+]
+
+
+def repair_sql(sql: str, grounded_map: dict, context: ValidationContext) -> Optional[str]:
+    """
+    Run every rule in order over the SQL. Returns the rewritten SQL, or None
+    when no rule applied. The result is not validated here; report the
+    outcome with record_outcome() so the LLM-avoidance rate stays accurate.
+    """
+    _stats["attempts"] += 1
+    fixed = sql
+    applied = []
+    for name, rule in _RULES:
+        out = rule(fixed, grounded_map, context)
+        if out is not None and out != fixed:
+            fixed = out
+            applied.append(name)
+    if not applied:
+        return None
+    _stats["rewrites"] += 1
+    for name in applied:
+        _stats["rules"][name] += 1
+    print("Local SQL repair applied:", ", ".join(applied))
+    return fixed
+
+
+def record_outcome(avoided_llm: bool):
+    if avoided_llm:
+        _stats["avoided_llm_calls"] += 1
+    else:
+        _stats["llm_fallbacks"] += 1
+
+
+def stats() -> dict:
+    attempts = _stats["attempts"]
+    return {
+        **_stats,
+        "rules": dict(_stats["rules"]),
+        "llm_avoidance_rate": (_stats["avoided_llm_calls"] / attempts) if attempts else 0.0,
+    }
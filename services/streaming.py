@@ -0,0 +1,46 @@
+# services/streaming.py
+"""
+Incremental encoders for streamed query results. Each takes the batches
+produced by executor.open_stream and yields text chunks for a
+StreamingResponse, so memory is bounded by one cursor batch.
+"""
+import json
+
+from services import serialization
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _encode_batch(batch) -> list:
+    # same conversions (Decimal, datetime, UUID, ...) as the non-streaming response
+    return [serialization.dumps(row).decode() for row in batch]
+
+
+async def ndjson_rows(batches):
+    """One JSON object per line. A failure mid-stream ends with an {"error": ...} line."""
+    try:
+        async for batch in batches:
+            yield "".join(line + "\n" for line in _encode_batch(batch))
+    except Exception as e:
+        print("Streaming failed:", e)
+        yield json.dumps({"error": str(e)}) + "\n"
+
+
+async def json_document(sql: str, batches):
+    """
+    The QueryResponse shape ({"sql", "results", "error"}) written as chunks.
+    A failure mid-stream still closes the document, with "error" set.
+    """
+    yield '{"sql": ' + json.dumps(sql) + ', "results": ['
+    error = None
+    first = True
+    try:
+        async for batch in batches:
+            encoded = _encode_batch(batch)
+            if encoded:
+                yield ("" if first else ",") + ",".join(encoded)
+                first = False
+    except Exception as e:
+        print("Streaming failed:", e)
+        error = str(e)
+    yield '], "error": ' + json.dumps(error) + '}'
@@ -0,0 +1,324 @@
+# services/template_promotion.py
+"""
+Promotes recurring LLM answers into templates. Every successful
+(question, SQL) pair from the LLM pipeline is logged and abstracted into a
+shape: question_shape() of the question, and the SQL with the question's
+slot values (tenant id, dates) replaced by $n. A question shape that keeps
+producing the same SQL shape for enough different slot values becomes a
+template in data/templates/<db_id>.promoted.json, which query_templates
+hot-reloads; later questions of that exact shape skip the LLM.
+
+With PROMOTION_REQUIRE_REVIEW new templates are written disabled ("pending")
+until approved. Promoted templates that keep failing at execution are
+demoted (disabled, and never re-promoted automatically).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from core.config import settings
+from services import query_templates
+from services.executor import apply_row_limit
+from services.sql_lexer import tokenize
+
+LOG_DIR = os.path.join(query_templates.DATA_DIR, "query_log")
+NAME_PREFIX = "auto_"
+# ignored when deriving index keywords from a question shape
+STOPWORDS = {
+    "a", "an", "and", "are", "between", "by", "can", "do", "for", "from", "give", "how", "in",
+    "is", "me", "of", "on", "or", "please", "show", "the", "to", "what", "which", "with",
+}
+MAX_VALUES_TRACKED = 50
+# a slot value is only a parameter as the right-hand side of one of these
+COMPARISON_OPS = {"=", "<>", "!=", "<", ">", "<=", ">="}
+
+
+@dataclass
+class _Shape:
+    sql: str                          # parameterized SQL shape
+    slots: tuple                      # slot bound to each $n
+    count: int = 0
+    values: set = field(default_factory=set)
+    example: str = ""
+
+
+_shapes: Dict[str, Dict[str, Dict[str, _Shape]]] = {}  # db_id -> question shape -> sql shape -> stats
+_loaded: set = set()
+_lock = threading.Lock()  # every registry/log mutation runs under it, in worker threads
+_stats = {"recorded": 0, "skipped": 0, "promoted": 0, "pending": 0, "demoted": 0}
+
+
+def _is_predicate_rhs(tokens, i: int) -> bool:
+    """Whether tokens[i] is the right-hand side of a comparison or of BETWEEN ... AND."""
+    prev = tokens[i - 1].text.lower() if i >= 1 else ""
+    if prev in COMPARISON_OPS or prev == "between":
+        return True
+    return prev == "and" and i >= 3 and tokens[i - 3].text.lower() == "between"
+
+
+def abstract_sql(sql: str, question: str) -> Optional[tuple[str, tuple, tuple]]:
+    """
+    (sql shape, slots, values): the SQL with the question's slot values turned
+    into $n placeholders. Only the right-hand side of a comparison or BETWEEN
+    is replaced; None when a value is ambiguous, appears more than once or
+    outside such a predicate (LIMIT 5, ORDER BY 2), or survives in some other
+    form (the SQL would hardcode it).
+    """
+    ctx = query_templates._build_context(question)
+    values = {slot: getattr(ctx, slot) for slot in query_templates.PARAM_NAMES if getattr(ctx, slot)}
+    if len(set(values.values())) != len(values):
+        return None  # e.g. from_date == to_date: cannot tell which $n is which
+    by_literal = {}
+    for slot, value in values.items():
+        by_literal[value] = slot
+        by_literal[f"'{value}'"] = slot
+
+    date_values = [v for s, v in values.items() if s != "tenant_id"]
+    tokens = [tok for tok in tokenize(sql) if tok.kind != "comment"]
+    if any(tok.kind == "param" for tok in tokens):
+        return None
+    hits = {}
+    for i, tok in enumerate(tokens):
+        slot = by_literal.get(tok.text) if tok.kind in ("number", "string") else None
+        if slot is not None:
+            if slot in hits or not _is_predicate_rhs(tokens, i):
+                return None
+            hits[slot] = tok
+        elif tok.kind == "string" and any(value in tok.text for value in date_values):
+            return None  # e.g. '2024-01-31 23:59:59': the date would be hardcoded
+    slots = tuple(s for s in query_templates.PARAM_NAMES if s in hits)
+    number = {slot: f"${i + 1}" for i, slot in enumerate(slots)}
+    out, pos = [], 0
+    for tok, slot in sorted(((tok, slot) for slot, tok in hits.items()), key=lambda hit: hit[0].start):
+        out.append(sql[pos:tok.start])
+        out.append(number[slot])
+        pos = tok.end
+    out.append(sql[pos:])
+    shaped = " ".join("".join(out).split())
+    return apply_row_limit(shaped), slots, tuple(values[s] for s in slots)
+
+
+def _keywords(shape: str) -> List[str]:
+    words = []
+    for word in re.findall(r"[^\W_]+|\{\w+\}", shape):
+        if word.startswith("{") or word in STOPWORDS or word in words:
+            continue
+        words.append(word)
+    return words
+
+
+def _template_name(db_id: str, qshape: str) -> str:
+    return NAME_PREFIX + hashlib.md5(f"{db_id}\0{qshape}".encode()).hexdigest()[:10]
+
+
+# ------------------------
+# Promoted registry file
+# ------------------------
+
+def _read_promoted(db_id: str) -> dict:
+    try:
+        with open(query_templates.promoted_path(db_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"templates": []}
+
+
+def _write_promoted(db_id: str, data: dict):
+    # write-then-rename: the hot reloader never sees a half-written file
+    path = query_templates.promoted_path(db_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _entries(db_id: str) -> Dict[str, dict]:
+    if not query_templates.valid_db_id(db_id):
+        return {}
+    return {e["name"]: e for e in _read_promoted(db_id).get("templates", [])}
+
+
+def _save_entries(db_id: str, entries: Dict[str, dict]):
+    _write_promoted(db_id, {"templates": list(entries.values())})
+
+
+def _set_status(db_id: str, name: str, status: str) -> bool:
+    with _lock:
+        entries = _entries(db_id)
+        entry = entries.get(name)
+        if entry is None:
+            return False
+        entry["status"] = status
+        entry["enabled"] = status == "active"
+        if status == "active":
+            entry["failures"] = 0
+        _save_entries(db_id, entries)
+        return True
+
+
+def _promote(db_id: str, qshape: str, shape: _Shape, total: int):
+    entries = _entries(db_id)
+    name = _template_name(db_id, qshape)
+    if name in entries:
+        return  # already promoted, pending, or demoted on purpose
+    status = "pending" if settings.PROMOTION_REQUIRE_REVIEW else "active"
+    entries[name] = {
+        "name": name,
+        "keywords": _keywords(qshape),
+        "shape": qshape,
+        "sql": shape.sql,
+        "params": list(shape.slots),
+        "enabled": status == "active",
+        "status": status,
+        "occurrences": shape.count,
+        "agreement": round(shape.count / total, 3),
+        "example": shape.example,
+        "promoted_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "failures": 0,
+    }
+    _save_entries(db_id, entries)
+    _stats["promoted" if status == "active" else "pending"] += 1
+    print(f"Template {name} {'promoted' if status == 'active' else 'proposed for review'} for '{db_id}': {qshape}")
+
+
+# ------------------------
+# Recording
+# ------------------------
+
+def _log_path(db_id: str) -> str:
+    if not query_templates.valid_db_id(db_id):
+        raise ValueError(f"Invalid db_id {db_id!r}")
+    return os.path.join(LOG_DIR, f"{db_id}.jsonl")
+
+
+def _append_log(db_id: str, item: dict):
+    path = _log_path(db_id)
+    os.makedirs(LOG_DIR, exist_ok=True)
+    try:
+        if os.path.getsize(path) >= settings.PROMOTION_LOG_MAX_BYTES:
+            # one previous generation is kept (and replayed)
+            os.replace(path, f"{path}.1")
+    except FileNotFoundError:
+        pass
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(item) + "\n")
+
+
+def _observe(db_id: str, question: str, sql: str) -> Optional[tuple[str, _Shape, int]]:
+    abstracted = abstract_sql(sql, question)
+    if abstracted is None:
+        return None
+    sql_shape, slots, values = abstracted
+    qshape = query_templates.question_shape(question)
+    by_sql = _shapes.setdefault(db_id, {}).setdefault(qshape, {})
+    shape = by_sql.setdefault(sql_shape, _Shape(sql=sql_shape, slots=slots, example=question))
+    shape.count += 1
+    if len(shape.values) < MAX_VALUES_TRACKED:
+        shape.values.add(values)
+    return qshape, shape, sum(s.count for s in by_sql.values())
+
+
+def _replay_log(db_id: str):
+    """Rebuild the shape counters from the log after a restart."""
+    _loaded.add(db_id)
+    path = _log_path(db_id)
+    lines = deque(maxlen=settings.PROMOTION_LOG_REPLAY_LINES)
+    for generation in (f"{path}.1", path):
+        try:
+            with open(generation, "r", encoding="utf-8") as f:
+                lines.extend(f)
+        except FileNotFoundError:
+            pass
+    for line in lines:
+        try:
+            item = json.loads(line)
+        except ValueError:
+            continue
+        _observe(db_id, item["question"], item["sql"])
+
+
+def _record(db_id: str, question: str, sql: str):
+    with _lock:
+        if db_id not in _loaded:
+            _replay_log(db_id)
+        _append_log(db_id, {"ts": time.time(), "question": question, "sql": sql})
+
+        observed = _observe(db_id, question, sql)
+        if observed is None:
+            _stats["skipped"] += 1
+            return
+        _stats["recorded"] += 1
+        qshape, shape, total = observed
+        if (
+            shape.count >= settings.PROMOTION_MIN_OCCURRENCES
+            and len(shape.values) >= settings.PROMOTION_MIN_DISTINCT_VALUES
+            and shape.count / total >= settings.PROMOTION_MIN_AGREEMENT
+        ):
+            _promote(db_id, qshape, shape, total)
+
+
+async def record(db_id: str, question: str, sql: str):
+    """Log one successful LLM answer and promote its shape once it qualifies."""
+    if not settings.PROMOTION_ENABLED:
+        return
+    if not query_templates.valid_db_id(db_id):
+        _stats["skipped"] += 1
+        return
+    # file I/O (log append, registry rewrite) stays off the event loop
+    await asyncio.to_thread(_record, db_id, question, sql)
+
+
+def _record_failure(db_id: str, name: str):
+    with _lock:
+        entries = _entries(db_id)
+        entry = entries.get(name)
+        if entry is None:
+            return
+        entry["failures"] = entry.get("failures", 0) + 1
+        if entry["failures"] >= settings.PROMOTION_DEMOTE_AFTER_FAILURES:
+            entry["status"] = "demoted"
+            entry["enabled"] = False
+            _stats["demoted"] += 1
+            print(f"Template {name} demoted for '{db_id}' after {entry['failures']} failures")
+        _save_entries(db_id, entries)
+
+
+async def record_template_result(db_id: str, name: str, ok: bool):
+    """Count failures of a promoted template; demote it past the threshold."""
+    # successes are not persisted: that would rewrite the file on every request
+    if ok or not name.startswith(NAME_PREFIX):
+        return
+    await asyncio.to_thread(_record_failure, db_id, name)
+
+
+# ------------------------
+# Review
+# ------------------------
+
+def list_promoted(db_id: str) -> List[dict]:
+    return list(_entries(db_id).values())
+
+
+async def approve(db_id: str, name: str) -> bool:
+    """Activate a pending (or previously demoted) template."""
+    return await asyncio.to_thread(_set_status, db_id, name, "active")
+
+
+async def demote(db_id: str, name: str) -> bool:
+    """Disable a template; its shape will not be promoted again automatically."""
+    if await asyncio.to_thread(_set_status, db_id, name, "demoted"):
+        _stats["demoted"] += 1
+        return True
+    return False
+
+
+def stats() -> dict:
+    return {**_stats, "shapes": sum(len(v) for v in _shapes.values())}
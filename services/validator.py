@@ -1,86 +1,488 @@
 # services/validator.py
-import re
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, FrozenSet, List, Mapping, Optional, Set, Tuple
+
+from services.sql_lexer import Token, normalize_identifier, split_name, tokenize
 
 FORBIDDEN = ["drop", "delete", "update", "insert", "alter", "truncate"]
+_FORBIDDEN_SET = frozenset(FORBIDDEN)
+
+# Words that can never be a column reference. Type names are intentionally
+# absent: they only appear after "::" / "AS" or before a string literal, and
+# those positions are skipped structurally.
+KEYWORDS = frozenset("""
+    select from where group by order having limit offset fetch first next rows row only ties
+    join inner left right full outer cross natural on using as and or not in is null true false
+    like ilike similar between case when then else end distinct all any some exists union
+    intersect except with recursive materialized asc desc nulls last lateral filter over
+    partition range preceding following unbounded current window within values default
+    collate escape at time zone interval current_date current_time current_timestamp
+    localtime localtimestamp current_user session_user user for both leading trailing
+    year month day hour minute second epoch dow doy isodow isoyear week quarter decade
+    century millennium milliseconds microseconds timezone_hour timezone_minute
+    returning into set do nothing conflict array
+""".split())
+
+# Keywords that end a FROM list or an ON predicate at the same nesting level.
+_CLAUSE_END = frozenset("""
+    where group order having limit offset fetch union intersect except window
+    join inner left right full cross natural on using returning
+""".split())
+
+_VALUE_END_KINDS = frozenset({"ident", "qident", "name", "number", "string", "param"})
+_REF_KINDS = frozenset({"ident", "qident", "name"})
+# Keywords that change scanner state; every other keyword is skipped outright.
+_STRUCTURAL = _CLAUSE_END | {"with", "from", "recursive", "lateral", "only"}
+_QUERY_START = frozenset({"select", "with", "values"})
+# Tokens after "a.x = b.y" that make the right side an expression, not a column.
+_EXPR_CONTINUATION = frozenset({"(", "::", "+", "-", "*", "/", "||", "->", "->>"})
+
+
+class _Frame:
+    """One parenthesis level. FROM-list / ON-predicate state is per level."""
+
+    __slots__ = ("is_query", "derived", "cte_body", "window_def", "in_from", "in_on")
+
+    def __init__(
+        self, is_query: bool = False, derived: bool = False, cte_body: bool = False, window_def: bool = False
+    ):
+        self.is_query = is_query
+        self.derived = derived
+        self.cte_body = cte_body
+        self.window_def = window_def
+        self.in_from = False
+        self.in_on = False
+
+
+def _canonical_table(parts: List[str]) -> str:
+    name = ".".join(parts)
+    if name.startswith("public."):
+        name = name[len("public."):]
+    return name
+
 
+def _word(tok: Optional[Token]) -> str:
+    if tok is None or tok.kind != "ident":
+        return ""
+    return tok.text.lower()
 
-def validate_sql(sql: str, grounded_map: dict, relationships: list):
+
+def _name(tok: Token) -> str:
+    return tok.text.lower() if tok.kind == "ident" else normalize_identifier(tok.text)
+
+
+def _parts(tok: Token) -> Tuple[List[str], bool]:
+    """Normalized parts of a reference token (a, a.b, a.b.c, a.*) and whether it ends in *."""
+    if tok.kind != "name":
+        return [_name(tok)], False
+    parts = split_name(tok.text)
+    if parts[-1] == "*":
+        return parts[:-1], True
+    return parts, False
+
+
+class SqlScan:
     """
-    Validates SQL using:
-      - grounded_map: mapping produced by grounding.ground (per-table entries with available_columns)
-      - relationships: global list of FK relationships
-    Returns: (ok:bool, message:str, repaired_sql_or_none)
+    Result of a single left-to-right walk over the token stream. References are
+    collected during the walk and resolved afterwards, because the select list
+    mentions aliases before the FROM clause defines them.
     """
-    low = sql.lower()
-
-    for word in FORBIDDEN:
-        if re.search(rf"\b{word}\b", low):
-            return False, "Destructive SQL not allowed", None
-
-    # Build reference maps
-    table_cols = {}   # table_name -> set(columns)
-    all_cols = set()  # "table.col" strings lowercase
-    fk_set = set()    # tuples (from_table, from_col, to_table, to_col) lowercase
-
-    # Collect table columns from grounded_map
-    for p_table, entry in grounded_map.items():
-        table = entry.get("matched_table")
-        cols = entry.get("available_columns", []) or []
-        if table:
-            table_cols[table.lower()] = {c.lower() for c in cols}
-            for c in cols:
-                all_cols.add(f"{table}.{c}".lower())
-
-    # Collect relationships from provided relationships list
+
+    __slots__ = (
+        "forbidden", "relations", "ctes", "windows", "opaque", "qualified",
+        "unqualified", "output_aliases", "join_pairs", "unquoted_interval",
+    )
+
+    def __init__(self):
+        self.forbidden = False
+        self.relations: Dict[str, Optional[str]] = {}   # alias/name -> canonical table (None = derived)
+        self.ctes: Set[str] = set()
+        self.windows: Set[str] = set()                    # WINDOW w AS (...) names
+        self.opaque = False                               # some relation has unknown columns
+        # ordered de-duplicated references (dicts used as ordered sets)
+        self.qualified: Dict[Tuple[str, str], None] = {}  # (qualifier, column or "*")
+        self.unqualified: Dict[str, None] = {}
+        self.output_aliases: Set[str] = set()
+        self.join_pairs: List[Tuple[str, str, str, str]] = []
+        self.unquoted_interval = False
+
+    def add_derived(self, alias: Optional[str]):
+        self.opaque = True
+        if alias:
+            self.relations[alias] = None
+
+    def resolve(self, qualifier: str) -> Tuple[bool, Optional[str]]:
+        """Return (found, canonical_table_or_None_for_derived)."""
+        if qualifier in self.relations:
+            return True, self.relations[qualifier]
+        canon = _canonical_table(qualifier.split("."))
+        if canon in self.relations:
+            return True, self.relations[canon]
+        return False, None
+
+    def add_table(self, parts: List[str], alias: Optional[str]):
+        canon = _canonical_table(parts)
+        self.relations.setdefault(canon, canon)
+        self.relations.setdefault(parts[-1], canon)
+        if alias:
+            self.relations[alias] = canon
+
+
+def _read_alias(tokens: List[Token], j: int) -> Tuple[Optional[str], int]:
+    """Optional [AS] alias after a relation; returns (alias, next index)."""
+    n = len(tokens)
+    if j < n and _word(tokens[j]) == "as":
+        j += 1
+        if j < n and tokens[j].kind in ("ident", "qident"):
+            return _name(tokens[j]), j + 1
+        return None, j
+    if j < n:
+        tok = tokens[j]
+        if tok.kind == "qident" or (tok.kind == "ident" and tok.text.lower() not in KEYWORDS):
+            return _name(tok), j + 1
+    return None, j
+
+
+def _split_reference(text: str) -> Tuple[str, str]:
+    """'a.b.col' -> ('a.b', 'col'); 'a.*' -> ('a', '*')."""
+    if '"' in text:
+        parts = split_name(text)
+        return ".".join(parts[:-1]), parts[-1]
+    qualifier, _, column = text.lower().rpartition(".")
+    return qualifier, column
+
+
+def scan_sql(tokens: List[Token]) -> SqlScan:
+    """
+    Walk the token stream once and collect relations (alias -> table), CTEs,
+    named windows, column references and JOIN ... ON column pairs. Used by
+    validate_sql and by the local repair rules.
+    """
+    scan = SqlScan()
+    frame = _Frame(is_query=True)
+    frames: List[_Frame] = [frame]
+    relations = scan.relations
+    qualified = scan.qualified
+    n = len(tokens)
+
+    expect_relation = False   # next token starts a FROM/JOIN item
+    expect_cte = False        # next identifier names a CTE
+    expect_window = False     # next identifier names a WINDOW clause window
+
+    i = -1
+    while True:
+        i += 1
+        if i >= n:
+            break
+        tok = tokens[i]
+        kind = tok.kind
+        text = tok.text
+
+        if kind == "op":
+            if text == "(":
+                frame = _Frame(is_query=i + 1 < n and _word(tokens[i + 1]) in _QUERY_START)
+                if expect_relation:
+                    if frame.is_query:
+                        frame.derived = True   # (subquery) alias
+                        expect_relation = False
+                    else:
+                        frame.is_query = True  # parenthesized join tree: (a JOIN b ON ...)
+                frames.append(frame)
+            elif text == ")":
+                closed = frames.pop() if len(frames) > 1 else frame
+                frame = frames[-1]
+                if closed.derived:
+                    alias, j = _read_alias(tokens, i + 1)
+                    scan.add_derived(alias)
+                    i = j - 1
+                elif closed.cte_body and i + 1 < n and tokens[i + 1].text == ",":
+                    expect_cte = True
+                    i += 1
+                elif closed.window_def and i + 1 < n and tokens[i + 1].text == ",":
+                    expect_window = True
+                    i += 1
+            elif text == "," and frame.in_from:
+                expect_relation = True
+            continue
+
+        if kind not in _REF_KINDS:
+            continue  # strings, numbers, parameters
+
+        if kind == "ident":
+            word = text.lower()
+            if word in KEYWORDS and word not in _STRUCTURAL and not expect_cte:
+                if word == "as":
+                    # "expr AS name": the name is an output alias, never a column
+                    if i + 1 < n and tokens[i + 1].kind in ("ident", "qident"):
+                        scan.output_aliases.add(_name(tokens[i + 1]))
+                        i += 1
+                elif word == "interval" and i + 1 < n and tokens[i + 1].kind == "number":
+                    scan.unquoted_interval = True
+                continue
+            if word in _FORBIDDEN_SET and (not i or tokens[i - 1].text != "."):
+                scan.forbidden = True
+        else:
+            word = ""
+        prev_text = tokens[i - 1].text if i else ""
+
+        # ---- CTE names: WITH [RECURSIVE] name [(cols)] AS [NOT] [MATERIALIZED] ( ... )
+        if expect_cte and word != "recursive":
+            name = _name(tok)
+            j = i + 1
+            if j < n and tokens[j].text == "(":
+                while j < n and tokens[j].text != ")":
+                    j += 1
+                j += 1
+            while j < n and _word(tokens[j]) in ("as", "not", "materialized"):
+                j += 1
+            scan.ctes.add(name)
+            scan.add_derived(name)
+            expect_cte = False
+            if j < n and tokens[j].text == "(":
+                frame = _Frame(is_query=True, cte_body=True)
+                frames.append(frame)
+                j += 1
+            i = j - 1
+            continue
+
+        # ---- window names: WINDOW name AS ( ... ) [, name AS ( ... )]
+        if expect_window:
+            scan.windows.add(_name(tok))
+            expect_window = False
+            if i + 2 < n and _word(tokens[i + 1]) == "as" and tokens[i + 2].text == "(":
+                # the definition's own column references are still checked
+                frame = _Frame(window_def=True)
+                frames.append(frame)
+                i += 2
+            continue
+
+        # ---- FROM / JOIN items
+        if expect_relation:
+            if word in ("lateral", "only"):
+                continue
+            parts, _ = _parts(tok)
+            expect_relation = False
+            if i + 1 < n and tokens[i + 1].text == "(":
+                # set-returning function: alias follows its closing paren
+                frame = _Frame(derived=True)
+                frames.append(frame)
+                i += 1
+                continue
+            alias, j = _read_alias(tokens, i + 1)
+            if len(parts) == 1 and parts[0] in scan.ctes:
+                if alias:
+                    relations[alias] = None
+            else:
+                scan.add_table(parts, alias)
+            i = j - 1
+            continue
+
+        if word:
+            if word == "with" and frame.is_query and prev_text in ("", "("):
+                expect_cte = True
+                continue
+            if word == "from" and frame.is_query:
+                if not i or _word(tokens[i - 1]) != "distinct":   # IS [NOT] DISTINCT FROM
+                    expect_relation = True
+                    frame.in_from = True
+                    frame.in_on = False
+                continue
+            if word == "join" and frame.is_query:
+                expect_relation = True
+                frame.in_from = False
+                frame.in_on = False
+                continue
+            if word == "window" and frame.is_query:
+                expect_window = True
+                frame.in_from = False
+                frame.in_on = False
+                continue
+            if word == "on" and frame.is_query:
+                frame.in_on = not i or _word(tokens[i - 1]) != "distinct"   # DISTINCT ON (...)
+                continue
+            if word in _CLAUSE_END:
+                frame.in_from = False
+                frame.in_on = False
+                continue
+            if word in KEYWORDS:
+                continue
+
+        if prev_text == "." or prev_text == "::":
+            continue  # field of a composite value / type name
+
+        nxt = tokens[i + 1] if i + 1 < n else None
+        nxt_text = nxt.text if nxt is not None else ""
+        if nxt_text == "(":
+            continue  # function call (optionally schema-qualified)
+
+        if kind != "name":
+            if nxt is not None and nxt.kind == "string":
+                continue  # typed literal: date '2024-01-01', timestamp '...'
+            name = word or normalize_identifier(text)
+            prev = tokens[i - 1] if i else None
+            prev_word = _word(prev)
+            if prev_word in ("as", "end") or (
+                prev is not None and (
+                    prev_text == ")" or (prev.kind in _VALUE_END_KINDS and prev_word not in KEYWORDS)
+                )
+            ):
+                # explicit or implicit alias: "count(*) AS total", "o.amount amt"
+                scan.output_aliases.add(name)
+            else:
+                scan.unqualified[name] = None
+            continue
+
+        qualifier, column = _split_reference(text)
+        qualified[(qualifier, column)] = None
+
+        if frame.in_on and nxt_text == "=" and column != "*" and i + 2 < n:
+            r_tok = tokens[i + 2]
+            if r_tok.kind == "name":
+                r_qualifier, r_column = _split_reference(r_tok.text)
+                after = tokens[i + 3].text if i + 3 < n else ""
+                if r_column != "*" and after not in _EXPR_CONTINUATION:
+                    scan.join_pairs.append((qualifier, column, r_qualifier, r_column))
+
+    # "OVER w" comes before the WINDOW clause that names w
+    for name in scan.windows:
+        scan.unqualified.pop(name, None)
+    return scan
+
+
+@dataclass(frozen=True)
+class ValidationContext:
+    """
+    Immutable lookup tables for one schema version: frozen column sets per
+    canonical table name and the bidirectional FK index. Compiled once per
+    schema version and shared by every request; requests only slice it down
+    to their matched tables.
+    """
+
+    version: str
+    table_cols: Mapping[str, FrozenSet[str]]
+    fk_set: FrozenSet[Tuple[str, str, str, str]]
+
+    def slice(self, grounded_map: dict) -> "ValidationContext":
+        """Restrict column checks to the tables grounding matched for this request."""
+        tables: Dict[str, FrozenSet[str]] = {}
+        for entry in grounded_map.values():
+            table = entry.get("matched_table")
+            if not table:
+                continue
+            canon = _canonical_table(table.lower().split("."))
+            cols = self.table_cols.get(canon)
+            if cols is None:
+                cols = frozenset(c.lower() for c in entry.get("available_columns", []) or [])
+            tables[canon] = cols
+        return ValidationContext(self.version, MappingProxyType(tables), self.fk_set)
+
+
+def _compile_fk_set(relationships: list) -> FrozenSet[Tuple[str, str, str, str]]:
+    fk_set = set()   # tuples (from_table, from_col, to_table, to_col) lowercase
     for rel in (relationships or []):
         f_tbl = rel.get("from_table")
         f_col = rel.get("from_column")
         t_tbl = rel.get("to_table")
         t_col = rel.get("to_column")
         if f_tbl and f_col and t_tbl and t_col:
-            fk_set.add((f_tbl.lower(), f_col.lower(), t_tbl.lower(), t_col.lower()))
-            fk_set.add((t_tbl.lower(), t_col.lower(), f_tbl.lower(), f_col.lower()))
+            f_tbl, f_col, t_tbl, t_col = f_tbl.lower(), f_col.lower(), t_tbl.lower(), t_col.lower()
+            fk_set.add((f_tbl, f_col, t_tbl, t_col))
+            fk_set.add((t_tbl, t_col, f_tbl, f_col))
+    return frozenset(fk_set)
+
+
+def compile_context(schema: dict, version: str) -> ValidationContext:
+    """Compile a stored schema ({tables: {table: [cols]}, relationships: [...]})."""
+    table_cols = {
+        _canonical_table(table.lower().split(".")): frozenset(c.lower() for c in cols)
+        for table, cols in (schema.get("tables") or {}).items()
+    }
+    return ValidationContext(
+        version=version,
+        table_cols=MappingProxyType(table_cols),
+        fk_set=_compile_fk_set(schema.get("relationships") or []),
+    )
+
+
+_contexts: Dict[str, ValidationContext] = {}
+
+
+def get_context(db_id: str, schema: dict, version: str) -> ValidationContext:
+    """
+    Return the compiled context for db_id, recompiling only when the schema
+    version changed. The dict assignment swaps contexts atomically.
+    """
+    ctx = _contexts.get(db_id)
+    if ctx is None or ctx.version != version:
+        ctx = compile_context(schema, version)
+        _contexts[db_id] = ctx
+    return ctx
+
+
+def validate_sql(sql: str, grounded_map: dict, relationships: list, context: Optional[ValidationContext] = None):
+    """
+    Validates SQL using:
+      - grounded_map: mapping produced by grounding.ground (per-table entries with available_columns)
+      - relationships: global list of FK relationships
+      - context: precompiled ValidationContext (see get_context); when given,
+        relationships are not re-read and the FK index is reused as-is
+    The SQL is tokenized once (strings, comments and quoted identifiers are
+    opaque), aliases and CTE names are resolved, and then qualified columns,
+    unqualified columns and JOIN ... ON predicates are checked.
+    Returns: (ok:bool, message:str, repaired_sql_or_none)
+    """
+    if context is None:
+        context = ValidationContext("adhoc", MappingProxyType({}), _compile_fk_set(relationships))
+    return _check(tokenize(sql), context.slice(grounded_map))
+
+
+def _check(tokens: List[Token], context: ValidationContext) -> Tuple[bool, str, None]:
+    table_cols = context.table_cols
+    fk_set = context.fk_set
+    scan = scan_sql(tokens)
+
+    if scan.forbidden:
+        return False, "Destructive SQL not allowed", None
+
+    if scan.unquoted_interval:
+        return False, "INTERVAL values must be quoted, e.g. INTERVAL '7 days'", None
 
     # -----------------------------------------------------
-    # Validate qualified column references: table.col or alias.col
+    # Qualified column references: table.col, alias.col, schema.table.col
     # -----------------------------------------------------
-    # Extract qualified references
-    for tbl, col in re.findall(r"([a-zA-Z_][\w]*)\.([a-zA-Z_][\w]*)", sql):
-        tbl_low = tbl.lower()
-        col_low = col.lower()
-        # If table exists in table_cols, validate col
-        if tbl_low in table_cols:
-            if col_low not in table_cols[tbl_low]:
-                return False, f"Column '{col}' not found in table '{tbl}'", None
-        # else: tbl might be alias; skip strict validation here
+    for qualifier, column in scan.qualified:
+        found, table = scan.resolve(qualifier)
+        if not found:
+            return False, f"Unknown table or alias '{qualifier}' in reference '{qualifier}.{column}'", None
+        if table is None or column == "*" or table not in table_cols:
+            continue
+        if column not in table_cols[table]:
+            return False, f"Column '{column}' not found in table '{table}'", None
 
     # -----------------------------------------------------
-    # Validate JOIN ON conditions are FK pairs
+    # Unqualified columns: only checkable when every relation has known columns
     # -----------------------------------------------------
-    # Find ON clauses (heuristic)
-    on_pairs = re.findall(
-        r"on\s+([a-zA-Z_][\w]*)\.([a-zA-Z_][\w]*)\s*=\s*([a-zA-Z_][\w]*)\.([a-zA-Z_][\w]*)",
-        sql,
-        flags=re.I,
-    )
+    referenced = {t for t in scan.relations.values() if t is not None}
+    if referenced and not scan.opaque and referenced.issubset(table_cols.keys()):
+        visible = set().union(*(table_cols[t] for t in referenced))
+        for name in scan.unqualified:
+            if name in visible or name in scan.output_aliases or name in scan.relations:
+                continue
+            tables = ", ".join(sorted(referenced))
+            return False, f"Column '{name}' not found in any referenced table ({tables})", None
 
-    for l_tbl, l_col, r_tbl, r_col in on_pairs:
-        l_tbl_low = l_tbl.lower()
-        r_tbl_low = r_tbl.lower()
-        l_col_low = l_col.lower()
-        r_col_low = r_col.lower()
-
-        # If either side is an alias not present in table_cols, we try to be permissive
-        # but if real table names appear, strictly validate FK presence
-        pair = (l_tbl_low, l_col_low, r_tbl_low, r_col_low)
-        pair_rev = (r_tbl_low, r_col_low, l_tbl_low, l_col_low)
-
-        if pair not in fk_set and pair_rev not in fk_set:
-            # If left or right table matches one of the grounded matched_table names, then this is invalid
-            left_known = l_tbl_low in table_cols
-            right_known = r_tbl_low in table_cols
-            if left_known or right_known:
-                return False, f"Invalid join: {l_tbl}.{l_col} ↔ {r_tbl}.{r_col}", None
-            # otherwise be permissive (alias-heavy SQL) and skip strict failure
+    # -----------------------------------------------------
+    # JOIN ON conditions must be FK pairs
+    # -----------------------------------------------------
+    for l_q, l_col, r_q, r_col in scan.join_pairs:
+        _, l_tbl = scan.resolve(l_q)
+        _, r_tbl = scan.resolve(r_q)
+        if l_tbl is None or r_tbl is None:
+            continue  # derived table / CTE: relationship unknown
+        if l_tbl not in table_cols and r_tbl not in table_cols:
+            continue
+        if (l_tbl, l_col, r_tbl, r_col) not in fk_set:
+            return False, f"Invalid join: {l_q}.{l_col} ↔ {r_q}.{r_col} ({l_tbl} ↔ {r_tbl} is not a foreign key)", None
 
     return True, "ok", None
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from core.config import settings
+from services import admission
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(admission, "_waiters", [])
+    monkeypatch.setattr(admission, "_active", {})
+    monkeypatch.setattr(admission, "_last_finish", {})
+    monkeypatch.setattr(admission, "_virtual_time", 0.0)
+    monkeypatch.setattr(admission, "_tenant_stats", {})
+    monkeypatch.setattr(settings, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_CONCURRENT", 1)
+    monkeypatch.setattr(settings, "ADMISSION_TENANT_MAX_CONCURRENT", 1)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_QUEUED_PER_TENANT", 10)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_QUEUE_WAIT_SECONDS", 5)
+    monkeypatch.setattr(settings, "ADMISSION_WEIGHTS", {})
+
+
+def test_burst_from_one_tenant_does_not_starve_another():
+    order = []
+
+    async def job(tenant, i):
+        async with admission.admit(tenant):
+            order.append(f"{tenant}{i}")
+            await asyncio.sleep(0)
+
+    async def run():
+        tasks = [asyncio.create_task(job("a", i)) for i in range(6)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(job("b", 0)))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    # b arrives behind a's whole burst but only waits about one of a's turns
+    assert order.index("b0") <= 3
+    assert order[-1] == "a5"
+    assert admission.stats()["tenants"]["a"]["admitted"] == 6
+
+
+def test_requests_over_the_wait_budget_are_shed(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_MAX_QUEUE_WAIT_SECONDS", 0.01)
+
+    async def run():
+        async with admission.admit("a"):
+            with pytest.raises(admission.Rejected) as exc:
+                async with admission.admit("b"):
+                    pass
+        return exc.value
+
+    rejected = asyncio.run(run())
+    assert rejected.retry_after >= 1
+    stats = admission.stats()
+    assert stats["tenants"]["b"]["rejected"] == 1
+    assert stats["active"] == 0 and stats["queued"] == 0
+
+
+def test_shared_key_is_not_held_to_the_tenant_cap(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_MAX_CONCURRENT", 3)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_QUEUE_WAIT_SECONDS", 0.01)
+
+    async def run():
+        async with admission.admit("mydb", capped=False), admission.admit("mydb", capped=False):
+            assert admission._active["mydb"] == 2
+            async with admission.admit("mydb/7"):
+                # the global limit still applies to it
+                with pytest.raises(admission.Rejected):
+                    async with admission.admit("mydb", capped=False):
+                        pass
+                with pytest.raises(admission.Rejected):
+                    async with admission.admit("mydb/7"):
+                        pass
+
+    asyncio.run(run())
+    assert admission.stats()["active"] == 0
+
+
+def test_held_slot_is_released_when_the_stream_closes():
+    async def run():
+        async with admission.admit("a"):
+            release = admission.hold()
+        # the handler returned but its stream is still open
+        assert admission._active["a"] == 1
+        release()
+        release()
+        assert admission._active["a"] == 0
+
+        # a failed request releases even a held slot
+        with pytest.raises(RuntimeError):
+            async with admission.admit("a"):
+                admission.hold()
+                raise RuntimeError("boom")
+        assert admission._active["a"] == 0
+
+    asyncio.run(run())
+    assert admission.hold() is None
+
+
+def test_idle_tenant_counters_are_bounded(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_MAX_TRACKED_TENANTS", 3)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_CONCURRENT", 10)
+
+    async def run():
+        async with admission.admit("busy"):
+            for i in range(10):
+                async with admission.admit(f"t{i}"):
+                    pass
+            assert "busy" in admission._tenant_stats
+
+    asyncio.run(run())
+    assert len(admission._tenant_stats) <= 3 and "t9" in admission._tenant_stats
@@ -0,0 +1,92 @@
+import asyncio
+
+from core.config import settings
+from services import catalog
+
+
+def _col(schema, table, column, data_type, base=True):
+    return {"table_schema": schema, "table_name": table, "column_name": column,
+            "data_type": data_type, "is_base_table": base}
+
+
+COLUMNS = [
+    _col("chatbot", "call_data", "tenant_id", "integer"),
+    _col("chatbot", "call_data", "agent_name", "character varying"),
+    _col("public", "users", "id", "integer"),
+    _col("public", "active_users", "id", "integer", base=False),
+]
+FKS = [{"from_schema": "chatbot", "from_table": "call_data", "from_column": "tenant_id",
+        "to_schema": "public", "to_table": "users", "to_column": "id", "constraint_name": "fk_tenant"}]
+
+
+def test_snapshot_matches_schema_file_format_and_indexes_types():
+    snap = catalog.build_snapshot(COLUMNS, FKS)
+    assert snap.schema["tables"] == {"chatbot.call_data": ["tenant_id", "agent_name"], "users": ["id"]}
+    assert snap.schema["relationships"][0]["to_table"] == "users"
+    # views are not grounding targets but still need types for literal quoting
+    assert snap.column_types["public.active_users"] == {"id": "integer"}
+    assert snap.textual_columns == {"agent_name": frozenset({"chatbot.call_data"})}
+
+
+def test_publish_swaps_only_on_change():
+    snap = catalog.build_snapshot(COLUMNS, FKS)
+    assert catalog.publish("testdb", snap)
+    assert not catalog.publish("testdb", catalog.build_snapshot(COLUMNS, FKS))
+    changed = catalog.build_snapshot(COLUMNS[:1] + [_col("chatbot", "call_data", "agent_name", "text")], FKS)
+    assert changed.version != snap.version
+    assert catalog.publish("testdb", changed)
+    assert catalog.current("testdb") is changed
+
+
+class _FingerprintConn:
+    def __init__(self, objects, digest):
+        self.row = {"objects": objects, "digest": digest}
+        self.calls = []
+
+    async def fetchrow(self, sql, schemas):
+        self.calls.append(schemas)
+        return self.row
+
+
+def test_fingerprint_is_one_query_over_the_configured_schemas(monkeypatch):
+    monkeypatch.setattr(settings, "DATABASE_SCHEMAS", "public,chatbot")
+    conn = _FingerprintConn(120, -4242)
+    first = asyncio.run(catalog.fingerprint(conn))
+    assert conn.calls == [["public", "chatbot"]]
+    assert first == asyncio.run(catalog.fingerprint(conn))
+    conn.row = {"objects": 121, "digest": -4242}
+    assert asyncio.run(catalog.fingerprint(conn)) != first
+    # a schema added to the configuration is a change even with equal digests
+    monkeypatch.setattr(settings, "DATABASE_SCHEMAS", "public,chatbot,sales")
+    conn.row = {"objects": 120, "digest": -4242}
+    assert asyncio.run(catalog.fingerprint(conn)) != first
+
+
+class _CatalogConn:
+    """Serves the bulk introspection queries from in-memory rows."""
+
+    def __init__(self, columns, fks):
+        self.columns, self.fks = columns, fks
+        self.column_reads = []
+
+    async def fetch(self, sql, schemas):
+        if sql is catalog.INTROSPECT_COLUMNS_SQL:
+            self.column_reads.append(list(schemas))
+            return [r for r in self.columns if r["table_schema"] in schemas]
+        return [r for r in self.fks if r["from_schema"] in schemas]
+
+
+def test_ddl_events_reread_only_the_touched_schema(monkeypatch):
+    monkeypatch.setattr(settings, "DATABASE_SCHEMAS", "chatbot,public")
+    monkeypatch.setattr(catalog, "_rows", {})
+    conn = _CatalogConn(COLUMNS, FKS)
+    asyncio.run(catalog.introspect(conn, "eventdb"))
+
+    conn.columns = COLUMNS + [_col("chatbot", "call_data", "call_score", "integer")]
+    conn.column_reads.clear()
+    snap = asyncio.run(catalog.introspect_schemas(conn, "eventdb", {"chatbot"}))
+    assert conn.column_reads == [["chatbot"]]
+    assert snap.version == asyncio.run(catalog.introspect(conn)).version
+    assert snap.schema["tables"]["chatbot.call_data"][-1] == "call_score"
+    # DDL outside the introspected schemas changes nothing
+    assert asyncio.run(catalog.introspect_schemas(conn, "eventdb", {"rollup"})) is None
@@ -0,0 +1,32 @@
+from datetime import date
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+
+from services import columnar, executor
+
+
+def test_negotiate_accept_header():
+    assert columnar.negotiate("application/vnd.apache.arrow.stream") == "arrow"
+    assert columnar.negotiate("text/html, application/x-parquet;q=0.9") == "parquet"
+    assert columnar.negotiate("application/json") is None
+
+
+def test_arrow_round_trip_keeps_types_and_sql():
+    rows = [{"id": 1, "day": date(2024, 1, 1), "meta": {"a": [1]}}, {"id": 2, "day": None, "meta": None}]
+    body = columnar.encode(rows, "arrow", "SELECT 1")
+    table = pa.ipc.open_stream(body).read_all()
+    assert table.column_names == ["id", "day", "meta"]
+    assert table.schema.field("id").type == pa.int64()
+    assert table.schema.field("day").type == pa.date32()
+    assert table.schema.metadata[b"sql"] == b"SELECT 1"
+
+
+def test_empty_result_keeps_its_columns():
+    records = executor.Records([], [("id", "int8"), ("day", "date"), ("agent", "varchar"), ("meta", "jsonb")])
+    table = pa.ipc.open_stream(columnar.encode(records, "arrow", "SELECT 1")).read_all()
+    assert table.num_rows == 0
+    assert table.column_names == ["id", "day", "agent", "meta"]
+    assert [f.type for f in table.schema] == [pa.int64(), pa.date32(), pa.string(), pa.string()]
+    assert table.schema.metadata[b"sql"] == b"SELECT 1"
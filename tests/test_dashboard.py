@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import pytest
+
+from core.config import settings
+from services import dashboard, query_templates, rollups
+
+
+def test_metrics_cover_the_single_value_templates():
+    builtin = {t.name for t in query_templates.TEMPLATES}
+    assert set(dashboard.METRICS) <= builtin
+    assert set(dashboard.METRICS) == set(rollups.DAILY_METRICS)
+
+
+def test_shared_predicates_match_the_template_sql():
+    def squash(sql):
+        return "".join(sql.lower().split())
+
+    sql = {t.name: squash(t.renderer(query_templates._build_context(""))) for t in query_templates.TEMPLATES}
+    for name, predicate in query_templates.COUNT_PREDICATES.items():
+        assert f"and{squash(predicate)}" in sql[name], name
+    for name, column in query_templates.AVERAGE_COLUMNS.items():
+        assert f"avg({column})" in sql[name], name
+    assert set(dashboard.METRICS) == (
+        set(query_templates.COUNT_PREDICATES) | set(query_templates.AVERAGE_COLUMNS) | {"total_duration"}
+    )
+
+
+def test_all_metrics_in_one_scan(monkeypatch):
+    monkeypatch.setattr(settings, "ROLLUP_ENABLED", False)
+    names = dashboard.resolve(None)
+    sql = dashboard.build_sql(names, "mydb")
+    assert sql.count("from chatbot.call_data") == 1
+    assert "count(*) filter (where is_ztp = true) as ztp_calls" in sql
+    assert sql.endswith("where tenant_id = $1 and date between $2 and $3;")
+
+
+def test_selection_keeps_metric_order_and_rejects_unknown_names():
+    assert dashboard.resolve(["avg_call_score", "fatal_calls"]) == ["fatal_calls", "avg_call_score"]
+    with pytest.raises(dashboard.UnknownMetric):
+        dashboard.resolve(["fatal_calls", "agent_wise"])
+
+
+def test_rollups_answer_the_dashboard_once_ready(monkeypatch):
+    monkeypatch.setattr(settings, "ROLLUP_ENABLED", True)
+    monkeypatch.setattr(rollups, "_ready", {"mydb": datetime.now()})
+    sql = dashboard.build_sql(["fatal_calls", "avg_handling_time"], "mydb")
+    assert "from rollup.call_data_daily\n" in sql
+    assert sql.endswith(
+        "select coalesce(sum(fatal_calls), 0)::bigint as fatal_calls,\n"
+        "sum(handling_time_sum)::numeric / nullif(sum(handling_time_n), 0) as avg_handling_time\n"
+        "from daily;"
+    )
+    assert dashboard.statement_name(sql) != dashboard.statement_name(dashboard.build_sql(["fatal_calls"], "mydb"))
@@ -0,0 +1,68 @@
+import asyncio
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+from core.config import settings
+from services import day_cache, executor
+
+
+@pytest.fixture
+def fake_source(monkeypatch):
+    """call_data with 2 fatal calls and call scores 80 and 90 on every day."""
+    queries = []
+
+    async def fetch_records(sql, db_id, enforce_limit=True, params=None, statement=None, primary=False):
+        # stored partials must not come from a lagging replica
+        assert primary
+        tenant_id, first, last = params
+        queries.append((first, last))
+        day = {**day_cache._EMPTY_DAY, "fatal_calls": 2, "avg_call_score_sum": 170, "avg_call_score_n": 2}
+        return [
+            {"date": first + timedelta(days=i), **day}
+            for i in range((last - first).days + 1)
+        ]
+
+    monkeypatch.setattr(executor, "fetch_records", fetch_records)
+    monkeypatch.setattr(day_cache, "_entries", type(day_cache._entries)())
+    monkeypatch.setattr(settings, "DAY_CACHE_SETTLE_DAYS", 1)
+    return queries
+
+
+def test_overlapping_ranges_only_compute_new_days(fake_source):
+    names = ["fatal_calls", "avg_call_score"]
+    first = asyncio.run(day_cache.aggregate(names, "mydb", "7", "2024-01-01", "2024-01-10"))
+    assert first == {"fatal_calls": 20, "avg_call_score": Decimal(85)}
+    assert fake_source == [(date(2024, 1, 1), date(2024, 1, 10))]
+
+    shifted = asyncio.run(day_cache.aggregate(names, "mydb", "7", "2024-01-03", "2024-01-12"))
+    assert shifted["fatal_calls"] == 20
+    assert fake_source[1:] == [(date(2024, 1, 11), date(2024, 1, 12))]
+
+    day_cache.invalidate("mydb", since=date(2024, 1, 5))
+    asyncio.run(day_cache.aggregate(names, "mydb", "7", "2024-01-01", "2024-01-12"))
+    assert fake_source[2:] == [(date(2024, 1, 5), date(2024, 1, 12))]
+
+
+def test_recent_days_are_never_cached(fake_source):
+    today = date.today()
+    for _ in range(2):
+        asyncio.run(day_cache.aggregate(
+            ["fatal_calls"], "mydb", "7", (today - timedelta(days=2)).isoformat(), today.isoformat()
+        ))
+    assert fake_source[1] == (today, today)
+
+
+def test_merged_partials_match_the_template_results():
+    days = [
+        {**day_cache._EMPTY_DAY, "total_duration_sum": 5400, "avg_handling_time_sum": 10.0, "avg_handling_time_n": 4},
+        day_cache._EMPTY_DAY,
+    ]
+    merged = day_cache.merge(["total_duration", "avg_handling_time", "avg_agent_skill_score", "ztp_calls"], days)
+    assert merged == {
+        "total_duration": "1 hours 30 minutes",
+        "avg_handling_time": 2.5,
+        "avg_agent_skill_score": None,
+        "ztp_calls": 0,
+    }
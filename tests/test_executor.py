@@ -0,0 +1,163 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+from core import deadline
+from core.config import settings
+from services import catalog, executor
+
+PLAN = {
+    "Node Type": "Aggregate",
+    "Total Cost": 250000.0,
+    "Plan Rows": 1,
+    "Plans": [
+        {
+            "Node Type": "Seq Scan",
+            "Schema": "chatbot",
+            "Relation Name": "call_data",
+            "Total Cost": 240000.0,
+            "Plan Rows": 5000000,
+        }
+    ],
+}
+
+
+def test_dry_run_rejects_plans_over_db_limits(monkeypatch):
+    monkeypatch.setattr(settings, "DRY_RUN_LIMITS", {"mydb": {"max_cost": 100000}})
+    with pytest.raises(executor.QueryTooExpensive) as exc:
+        executor._check_plan(PLAN, "mydb")
+    assert "chatbot.call_data" in str(exc.value)
+
+    # other databases fall back to the global (unlimited) thresholds
+    monkeypatch.setattr(settings, "DRY_RUN_MAX_COST", 0)
+    executor._check_plan(PLAN, "otherdb")
+
+
+def test_unconfigured_db_ids_share_the_default_pool(monkeypatch):
+    monkeypatch.setattr(settings, "DATABASE_URLS", {"sales": "postgresql://u:p@sales/db"})
+    assert executor._pool_key("sales") == "sales"
+    assert executor._pool_key("mydb") == executor.DEFAULT_POOL
+    assert settings.get_asyncpg_dsn("sales") == "postgresql://u:p@sales/db"
+
+
+def test_unconfigured_db_ids_use_the_default_snapshot_without_publishing(monkeypatch):
+    monkeypatch.setattr(settings, "DATABASE_URLS", {})
+    snapshot = catalog.CatalogSnapshot(
+        version="v1", schema={"tables": {}, "relationships": []},
+        column_types={"chatbot.call_data": {"tenant_id": "integer"}}, textual_columns={},
+    )
+    monkeypatch.setattr(catalog, "_snapshots", {settings.DEFAULT_DB_ID: snapshot})
+    types, _ = asyncio.run(executor._ensure_column_metadata("made-up"))
+    assert types == {"chatbot.call_data": {"tenant_id": "integer"}}
+    assert catalog.current("made-up") is None
+
+
+def test_reads_go_to_least_busy_healthy_replica(monkeypatch):
+    monkeypatch.setattr(settings, "DATABASE_URLS", {})
+    monkeypatch.setattr(settings, "READ_REPLICA_URLS", {settings.DEFAULT_DB_ID: [
+        "postgresql+asyncpg://u:p@r0/db", "postgresql://u:p@r1/db", "postgresql://u:p@r2/db",
+    ]})
+    monkeypatch.setattr(executor, "_replicas", {})
+    monkeypatch.setattr(executor, "_replica_dsns", {})
+    monkeypatch.setattr(executor, "_replica_health", {
+        "default/replica0": {"healthy": True},
+        "default/replica1": {"healthy": True},
+        "default/replica2": {"healthy": False},  # idle, but lagging
+    })
+    monkeypatch.setattr(executor, "_pool_stats", {
+        "default/replica0": {"in_use": 4, "waiting": 1},
+        "default/replica1": {"in_use": 2, "waiting": 0},
+    })
+    assert executor._route("mydb", read_only=True) == "default/replica1"
+    assert executor._route("mydb", read_only=False) == executor.DEFAULT_POOL
+    assert executor._pool_dsn("default/replica0") == "postgresql://u:p@r0/db"
+
+    for key in ("default/replica0", "default/replica1"):
+        executor._mark_replica(key, False, lag=120.0)
+    assert executor._route("mydb", read_only=True) == executor.DEFAULT_POOL
+
+
+def test_replicas_belong_to_the_pool_not_the_db_id(monkeypatch):
+    monkeypatch.setattr(settings, "DATABASE_URLS", {"sales": "postgresql://u:p@sales/db"})
+    monkeypatch.setattr(settings, "READ_REPLICA_URLS", {
+        settings.DEFAULT_DB_ID: ["postgresql://u:p@r0/db"],
+        "reporting": ["postgresql://u:p@r1/db"],   # shares the default database
+        "sales": ["postgresql://u:p@sales-r0/db"],
+    })
+    monkeypatch.setattr(executor, "_replicas", {})
+    monkeypatch.setattr(executor, "_replica_dsns", {})
+    assert executor._replica_keys(executor.DEFAULT_POOL) == ["default/replica0", "default/replica1"]
+    assert executor._pool_dsn("default/replica1") == "postgresql://u:p@r1/db"
+    assert executor._replica_keys("sales") == ["sales/replica0"]
+
+
+def test_exhausted_replica_falls_back_without_being_marked_unhealthy(monkeypatch):
+    class FullPool:
+        def get_size(self):
+            return 5
+
+        def get_max_size(self):
+            return 5
+
+        def get_idle_size(self):
+            return 0
+
+        async def release(self, conn):
+            pass
+
+    async def checkout(key):
+        if key == "default/replica0":
+            raise asyncio.TimeoutError()
+        return FullPool(), "conn"
+
+    monkeypatch.setattr(executor, "_route", lambda db_id, read_only: "default/replica0")
+    monkeypatch.setattr(executor, "_checkout", checkout)
+    monkeypatch.setattr(executor, "_replica_dsns", {"default/replica0": "postgresql://u:p@r0/db"})
+    monkeypatch.setattr(executor, "_replica_health", {"default/replica0": {"healthy": True}})
+    monkeypatch.setattr(executor, "_pools", {"default/replica0": FullPool()})
+    monkeypatch.setattr(executor, "_pool_stats", {executor.DEFAULT_POOL: {"in_use": 0}})
+
+    async def run():
+        async with executor._acquire("mydb", read_only=True) as (key, conn):
+            return key
+
+    assert asyncio.run(run()) == executor.DEFAULT_POOL
+    assert executor._replica_health["default/replica0"]["healthy"]
+
+
+def test_template_params_are_coerced_to_statement_types():
+    assert executor._coerce_param("7", "int4") == 7
+    assert executor._coerce_param("2024-01-31", "date") == date(2024, 1, 31)
+    assert executor._coerce_param("7", "text") == "7"
+    assert executor._coerce_param(None, "int4") is None
+
+
+def test_numeric_literals_quoted_only_outside_strings_and_comments():
+    metadata = (
+        {"chatbot.call_data": {"agent_id": "text", "tenant_id": "integer"}},
+        {"agent_id": frozenset({"chatbot.call_data"})},
+    )
+    sql = (
+        "SELECT * FROM chatbot.call_data c WHERE c.agent_id = 5 AND tenant_id = 7 "
+        "AND c.agent_id NOT IN (1, -2) AND note = 'agent_id = 9' -- agent_id = 9"
+    )
+    assert executor._quote_numeric_literals(sql, metadata) == (
+        "SELECT * FROM chatbot.call_data c WHERE c.agent_id = '5' AND tenant_id = 7 "
+        "AND c.agent_id NOT IN ('1', '-2') AND note = 'agent_id = 9' -- agent_id = 9"
+    )
+
+
+def test_statement_timeout_follows_request_deadline():
+    assert executor._statement_timeout_ms() == settings.STATEMENT_TIMEOUT_MS
+    token = deadline.set_deadline(2.0)
+    try:
+        assert 1000 < executor._statement_timeout_ms() <= 2000
+    finally:
+        deadline.reset(token)
+    token = deadline.set_deadline(-1)
+    try:
+        with pytest.raises(deadline.DeadlineExceeded):
+            executor._statement_timeout_ms()
+    finally:
+        deadline.reset(token)
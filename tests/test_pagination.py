@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from core.config import settings
+from services import admission, executor, pagination
+
+
+def _fake_stream(rows, closed):
+    def stream_sql(sql, db_id, enforce_limit=True, prefetch=None, params=None, statement=None):
+        assert enforce_limit is False
+
+        async def batches():
+            try:
+                for i in range(0, len(rows), prefetch):
+                    batch = rows[i:i + prefetch]
+                    yield batch
+                    if len(batch) < prefetch:
+                        break
+            finally:
+                closed.append(sql)
+        return batches()
+    return stream_sql
+
+
+def test_pages_follow_the_token_until_exhausted(monkeypatch):
+    closed = []
+    monkeypatch.setattr(executor, "stream_sql", _fake_stream([{"n": i} for i in range(7)], closed))
+    monkeypatch.setattr(pagination, "_cursors", type(pagination._cursors)())
+
+    async def run():
+        page = await pagination.first_page("SELECT n FROM t", "mydb", 3)
+        pages = [page.rows]
+        while page.next_token:
+            _, page = await pagination.next_page(page.next_token)
+            pages.append(page.rows)
+        return pages
+
+    pages = asyncio.run(run())
+    assert [[r["n"] for r in p] for p in pages] == [[0, 1, 2], [3, 4, 5], [6]]
+    assert closed == ["SELECT n FROM t"] and not pagination._cursors
+
+
+def test_cursor_keeps_the_tenant_but_not_the_slot(monkeypatch):
+    closed = []
+    monkeypatch.setattr(executor, "stream_sql", _fake_stream([{"n": i} for i in range(10)], closed))
+    monkeypatch.setattr(pagination, "_cursors", type(pagination._cursors)())
+    monkeypatch.setattr(settings, "ADMISSION_ENABLED", True)
+
+    async def run():
+        async with admission.admit("mydb/7"):
+            page = await pagination.first_page("SELECT n FROM t", "mydb", 2)
+        # the open cursor does not hold an admission slot between pages
+        assert admission._active["mydb/7"] == 0
+        assert pagination.tenant_of(page.next_token) == ("mydb/7", True)
+        assert await pagination.close(page.next_token)
+        assert pagination.tenant_of(page.next_token) is None
+
+    asyncio.run(run())
+    assert closed == ["SELECT n FROM t"] and not pagination._cursors
+
+
+def test_expired_tokens_release_their_cursor(monkeypatch):
+    closed = []
+    monkeypatch.setattr(executor, "stream_sql", _fake_stream([{"n": i} for i in range(10)], closed))
+    monkeypatch.setattr(pagination, "_cursors", type(pagination._cursors)())
+    monkeypatch.setattr(settings, "PAGINATION_TTL_SECONDS", 0)
+
+    async def run():
+        page = await pagination.first_page("SELECT n FROM t", "mydb", 2)
+        with pytest.raises(pagination.TokenExpired):
+            await pagination.next_page(page.next_token)
+
+    asyncio.run(run())
+    assert closed == ["SELECT n FROM t"]
+
+
+def test_close_waits_for_a_page_being_fetched(monkeypatch):
+    closed = []
+    release = asyncio.Event()
+    monkeypatch.setattr(pagination, "_cursors", type(pagination._cursors)())
+
+    def stream_sql(sql, db_id, enforce_limit=True, prefetch=None, params=None, statement=None):
+        async def batches():
+            try:
+                yield [{"n": 0}, {"n": 1}]
+                await release.wait()
+                yield [{"n": 2}, {"n": 3}]
+            finally:
+                closed.append(sql)
+        return batches()
+
+    monkeypatch.setattr(executor, "stream_sql", stream_sql)
+
+    async def run():
+        page = await pagination.first_page("SELECT n FROM t", "mydb", 2)
+        fetch = asyncio.create_task(pagination.next_page(page.next_token))
+        await asyncio.sleep(0)
+        closing = asyncio.create_task(pagination.close(page.next_token))
+        await asyncio.sleep(0)
+        assert not closing.done() and not closed
+        release.set()
+        _, second = await fetch
+        assert [r["n"] for r in second.rows] == [2, 3]
+        assert await closing
+
+    asyncio.run(run())
+    assert closed == ["SELECT n FROM t"] and not pagination._cursors
@@ -0,0 +1,84 @@
+import json
+import os
+
+import pytest
+
+from services import query_templates
+from services.query_templates import QueryTemplate, TemplateMatcher, match_template
+
+
+def test_templates_bind_values_instead_of_interpolating():
+    first = match_template("fatal call count for tenant 7 between 2024-01-01 and 2024-01-31")
+    second = match_template("fatal call count for tenant 9 between 2024-02-01 and 2024-02-29")
+    assert first.name == second.name == "fatal_calls"
+    # identical SQL text, so one prepared statement serves every tenant and range
+    assert first.sql == second.sql
+    assert "tenant_id = $1 and date between $2 and $3" in first.sql
+    assert first.params == ["7", "2024-01-01", "2024-01-31"]
+    assert first.missing == []
+
+
+def test_missing_values_are_reported():
+    template = match_template("avg call score")
+    assert template.missing == ["tenant_id", "from_date", "to_date"]
+
+
+def test_most_specific_template_wins_over_list_order():
+    # "duration" alone matches total_duration, which is listed first
+    assert match_template("avg handling time and duration for tenant 3").name == "avg_handling_time"
+    assert match_template("total duration for tenant 3").name == "total_duration"
+
+
+def test_matcher_finds_overlapping_keywords():
+    templates = [
+        QueryTemplate("calls", ["call"], None),
+        QueryTemplate("callbacks", ["callback", "count"], None),
+        QueryTemplate("backlog", ["back", "log"], None),
+    ]
+    matcher = TemplateMatcher(templates)
+    assert matcher.match("Callback COUNT per day").name == "callbacks"
+    assert matcher.match("callbacks in the backlog").name == "backlog"
+    assert matcher.match("nothing relevant") is None
+
+
+def _write_registry(path, text, mtime):
+    path.write_text(text if isinstance(text, str) else json.dumps({"templates": text}))
+    # explicit mtimes: coarse filesystem timestamps must not hide an edit
+    os.utime(path, (mtime, mtime))
+
+
+def test_registry_templates_hot_reload_per_db_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(query_templates, "TEMPLATE_DIR", str(tmp_path))
+    monkeypatch.setattr(query_templates, "_registries", {})
+    registry = tmp_path / "ops.json"
+    _write_registry(registry, [{
+        "name": "refunds",
+        "keywords": ["refund", "count"],
+        "sql": "select count(*) from chatbot.refunds where tenant_id = $1",
+        "params": ["tenant_id"],
+    }], 1000)
+
+    rendered = match_template("refund count for tenant 4", "ops")
+    assert (rendered.name, rendered.params, rendered.missing) == ("refunds", ["4"], [])
+    assert match_template("refund count for tenant 4", "mydb") is None
+    # built-ins stay available next to the registry
+    assert match_template("fatal call count", "ops").name == "fatal_calls"
+
+    # a broken edit keeps the previous set active
+    _write_registry(registry, '{"templates": [{"name": "half', 2000)
+    assert match_template("refund count for tenant 4", "ops").name == "refunds"
+
+    _write_registry(registry, [{
+        "name": "refunds_v2",
+        "keywords": ["refund"],
+        "sql": "select count(*) from chatbot.refunds where date between $1 and $2",
+        "params": ["from_date", "to_date"],
+    }], 3000)
+    assert match_template("refund count for tenant 4", "ops").name == "refunds_v2"
+
+
+def test_registry_rejects_placeholders_without_params():
+    with pytest.raises(query_templates.RegistryError):
+        query_templates.compile_registry({"templates": [
+            {"name": "t", "keywords": ["x"], "sql": "select $2", "params": ["tenant_id"]},
+        ]})
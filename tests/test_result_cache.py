@@ -0,0 +1,36 @@
+from datetime import date, timedelta
+
+from core.config import settings
+from services import result_cache
+
+
+def test_lookup_ignores_formatting_but_not_params_or_db(monkeypatch):
+    monkeypatch.setattr(settings, "RESULT_CACHE_MAX_ENTRIES", 2)
+    result_cache.clear()
+    sql = "select count(*) from chatbot.call_data where tenant_id = $1;"
+    result_cache.put("mydb", sql, ["7"], [{"count": 3}], ttl=60)
+
+    # identifiers and keywords are not case-folded, whitespace is ignored
+    assert result_cache.get("mydb", "SELECT  count(*)\nfrom chatbot.call_data where tenant_id = $1", ["7"]) is None
+    assert result_cache.get("mydb", "select count(*)  from chatbot.call_data\n where tenant_id = $1", ["7"]) == [{"count": 3}]
+    assert result_cache.get("mydb", sql, ["8"]) is None
+    assert result_cache.get("otherdb", sql, ["7"]) is None
+
+    # least recently used entry goes first once the cache is full
+    result_cache.put("mydb", "select 1", None, [], ttl=60)
+    result_cache.put("mydb", "select 2", None, [], ttl=60)
+    assert result_cache.get("mydb", sql, ["7"]) is None
+    assert result_cache.stats()["evictions"] == 1
+
+
+def test_finished_ranges_get_the_historical_ttl(monkeypatch):
+    monkeypatch.setattr(settings, "RESULT_CACHE_TEMPLATE_TTLS", {"fatal_calls": 300})
+    monkeypatch.setattr(settings, "DAY_CACHE_SETTLE_DAYS", 4)
+    settled = (date.today() - timedelta(days=5)).isoformat()
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    today = date.today().isoformat()
+    assert result_cache.ttl_for("fatal_calls", settled) == settings.RESULT_CACHE_HISTORICAL_TTL
+    # late rows can still land in the last few days
+    assert result_cache.ttl_for("fatal_calls", yesterday) == 300
+    assert result_cache.ttl_for("fatal_calls", today) == 300
+    assert result_cache.ttl_for(None, None) == settings.RESULT_CACHE_TTL
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from core.config import settings
+from services import query_templates, rollups
+from services.sql_lexer import tokenize
+
+
+@pytest.fixture
+def ready(monkeypatch):
+    monkeypatch.setattr(settings, "ROLLUP_ENABLED", True)
+    monkeypatch.setattr(rollups, "_ready", {"mydb": datetime.now()})
+
+
+def test_builtin_templates_read_finished_days_from_rollups(ready):
+    template = query_templates.match_template(
+        "fatal call count for tenant 7 between '2024-01-01' and '2024-01-31'"
+    )
+    sql = rollups.template_sql(template, "mydb")
+    assert "from rollup.call_data_daily\n" in sql
+    # both halves of the union list every rollup column
+    assert sql.count("call_score_sum") == 2 and sql.count("duration_sum") == 2
+    assert "date < current_date" in sql and "date >= current_date" in sql
+    assert sql.endswith("select coalesce(sum(fatal_calls), 0)::bigint as count from daily;")
+    # binds the same parameters as the raw template
+    assert {tok.text for tok in tokenize(sql) if tok.kind == "param"} == {"$1", "$2", "$3"}
+
+
+def test_every_mapped_rollup_query_matches_a_builtin_template():
+    builtin = {t.name for t in query_templates.TEMPLATES}
+    assert set(rollups.TEMPLATE_QUERIES) <= builtin
+    for table, _ in rollups.TEMPLATE_QUERIES.values():
+        assert table in rollups._by_table
+
+
+def test_raw_sql_until_ready_or_when_overridden(ready, monkeypatch):
+    template = query_templates.match_template(
+        "disposition call count for tenant 7 between '2024-01-01' and '2024-01-31'"
+    )
+    assert rollups.template_sql(template, "otherdb") is None
+    # a registry template reusing a built-in name keeps its own SQL
+    overridden = query_templates.RenderedTemplate(
+        name=template.name, sql="select 1 where $1 = $1", params=["7"], param_names=("tenant_id",)
+    )
+    assert rollups.template_sql(overridden, "mydb") is None
+    monkeypatch.setattr(settings, "ROLLUP_ENABLED", False)
+    assert rollups.template_sql(template, "mydb") is None
+
+
+def test_rollups_go_stale_without_successful_refreshes(ready, monkeypatch):
+    template = query_templates.match_template(
+        "fatal call count for tenant 7 between '2024-01-01' and '2024-01-31'"
+    )
+    monkeypatch.setattr(settings, "ROLLUP_REFRESH_INTERVAL_SECONDS", 60)
+    rollups._ready["mydb"] = datetime.now() - timedelta(seconds=150)
+    assert rollups.template_sql(template, "mydb") is not None
+    rollups._ready["mydb"] = datetime.now() - timedelta(seconds=200)
+    assert rollups.template_sql(template, "mydb") is None
+    assert rollups.metrics_sql(["fatal_calls"], "mydb") is None
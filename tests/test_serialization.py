@@ -0,0 +1,38 @@
+import gzip
+import json
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+
+from core.config import settings
+from services import serialization
+
+
+def test_fast_path_matches_jsonable_encoder():
+    row = {
+        "created_at": datetime(2024, 3, 1, 9, 30, 15, 250, tzinfo=timezone.utc),
+        "date": date(2024, 3, 1),
+        "score": Decimal("87.5"),
+        "calls": Decimal("12"),
+        "talk_time": timedelta(minutes=2),
+        "call_uuid": uuid.UUID(int=7),
+        "metadata": '{"sentiment": "pos"}',
+        "agent": "Zoë",
+        "resolved": None,
+    }
+    payload = {"sql": "SELECT 1", "results": [row, row]}
+    assert json.loads(serialization.dumps(payload)) == jsonable_encoder(payload)
+
+
+def test_large_bodies_are_compressed_when_accepted(monkeypatch):
+    monkeypatch.setattr(settings, "RESPONSE_COMPRESSION_MIN_BYTES", 100)
+    payload = {"results": [{"n": i} for i in range(200)]}
+
+    response = serialization.json_response(payload, "gzip;q=1.0, deflate")
+    assert response.headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(response.body)) == payload
+
+    assert "content-encoding" not in serialization.json_response(payload, "identity").headers
+    assert "content-encoding" not in serialization.json_response({"results": []}, "gzip").headers
@@ -0,0 +1,42 @@
+from types import MappingProxyType
+
+from services.sql_repair import repair_sql
+from services.validator import ValidationContext, validate_sql
+
+GROUNDED = {
+    "calls": {"matched_table": "chatbot.call_data", "available_columns": ["agent_name", "call_date", "duration"]},
+}
+CONTEXT = ValidationContext(
+    "test",
+    MappingProxyType({"chatbot.call_data": frozenset({"agent_name", "call_date", "duration"})}),
+    frozenset(),
+)
+
+
+def test_rules_fix_interval_schema_and_column_typos():
+    sql = "SELECT c.agnet_name, duraton FROM call_data c WHERE call_date > now() - INTERVAL 7 days"
+    fixed = repair_sql(sql, GROUNDED, CONTEXT)
+    assert fixed == (
+        "SELECT c.agent_name, duration FROM chatbot.call_data c "
+        "WHERE call_date > now() - INTERVAL '7 days'"
+    )
+    ok, msg, _ = validate_sql(fixed, GROUNDED, [], CONTEXT)
+    assert ok, msg
+
+
+def test_ambiguous_or_distant_names_are_left_alone():
+    # 'xyz' is too far from every column; valid SQL needs no rewrite
+    assert repair_sql("SELECT xyz FROM chatbot.call_data", GROUNDED, CONTEXT) is None
+    assert repair_sql("SELECT duration FROM chatbot.call_data", GROUNDED, CONTEXT) is None
+
+
+def test_short_names_need_a_closer_match():
+    context = ValidationContext(
+        "test", MappingProxyType({"chatbot.call_data": frozenset({"id", "call_date", "duration"})}), frozenset()
+    )
+    # 'dt' is two edits from 'id' but more likely an alias or a made-up column
+    assert repair_sql("SELECT dt FROM chatbot.call_data", GROUNDED, context) is None
+    # up to 8 characters one edit is still repaired
+    assert repair_sql("SELECT duraton FROM chatbot.call_data", GROUNDED, context) == (
+        "SELECT duration FROM chatbot.call_data"
+    )
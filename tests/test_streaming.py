@@ -0,0 +1,36 @@
+import asyncio
+import json
+from datetime import date
+from decimal import Decimal
+
+from services import streaming
+
+
+async def _batches(*batches, fail=None):
+    for batch in batches:
+        yield batch
+    if fail:
+        raise RuntimeError(fail)
+
+
+async def _collect(chunks):
+    return "".join([chunk async for chunk in chunks])
+
+
+def test_json_document_matches_query_response_shape():
+    body = asyncio.run(_collect(streaming.json_document(
+        "SELECT 1", _batches([{"d": date(2024, 1, 2), "n": Decimal("1.5")}], [{"d": None, "n": 2}])
+    )))
+    assert json.loads(body) == {
+        "sql": "SELECT 1",
+        "results": [{"d": "2024-01-02", "n": 1.5}, {"d": None, "n": 2}],
+        "error": None,
+    }
+
+
+def test_mid_stream_failures_are_reported_in_band():
+    body = asyncio.run(_collect(streaming.json_document("SELECT 1", _batches([{"a": 1}], fail="boom"))))
+    assert json.loads(body) == {"sql": "SELECT 1", "results": [{"a": 1}], "error": "boom"}
+
+    lines = asyncio.run(_collect(streaming.ndjson_rows(_batches([{"a": 1}, {"a": 2}], fail="boom")))).splitlines()
+    assert [json.loads(line) for line in lines] == [{"a": 1}, {"a": 2}, {"error": "boom"}]
@@ -0,0 +1,135 @@
+import asyncio
+import os
+from datetime import date
+
+import pytest
+
+from core.config import settings
+from services import executor, query_templates, template_promotion
+
+
+@pytest.fixture
+def registry_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(query_templates, "TEMPLATE_DIR", str(tmp_path / "templates"))
+    monkeypatch.setattr(query_templates, "_registries", {})
+    monkeypatch.setattr(template_promotion, "LOG_DIR", str(tmp_path / "log"))
+    monkeypatch.setattr(template_promotion, "_shapes", {})
+    monkeypatch.setattr(template_promotion, "_loaded", set())
+    monkeypatch.setattr(settings, "PROMOTION_ENABLED", True)
+    monkeypatch.setattr(settings, "PROMOTION_MIN_OCCURRENCES", 3)
+    monkeypatch.setattr(settings, "PROMOTION_MIN_DISTINCT_VALUES", 2)
+    monkeypatch.setattr(settings, "PROMOTION_REQUIRE_REVIEW", False)
+    return tmp_path
+
+
+def _answer(tenant, start, end):
+    question = f"How many refunds for tenant {tenant} between '{start}' and '{end}'?"
+    sql = (f"SELECT COUNT(*) FROM chatbot.refunds WHERE tenant_id = {tenant} "
+           f"AND date BETWEEN '{start}' AND '{end}' AND amount > 100")
+    return question, sql
+
+
+def test_slot_values_become_placeholders():
+    question, sql = _answer(7, "2024-01-01", "2024-01-31")
+    shaped, slots, values = template_promotion.abstract_sql(sql, question)
+    assert shaped.startswith(
+        "SELECT COUNT(*) FROM chatbot.refunds WHERE tenant_id = $1 AND date BETWEEN $2 AND $3 AND amount > 100"
+    )
+    assert slots == ("tenant_id", "from_date", "to_date")
+    assert values == ("7", "2024-01-01", "2024-01-31")
+    # a date hardcoded in another form would make the template wrong for other ranges
+    assert template_promotion.abstract_sql(sql.replace("'2024-01-31'", "'2024-01-31 23:59'"), question) is None
+
+
+def test_only_predicate_values_become_placeholders():
+    question = "top refunds for tenant 5 between '2024-01-01' and '2024-01-31'"
+    where = "WHERE tenant_id = 5 AND date BETWEEN '2024-01-01' AND '2024-01-31'"
+    # the tenant id doubling as a LIMIT or an ordinal would be parameterized too
+    assert template_promotion.abstract_sql(f"SELECT * FROM chatbot.refunds {where} LIMIT 5", question) is None
+    assert template_promotion.abstract_sql(
+        f"SELECT agent, amount FROM chatbot.refunds {where} ORDER BY 2", "top refunds for tenant 2"
+    ) is None
+    # a value compared twice is ambiguous as well
+    assert template_promotion.abstract_sql(
+        f"SELECT COUNT(*) FROM chatbot.refunds {where} AND amount > 5", question
+    ) is None
+    shaped, slots, _ = template_promotion.abstract_sql(f"SELECT * FROM chatbot.refunds {where} LIMIT 10", question)
+    assert "tenant_id = $1 AND date BETWEEN $2 AND $3 LIMIT 10" in shaped
+    assert slots == ("tenant_id", "from_date", "to_date")
+
+
+def test_recurring_shape_is_promoted_then_demoted(registry_dir, monkeypatch):
+    monkeypatch.setattr(settings, "PROMOTION_DEMOTE_AFTER_FAILURES", 1)
+    for tenant, start, end in [(7, "2024-01-01", "2024-01-31"), (7, "2024-02-01", "2024-02-29")]:
+        asyncio.run(template_promotion.record("ops", *_answer(tenant, start, end)))
+    assert template_promotion.list_promoted("ops") == []
+
+    asyncio.run(template_promotion.record("ops", *_answer(9, "2024-03-01", "2024-03-31")))
+    [entry] = template_promotion.list_promoted("ops")
+    assert entry["status"] == "active"
+
+    rendered = query_templates.match_template(
+        "how many refunds for tenant 12 between '2023-05-01' and '2023-05-31'", "ops"
+    )
+    assert rendered.name == entry["name"]
+    assert rendered.params == ["12", "2023-05-01", "2023-05-31"]
+    # same keywords, different shape: not this template
+    assert query_templates.match_template("how many refunds for tenant 12 by agent", "ops") is None
+
+    asyncio.run(template_promotion.record_template_result("ops", entry["name"], False))
+    assert template_promotion.list_promoted("ops")[0]["status"] == "demoted"
+    assert query_templates.match_template(
+        "how many refunds for tenant 12 between '2023-05-01' and '2023-05-31'", "ops"
+    ) is None
+
+
+def test_db_id_never_leaves_the_data_directories(registry_dir):
+    (registry_dir / "evil.json").write_text('{"templates": [{"name": "x", "keywords": ["refunds"], "sql": "select 1"}]}')
+    asyncio.run(template_promotion.record("../evil", *_answer(7, "2024-01-01", "2024-01-31")))
+    assert not (registry_dir / "evil.jsonl").exists() and not (registry_dir / "log").exists()
+    assert query_templates.match_template("refunds", "../evil") is None
+    assert template_promotion.list_promoted("../evil") == []
+    assert not asyncio.run(template_promotion.approve("../evil", "x"))
+
+
+def test_query_log_is_rotated_and_both_generations_replayed(registry_dir, monkeypatch):
+    monkeypatch.setattr(settings, "PROMOTION_LOG_MAX_BYTES", 1)
+    for tenant in (7, 8):
+        asyncio.run(template_promotion.record("ops", *_answer(tenant, "2024-01-01", "2024-01-31")))
+    path = template_promotion._log_path("ops")
+    assert os.path.exists(f"{path}.1") and os.path.exists(path)
+
+    monkeypatch.setattr(template_promotion, "_shapes", {})
+    monkeypatch.setattr(template_promotion, "_loaded", set())
+    template_promotion._replay_log("ops")
+    [by_sql] = template_promotion._shapes["ops"].values()
+    assert [shape.count for shape in by_sql.values()] == [2]
+
+
+def test_promoted_numeric_slot_binds_to_the_column_type(registry_dir):
+    # the LLM answers tenant_id = 7 or, for a text column, tenant_id = '7'
+    # (_quote_numeric_literals); both forms are the same shape
+    for tenant, start, end in [(7, "2024-01-01", "2024-01-31"), (8, "2024-02-01", "2024-02-29")]:
+        asyncio.run(template_promotion.record("ops", *_answer(tenant, start, end)))
+    question, sql = _answer(9, "2024-03-01", "2024-03-31")
+    asyncio.run(template_promotion.record("ops", question, sql.replace("= 9", "= '9'")))
+    [entry] = template_promotion.list_promoted("ops")
+    assert entry["status"] == "active" and "tenant_id = $1" in entry["sql"]
+
+    # prepared templates skip _quote_numeric_literals: the bound value follows
+    # the type Postgres infers for $1 instead
+    rendered = query_templates.match_template(
+        "how many refunds for tenant 12 between '2023-05-01' and '2023-05-31'", "ops"
+    )
+
+    class Stmt:
+        def __init__(self, *types):
+            self.types = types
+
+        def get_parameters(self):
+            return [type("Type", (), {"name": t}) for t in self.types]
+
+    text_bound = executor._bind(Stmt("varchar", "date", "date"), rendered.params)
+    int_bound = executor._bind(Stmt("int4", "date", "date"), rendered.params)
+    assert text_bound[0] == "12" and int_bound[0] == 12
+    assert text_bound[1:] == int_bound[1:] == [date(2023, 5, 1), date(2023, 5, 31)]
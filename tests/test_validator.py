@@ -0,0 +1,109 @@
+from services.validator import validate_sql
+
+GROUNDED = {
+    "users": {"matched_table": "users", "available_columns": ["id", "name", "city"]},
+    "orders": {"matched_table": "orders", "available_columns": ["id", "user_id", "total", "created_at"]},
+    "calls": {"matched_table": "chatbot.call_data", "available_columns": ["tenant_id", "date", "scoring_parameters"]},
+}
+RELATIONSHIPS = [{"from_table": "orders", "from_column": "user_id", "to_table": "users", "to_column": "id"}]
+
+
+def _validate(sql):
+    return validate_sql(sql, GROUNDED, RELATIONSHIPS)
+
+
+def test_aliased_join_on_fk_is_valid():
+    ok, msg, _ = _validate(
+        "SELECT DISTINCT u.name FROM users u JOIN orders o ON o.user_id = u.id WHERE o.total > 1000"
+    )
+    assert ok, msg
+
+
+def test_alias_column_is_resolved():
+    ok, msg, _ = _validate("SELECT u.nam FROM users u")
+    assert not ok
+    assert "nam" in msg and "users" in msg
+
+
+def test_alias_join_must_follow_fk():
+    ok, msg, _ = _validate("SELECT u.name FROM users u JOIN orders o ON o.id = u.id")
+    assert not ok
+    assert msg.startswith("Invalid join")
+
+
+def test_unqualified_column_checked():
+    ok, _, _ = _validate("SELECT name, total FROM users u JOIN orders o ON o.user_id = u.id")
+    assert ok
+    ok, msg, _ = _validate("SELECT nme FROM users")
+    assert not ok and "nme" in msg
+
+
+def test_unknown_alias_rejected():
+    ok, msg, _ = _validate("SELECT x.name FROM users u")
+    assert not ok and "'x'" in msg
+
+
+def test_cte_and_output_aliases_are_not_columns():
+    ok, msg, _ = _validate(
+        "WITH big AS (SELECT o.user_id, SUM(o.total) AS s FROM orders o GROUP BY o.user_id) "
+        "SELECT u.name, b.s, count(*) cnt FROM users u JOIN big b ON b.user_id = u.id "
+        "GROUP BY u.name, b.s ORDER BY cnt DESC"
+    )
+    assert ok, msg
+
+
+def test_named_windows_are_not_columns():
+    ok, msg, _ = _validate(
+        "SELECT o.id, rank() OVER w AS r, sum(o.total) OVER w2 FROM orders o "
+        "WINDOW w AS (PARTITION BY o.user_id ORDER BY o.total DESC), w2 AS (ORDER BY created_at)"
+    )
+    assert ok, msg
+    # the window definition's columns are still checked
+    ok, msg, _ = _validate("SELECT rank() OVER w FROM orders WINDOW w AS (ORDER BY totl)")
+    assert not ok and "totl" in msg
+
+
+def test_function_relation_and_schema_qualified_table():
+    ok, msg, _ = _validate(
+        "select count(*) as call_count from chatbot.call_data where tenant_id = 5 "
+        "and exists (select 1 from jsonb_array_elements(scoring_parameters) as sp where sp->>'name' = 'x')"
+    )
+    assert ok, msg
+
+
+def test_keywords_inside_strings_are_ignored():
+    ok, msg, _ = _validate("SELECT u.name FROM users u WHERE u.city ILIKE '%delete%'")
+    assert ok, msg
+    ok, msg, _ = _validate("DELETE FROM users")
+    assert not ok and msg == "Destructive SQL not allowed"
+
+
+def test_array_constructor_is_not_a_column():
+    ok, msg, _ = _validate("SELECT name FROM users WHERE city = ANY(ARRAY['Pune', 'Delhi'])")
+    assert ok, msg
+    ok, msg, _ = _validate("SELECT name FROM users WHERE city = ANY(ARRAY[citi])")
+    assert not ok and "citi" in msg
+
+
+def test_unquoted_interval_rejected():
+    ok, msg, _ = _validate("SELECT o.id FROM orders o WHERE o.created_at > now() - INTERVAL 7 days")
+    assert not ok and "INTERVAL" in msg
+
+
+def test_compiled_context_is_reused_per_version():
+    from services import validator
+
+    schema = {
+        "tables": {t["matched_table"]: t["available_columns"] for t in GROUNDED.values()},
+        "relationships": RELATIONSHIPS,
+    }
+    ctx = validator.get_context("test_db", schema, "v1")
+    assert validator.get_context("test_db", schema, "v1") is ctx
+    assert validator.get_context("test_db", schema, "v2") is not ctx
+
+    ok, msg, _ = validate_sql(
+        "SELECT u.name FROM users u JOIN orders o ON o.user_id = u.id", GROUNDED, [], ctx
+    )
+    assert ok, msg
+    sliced = ctx.slice({"users": GROUNDED["users"]})
+    assert set(sliced.table_cols) == {"users"}
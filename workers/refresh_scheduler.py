@@ -4,147 +4,224 @@ import os
 import json
 import asyncpg
 from core.config import settings
+from services import catalog, result_cache, rollups, day_cache
 from services.grounding import load_schema, regenerate_embeddings
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "schemas")
 os.makedirs(DATA_DIR, exist_ok=True)
 
-async def introspect_db(db_dsn: str):
-    """Return schema dict: {tables: {table:[cols]}, relationships: [...] }"""
+async def introspect_catalog(db_dsn: str) -> catalog.CatalogSnapshot:
+    """Full catalog snapshot: tables, columns, data types and FKs."""
     conn = await asyncpg.connect(dsn=db_dsn)
     try:
-        # Get list of schemas to check
-        schemas_to_check = []
-        if settings.DATABASE_SCHEMAS:
-            # Use configured schemas
-            schemas_to_check = [s.strip() for s in settings.DATABASE_SCHEMAS.split(',') if s.strip()]
-        else:
-            # If not configured, get all non-system schemas
-            schema_rows = await conn.fetch("""
-                SELECT schema_name 
-                FROM information_schema.schemata 
-                WHERE schema_name NOT IN ('pg_catalog', 'information_schema', 'pg_toast')
-                ORDER BY schema_name
-            """)
-            schemas_to_check = [r['schema_name'] for r in schema_rows]
-        
-        if not schemas_to_check:
-            return {"tables": {}, "relationships": []}
-        
-        # Build SQL with schema list
-        schema_placeholders = ','.join([f"${i+1}" for i in range(len(schemas_to_check))])
-        
-        INTROSPECT_TABLES_SQL = f"""
-        SELECT table_schema, table_name
-        FROM information_schema.tables
-        WHERE table_schema IN ({schema_placeholders}) AND table_type='BASE TABLE'
-        ORDER BY table_schema, table_name;
-        """
-        
-        tables = {}
-        rows = await conn.fetch(INTROSPECT_TABLES_SQL, *schemas_to_check)
-        
-        for row in rows:
-            schema_name = row['table_schema']
-            table_name = row['table_name']
-            # Use schema.table format for table names to avoid conflicts
-            full_table_name = f"{schema_name}.{table_name}" if schema_name != 'public' else table_name
-            
-            # Get columns for this table
-            INTROSPECT_COLUMNS_SQL = """
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_schema = $1 AND table_name = $2
-            ORDER BY ordinal_position;
-            """
-            cols = await conn.fetch(INTROSPECT_COLUMNS_SQL, row['table_schema'], table_name)
-            tables[full_table_name] = [c['column_name'] for c in cols]
-
-        # Get foreign keys from all schemas
-        # Use same placeholders for both schema checks
-        INTROSPECT_FKS_SQL = f"""
-        SELECT
-          tc.table_schema AS from_schema,
-          tc.table_name AS from_table,
-          kcu.column_name AS from_column,
-          ccu.table_schema AS to_schema,
-          ccu.table_name AS to_table,
-          ccu.column_name AS to_column,
-          tc.constraint_name
-        FROM
-          information_schema.table_constraints AS tc
-        JOIN information_schema.key_column_usage AS kcu
-          ON tc.constraint_name = kcu.constraint_name AND tc.table_schema = kcu.table_schema
-        JOIN information_schema.constraint_column_usage AS ccu
-          ON ccu.constraint_name = tc.constraint_name AND ccu.table_schema = tc.table_schema
-        WHERE tc.constraint_type = 'FOREIGN KEY' 
-          AND tc.table_schema IN ({schema_placeholders});
-        """
-        
-        fk_rows = await conn.fetch(INTROSPECT_FKS_SQL, *schemas_to_check)
-        relationships = []
-        for r in fk_rows:
-            from_table = f"{r['from_schema']}.{r['from_table']}" if r['from_schema'] != 'public' else r['from_table']
-            to_table = f"{r['to_schema']}.{r['to_table']}" if r['to_schema'] != 'public' else r['to_table']
-            relationships.append({
-                "from_table": from_table,
-                "from_column": r['from_column'],
-                "to_table": to_table,
-                "to_column": r['to_column'],
-                "constraint_name": r['constraint_name']
-            })
-
-        return {"tables": tables, "relationships": relationships}
+        return await catalog.introspect(conn)
     finally:
         await conn.close()
 
+async def introspect_db(db_dsn: str):
+    """Return schema dict: {tables: {table:[cols]}, relationships: [...] }"""
+    snapshot = await introspect_catalog(db_dsn)
+    return snapshot.schema
+
 async def write_schema_file(db_id: str, schema: dict):
     path = os.path.join(DATA_DIR, f"{db_id}_schema.json")
     with open(path, "w", encoding="utf-8") as f:
         json.dump(schema, f, indent=2)
 
+# dead LISTEN connections are detected by a ping after this much silence
+LISTEN_PING_SECONDS = 30
+LISTEN_RETRY_SECONDS = 5
+
+_refresh_stats = {
+    "checks": 0, "unchanged": 0, "introspections": 0, "fingerprint_errors": 0,
+    "events": 0, "event_refreshes": 0, "listener_reconnects": 0,
+}
+# db_id -> last published catalog, shared by the poll loop and the event listener
+_state: dict = {}
+_refresh_lock = asyncio.Lock()
+
+def _databases() -> dict:
+    """db_id -> primary DSN for every configured database (a lagging replica would publish a stale catalog)."""
+    return {db_id: settings.get_asyncpg_dsn(db_id) for db_id in settings.database_ids()}
+
+def _db_state(db_id: str) -> dict:
+    return _state.setdefault(db_id, {"version": None, "fingerprint": None})
+
+async def check_catalog(db_dsn: str, last_fingerprint: str | None, db_id: str | None = None):
+    """
+    (fingerprint, snapshot): the snapshot is None when the cheap fingerprint
+    matches last_fingerprint, so the full introspection is skipped. If the
+    fingerprint query fails we introspect anyway (fingerprint None).
+    """
+    conn = await asyncpg.connect(dsn=db_dsn)
+    try:
+        _refresh_stats["checks"] += 1
+        try:
+            current = await catalog.fingerprint(conn)
+        except Exception as e:
+            print(f"Warning: Schema fingerprint failed, running full introspection: {e}")
+            _refresh_stats["fingerprint_errors"] += 1
+            current = None
+        if current is not None and current == last_fingerprint:
+            _refresh_stats["unchanged"] += 1
+            return current, None
+        _refresh_stats["introspections"] += 1
+        return current, await catalog.introspect(conn, db_id)
+    finally:
+        await conn.close()
+
+async def _publish(db_id: str, snapshot: catalog.CatalogSnapshot, fingerprint: str | None):
+    state = _db_state(db_id)
+    # Only update if schema has changed
+    if snapshot.version != state["version"]:
+        catalog.publish(db_id, snapshot)
+        await write_schema_file(db_id, snapshot.schema)
+        # Regenerate embeddings when schema changes
+        regenerate_embeddings(db_id, snapshot.schema)
+        if state["version"] is not None:
+            result_cache.clear(db_id)
+            day_cache.invalidate(db_id)
+        state["version"] = snapshot.version
+    state["fingerprint"] = fingerprint
+
 async def background_refresh():
     """
-    Background task that automatically refreshes schema and embeddings periodically.
-    Runs once at startup, then every REFRESH_INTERVAL_SECONDS.
+    Background task that automatically refreshes schema and embeddings periodically,
+    for DEFAULT_DB_ID and every DATABASE_URLS entry.
+    Runs once at startup, then every REFRESH_INTERVAL_SECONDS (or the slower
+    SCHEMA_EVENTS_POLL_INTERVAL_SECONDS when DDL events are pushed). Each pass
+    first compares a cheap catalog fingerprint; only when it changed is the
+    catalog introspected and the snapshot published. Files, embeddings and
+    cached results are only rebuilt when the snapshot version changes.
     """
-    db_id = 'mydb'
-    dsn = settings.get_asyncpg_dsn()
-    last_schema_hash = None
-    
-    def _schema_hash(schema: dict) -> str:
-        """Generate a simple hash of schema to detect changes"""
-        import hashlib
-        schema_str = json.dumps(schema, sort_keys=True)
-        return hashlib.md5(schema_str.encode()).hexdigest()
-    
+    interval = (
+        settings.SCHEMA_EVENTS_POLL_INTERVAL_SECONDS if settings.SCHEMA_EVENTS_ENABLED
+        else settings.REFRESH_INTERVAL_SECONDS
+    )
+
     # Try once at startup and then periodically
-    try:
-        schema = await introspect_db(dsn)
-        await write_schema_file(db_id, schema)
-        # Regenerate embeddings on startup
-        regenerate_embeddings(db_id, schema)
-        last_schema_hash = _schema_hash(schema)
-    except Exception as e:
-        # If introspect fails, we leave any existing schema in place
-        print(f"Warning: Initial schema refresh failed: {e}")
+    first = True
+    while True:
+        for db_id, dsn in _databases().items():
+            try:
+                async with _refresh_lock:
+                    fingerprint, snapshot = await check_catalog(dsn, _db_state(db_id)["fingerprint"], db_id)
+                    if snapshot is not None:
+                        await _publish(db_id, snapshot, fingerprint)
+            except Exception as e:
+                # If introspect fails, we leave any existing schema in place
+                # and try again at the next interval
+                print(f"Warning: {'Initial schema' if first else 'Schema'} refresh failed for '{db_id}': {e}")
+        first = False
+        await asyncio.sleep(interval)
+
+async def _apply_schema_events(dsn: str, db_id: str, changed: set):
+    """Refresh after pushed DDL events: only the touched schemas when possible."""
+    async with _refresh_lock:
+        if None in changed:
+            # e.g. CREATE SCHEMA: no schema name in the event
+            fingerprint, snapshot = await check_catalog(dsn, _db_state(db_id)["fingerprint"], db_id)
+        else:
+            conn = await asyncpg.connect(dsn=dsn)
+            try:
+                snapshot = await catalog.introspect_schemas(conn, db_id, changed)
+                fingerprint = await catalog.fingerprint(conn)
+            finally:
+                await conn.close()
+        if snapshot is None:
+            return
+        _refresh_stats["event_refreshes"] += 1
+        await _publish(db_id, snapshot, fingerprint)
+        print(f"Schema of '{db_id}' refreshed after DDL in {', '.join(sorted(s or '?' for s in changed))}")
+
+async def schema_event_listener():
+    """
+    Push-based change detection (SCHEMA_EVENTS_ENABLED): installs the DDL
+    event triggers (SCHEMA_EVENTS_INSTALL), holds a dedicated LISTEN
+    connection per configured database and, SCHEMA_EVENTS_DEBOUNCE_SECONDS
+    after a burst of notifications, refreshes only the schemas they name. The
+    poll loop keeps running slowly as a safety net (missed notifications,
+    reconnects).
+    """
+    await asyncio.gather(*(_listen(db_id, dsn) for db_id, dsn in _databases().items()))
+
+async def _listen(db_id: str, dsn: str):
+    channel = settings.SCHEMA_EVENTS_CHANNEL
+    changed: set = set()
+    wake = asyncio.Event()
 
+    def on_notify(conn, pid, channel, payload):
+        try:
+            changed.add(json.loads(payload).get("schema"))
+        except (ValueError, AttributeError):
+            changed.add(None)
+        _refresh_stats["events"] += 1
+        wake.set()
+
+    installed = False
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(dsn=dsn)
+            if settings.SCHEMA_EVENTS_INSTALL and not installed:
+                try:
+                    await catalog.install_event_triggers(conn, channel)
+                    print(f"Installed schema event triggers on '{db_id}' notifying '{channel}'")
+                except Exception as e:
+                    print(f"Warning: Could not install schema event triggers on '{db_id}' (superuser required?): {e}")
+                installed = True
+            await conn.add_listener(channel, on_notify)
+            # DDL while we were not listening is picked up by the fingerprint
+            changed.add(None)
+            wake.set()
+            while True:
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout=LISTEN_PING_SECONDS)
+                except asyncio.TimeoutError:
+                    # a dead LISTEN connection fails here and is reopened
+                    await conn.execute("SELECT 1")
+                    continue
+                # debounce: let the rest of a migration's DDL arrive first
+                await asyncio.sleep(settings.SCHEMA_EVENTS_DEBOUNCE_SECONDS)
+                wake.clear()
+                batch = set(changed)
+                changed.clear()
+                try:
+                    await _apply_schema_events(dsn, db_id, batch)
+                except Exception as e:
+                    print(f"Warning: Schema refresh of '{db_id}' after DDL events failed: {e}")
+        except Exception as e:
+            print(f"Warning: Schema event listener for '{db_id}' disconnected: {e}")
+            _refresh_stats["listener_reconnects"] += 1
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(LISTEN_RETRY_SECONDS)
+
+def stats() -> dict:
+    return {**_refresh_stats, "push": settings.SCHEMA_EVENTS_ENABLED}
+
+async def rollup_refresh():
+    """
+    Keeps the call_data rollups current: backfills on the first pass, then
+    recomputes the last ROLLUP_LOOKBACK_DAYS days every
+    ROLLUP_REFRESH_INTERVAL_SECONDS. Templates fall back to the raw table
+    until the first pass succeeds.
+    """
+    db_id = settings.DEFAULT_DB_ID
+    # writes: always the primary
+    dsn = settings.get_asyncpg_dsn()
     while True:
-        await asyncio.sleep(settings.REFRESH_INTERVAL_SECONDS)
         try:
-            schema = await introspect_db(dsn)
-            current_hash = _schema_hash(schema)
-            
-            # Only update if schema has changed
-            if current_hash != last_schema_hash:
-                await write_schema_file(db_id, schema)
-                # Regenerate embeddings when schema changes
-                regenerate_embeddings(db_id, schema)
-                last_schema_hash = current_hash
+            conn = await asyncpg.connect(dsn=dsn)
+            try:
+                rows = await rollups.refresh(conn, db_id)
+            finally:
+                await conn.close()
+            print(f"Rollups refreshed for '{db_id}': {rows} rows rewritten")
         except Exception as e:
-            # failed refresh — skip until next interval
-            print(f"Warning: Schema refresh failed: {e}")
-            continue
+            print(f"Warning: Rollup refresh failed: {e}")
+        await asyncio.sleep(settings.ROLLUP_REFRESH_INTERVAL_SECONDS)
 
 async def refresh_once(db_id: str = 'mydb'):
     """Run a single schema refresh (useful for manual updates)"""